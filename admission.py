@@ -0,0 +1,197 @@
+# admission.py
+# Admission control for chat turns: a bounded number of bot calls in flight,
+# a short wait queue in front of them, and token-bucket rate limits per client,
+# per conversation and per tenant. Overload is reported straight away (503/429
+# with Retry-After) instead of piling up threads that sleep in retry backoff.
+#
+# Waiting turns are queued per tenant and freed slots go to the tenants in
+# turn, so one busy tenant can't take every upstream slot from the others.
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import config
+
+
+class Rejected(Exception):
+    """A chat turn was refused; status is the HTTP status to answer with"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self):
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class AdmissionController:
+    """
+    At most max_inflight admitted turns; up to max_queue more wait (at most
+    tenant_queue of them for one tenant), each for at most queue_timeout
+    seconds. FIFO within a tenant, round-robin across tenants. Used from the
+    event loop only.
+    """
+
+    def __init__(self, max_inflight=config.MAX_INFLIGHT_CHATS, max_queue=config.ADMISSION_QUEUE_SIZE,
+                 queue_timeout=config.ADMISSION_QUEUE_TIMEOUT, tenant_queue=None):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tenant_queue = config.TENANT_QUEUE_SIZE if tenant_queue is None else tenant_queue
+        self.inflight = 0
+        # tenant -> waiting futures; the tenant served next is first
+        self._waiters = OrderedDict()
+        self._queued = 0
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    @asynccontextmanager
+    async def admit(self, tenant=None):
+        """Hold an in-flight slot for the body of the with block, or raise Rejected"""
+        await self._acquire(tenant)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, tenant=None):
+        if self.inflight < self.max_inflight and not self._queued:
+            self.inflight += 1
+            self.stats['admitted'] += 1
+            return
+
+        queue = self._waiters.get(tenant)
+        if self._queued >= self.max_queue or (queue and self.tenant_queue and len(queue) >= self.tenant_queue):
+            self.stats['rejected'] += 1
+            raise Rejected(503, "Server is busy, please try again shortly", self.queue_timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._waiters[tenant] = deque()
+        queue.append(waiter)
+        self._queued += 1
+        self.stats['queued'] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # The slot was handed over just as the wait ran out: keep it
+                self.stats['admitted'] += 1
+                return
+            self._remove(tenant, waiter)
+            waiter.cancel()
+            self.stats['timed_out'] += 1
+            raise Rejected(503, "Server is busy, please try again shortly", self.queue_timeout)
+        except BaseException:
+            # Caller went away while queued; pass on a slot it may have been given
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                self._remove(tenant, waiter)
+            raise
+        self.stats['admitted'] += 1
+
+    def _remove(self, tenant, waiter):
+        queue = self._waiters.get(tenant)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[tenant]
+
+    def _release(self):
+        # Hand the slot straight to the next tenant's oldest waiter, so inflight stays counted
+        while self._waiters:
+            tenant, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(tenant)
+            else:
+                del self._waiters[tenant]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+
+class RateLimiter:
+    """Token buckets keyed by an arbitrary string: rate tokens per second, up to burst"""
+
+    def __init__(self, rate, burst, idle_ttl=600):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self._buckets = {}
+        self._last_prune = time.monotonic()
+
+    def hit(self, key, now=None):
+        """Take one token for key; returns 0 if allowed, else seconds until the next token"""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic() if now is None else now
+        self._prune(now)
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+    def _prune(self, now):
+        if now - self._last_prune < self.idle_ttl:
+            return
+        self._last_prune = now
+        # An idle bucket is full again, so forgetting it changes nothing
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > self.idle_ttl]
+        for key in stale:
+            del self._buckets[key]
+
+
+class ChatAdmission:
+    """The rate limits and in-flight limit that every chat turn goes through"""
+
+    def __init__(self):
+        self.controller = AdmissionController()
+        self.per_client = RateLimiter(config.RATE_LIMIT_CLIENT_PER_MIN / 60, config.RATE_LIMIT_CLIENT_BURST)
+        self.per_conversation = RateLimiter(config.RATE_LIMIT_CONVERSATION_PER_MIN / 60,
+                                            config.RATE_LIMIT_CONVERSATION_BURST)
+        self.per_tenant = RateLimiter(config.RATE_LIMIT_TENANT_PER_MIN / 60, config.RATE_LIMIT_TENANT_BURST)
+
+    def check_rate(self, client, conversation_id, tenant=None):
+        """Raise Rejected (429) if client (None: not checked), conversation or tenant is over its rate limit"""
+        wait = self.per_client.hit(client) if client is not None else 0
+        wait = wait or self.per_conversation.hit(conversation_id)
+        if not wait and tenant is not None:
+            wait = self.per_tenant.hit(tenant)
+        self._reject_if(wait)
+
+    def check_client(self, client):
+        """Raise Rejected (429) if client is over its rate limit; a batch takes one token for all its items"""
+        self._reject_if(self.per_client.hit(client))
+
+    def _reject_if(self, wait):
+        if wait:
+            self.controller.stats['rejected'] += 1
+            raise Rejected(429, "Too many messages, please slow down", wait)
+
+    @asynccontextmanager
+    async def turn(self, client, conversation_id, tenant=None):
+        """Rate-limit, then hold an in-flight slot for one chat turn"""
+        self.check_rate(client, conversation_id, tenant)
+        async with self.controller.admit(tenant):
+            yield
+
+
+chat_admission = ChatAdmission()
+
+
+def client_key(connection):
+    """Rate-limit key for a request or websocket: the caller's address"""
+    # Behind a proxy, run gunicorn with --forwarded-allow-ips so this is the real client
+    return connection.client.host if connection.client else "unknown"
@@ -0,0 +1,486 @@
+# affinity_router.py
+# Front router for running the bot on several nodes. Each conversation lives
+# on one node (its history, lock, rate limit and human-transfer flag are in
+# that node's memory), so the router sends every request for a conversation
+# to the same node, picked by consistent hashing:
+#
+#   ROUTER_NODES=http://10.0.0.5:8000,http://10.0.0.6:8000 ADMIN_TOKEN=... \
+#       uvicorn affinity_router:app --host 0.0.0.0 --port 8080
+#
+# Each node is placed on a hash ring ROUTER_VNODES times, so conversations
+# spread evenly and a node joining or leaving moves only its share of them
+# (about 1/N). Requests are proxied over one pooled, keep-alive connection
+# pool per router process.
+#
+# Adding or removing a node (POST /router/nodes) hands the moving
+# conversations over before the ring changes: requests for conversations
+# whose owner changes are held, running ones are waited for, their history
+# and flags are exported from the old owner and imported into the new one
+# through the nodes' /internal/handoff endpoints, the ring is swapped, and
+# the old owner forgets them. Every other conversation keeps flowing.
+#
+# Routing keys match the bot's conversation keys: the conversation id, or
+# "<tenant>:<conversation_id>" when X-Tenant-ID (or ?tenant=) names another
+# tenant; behind the router, tenants must be chosen that way, not by Host. The
+# WebSocket widget (/ws) is not proxied; serve it from a node directly.
+#
+#   python affinity_router.py    # how many conversations move as nodes come and go
+
+import argparse
+import asyncio
+import hmac
+import itertools
+import logging
+import time
+from bisect import bisect
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from hashlib import blake2b
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+import batch
+import config
+from serialization import FastJSONResponse, InvalidBody, dumps, loads
+from tenants import DEFAULT_TENANT, TENANT_HEADER, conversation_key
+
+logger = logging.getLogger("affinity_router")
+
+# Connection-level headers that must not be forwarded by a proxy
+HOP_HEADERS = frozenset({"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+                         "trailer", "transfer-encoding", "upgrade", "host", "content-length"})
+
+
+def _point(value):
+    # Position on the ring: 64 bits of a hash that is the same in every process (unlike hash())
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring of node URLs, each placed at `vnodes` points.
+    Immutable: a membership change builds a new ring (with_nodes).
+    """
+
+    def __init__(self, nodes=(), vnodes=None):
+        self.vnodes = config.ROUTER_VNODES if vnodes is None else vnodes
+        self.nodes = tuple(sorted(set(nodes)))
+        points = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        """The node that owns key; raises LookupError on an empty ring"""
+        if not self._points:
+            raise LookupError("No bot nodes")
+        return self._owners[bisect(self._points, _point(key)) % len(self._points)]
+
+    def with_nodes(self, add=(), remove=()):
+        return HashRing((set(self.nodes) | set(add)) - set(remove), self.vnodes)
+
+
+class RebalanceError(Exception):
+    """A handoff failed; the ring was left as it was"""
+
+
+class AffinityRouter:
+    """Routes requests to the node owning their conversation and moves conversations between nodes"""
+
+    def __init__(self, nodes=(), vnodes=None, pool_size=None, timeout=None, transport=None):
+        self.ring = HashRing(nodes, vnodes)
+        self.pool_size = config.ROUTER_POOL_SIZE if pool_size is None else pool_size
+        self.timeout = config.ROUTER_TIMEOUT if timeout is None else timeout
+        self.transport = transport
+        self.client = None
+        # (old ring, new ring, event set when the handoff is over) while nodes are changing
+        self._transition = None
+        self._rebalance_lock = None
+        # Requests in progress per routing key, so a handoff can wait for them
+        self._inflight = Counter()
+        self._spread = itertools.count()
+        self.stats = {'proxied': 0, 'upstream_errors': 0, 'held': 0, 'rebalances': 0, 'moved': 0,
+                      'last_rebalance': None}
+
+    def start(self):
+        """Open the connection pool; call from the event loop that serves requests"""
+        if self.client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout, transport=self.transport)
+            self._rebalance_lock = asyncio.Lock()
+
+    async def close(self):
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.aclose()
+
+    @staticmethod
+    def routing_key(request, conversation_id):
+        """The bot's key for conversation_id under the request's tenant"""
+        tenant_id = request.headers.get(TENANT_HEADER) or request.query_params.get("tenant")
+        return conversation_key(tenant_id or DEFAULT_TENANT, conversation_id)
+
+    async def route(self, keys):
+        """
+        Owner of each key, holding keys whose owner is being changed until
+        their handoff is over. The keys count as in flight until release(keys).
+        """
+        while True:
+            transition = self._transition
+            if transition is None:
+                ring = self.ring
+            else:
+                old, ring, done = transition
+                if any(old.node_for(key) != ring.node_for(key) for key in keys):
+                    self.stats['held'] += 1
+                    await done.wait()
+                    continue
+            owners = {key: ring.node_for(key) for key in keys}
+            self._inflight.update(keys)
+            return owners
+
+    def release(self, keys):
+        for key in keys:
+            self._inflight[key] -= 1
+            if self._inflight[key] <= 0:
+                del self._inflight[key]
+
+    def any_node(self):
+        nodes = self.ring.nodes
+        if not nodes:
+            raise LookupError("No bot nodes")
+        return nodes[next(self._spread) % len(nodes)]
+
+    def _forward_headers(self, request):
+        # The nodes rate-limit by client address: run them with --forwarded-allow-ips=<router>
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in HOP_HEADERS and name.lower() != "x-forwarded-for"]
+        chain = [hop for hop in (request.headers.get("x-forwarded-for"),
+                                 request.client.host if request.client else None) if hop]
+        if chain:
+            headers.append(("x-forwarded-for", ", ".join(chain)))
+        return headers
+
+    async def proxy(self, request, body, keys=()):
+        """Forward request to the owner of keys (any node without keys) and stream the reply back"""
+        keys = list(keys)
+        try:
+            node = (await self.route(keys))[keys[0]] if keys else self.any_node()
+        except LookupError as e:
+            return _error_response(str(e), 503)
+        url = node + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        upstream_request = self.client.build_request(request.method, url, headers=self._forward_headers(request),
+                                                     content=body)
+        try:
+            upstream = await self.client.send(upstream_request, stream=True)
+        except httpx.HTTPError as e:
+            self.release(keys)
+            self.stats['upstream_errors'] += 1
+            logger.warning(f"Node {node} unavailable: {e!r}")
+            return _error_response("Bot node unavailable", 502)
+        self.stats['proxied'] += 1
+
+        async def finish():
+            await upstream.aclose()
+            self.release(keys)
+
+        response = StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code,
+                                     background=BackgroundTask(finish))
+        response.raw_headers = [(name.encode("latin-1"), value.encode("latin-1"))
+                                for name, value in upstream.headers.multi_items()
+                                if name.lower() not in HOP_HEADERS or name.lower() == "content-length"]
+        return response
+
+    async def proxy_batch(self, request, body):
+        """
+        Split a /chat/batch request by owner, send each node its items and
+        merge the NDJSON results (indexes mapped back) into one stream.
+        """
+        try:
+            items = batch.parse_batch(body)
+        except InvalidBody as e:
+            return _error_response(str(e), 400)
+        keys = [self.routing_key(request, item["conversation_id"]) for item in items]
+        try:
+            owners = await self.route(keys)
+        except LookupError as e:
+            return _error_response(str(e), 503)
+
+        parts = defaultdict(list)  # node -> indexes of its items
+        for index, key in enumerate(keys):
+            parts[owners[key]].append(index)
+        headers = self._forward_headers(request)
+        results = asyncio.Queue()
+
+        async def run_part(node, indexes):
+            reported = set()
+            try:
+                payload = dumps({"items": [items[index] for index in indexes]})
+                async with self.client.stream("POST", node + "/chat/batch", headers=headers,
+                                              content=payload) as upstream:
+                    if upstream.status_code != 200:
+                        await upstream.aread()
+                        self._fail_items(results, items, indexes, upstream)
+                        return
+                    async for line in upstream.aiter_lines():
+                        if not line:
+                            continue
+                        result = loads(line)
+                        if result.get("done"):
+                            continue
+                        result["index"] = indexes[result["index"]]
+                        reported.add(result["index"])
+                        results.put_nowait(result)
+            except httpx.HTTPError as e:
+                self.stats['upstream_errors'] += 1
+                logger.warning(f"Node {node} unavailable: {e!r}")
+                self._fail_items(results, items, [i for i in indexes if i not in reported], None)
+            finally:
+                results.put_nowait(None)
+
+        async def stream():
+            tasks = [asyncio.ensure_future(run_part(node, indexes)) for node, indexes in parts.items()]
+            failed = 0
+            try:
+                remaining = len(tasks)
+                while remaining:
+                    result = await results.get()
+                    if result is None:
+                        remaining -= 1
+                        continue
+                    failed += not result["success"]
+                    yield dumps(result) + b"\n"
+                yield dumps({"done": True, "items": len(items), "failed": failed}) + b"\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.release(keys)
+
+        self.stats['proxied'] += 1
+        return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+    @staticmethod
+    def _fail_items(results, items, indexes, upstream):
+        # One error line per item a node did not answer
+        if upstream is None:
+            error, status, retry_after = "Bot node unavailable", 502, None
+        else:
+            try:
+                error = loads(upstream.content).get("error") or upstream.reason_phrase
+            except (ValueError, AttributeError):
+                error = upstream.reason_phrase
+            status, retry_after = upstream.status_code, upstream.headers.get("retry-after")
+        for index in indexes:
+            result = {"index": index, "id": items[index]["id"] or None,
+                      "conversation_id": items[index]["conversation_id"], "success": False,
+                      "error": error, "status": status}
+            if retry_after is not None:
+                result["retry_after"] = int(retry_after)
+            results.put_nowait(result)
+
+    async def _call(self, node, method, path, payload=None):
+        # Internal endpoints of a node, authenticated with the shared ADMIN_TOKEN
+        response = await self.client.request(method, node + path,
+                                             content=None if payload is None else dumps(payload),
+                                             headers={"Authorization": f"Bearer {config.ADMIN_TOKEN}",
+                                                      "Content-Type": "application/json"})
+        response.raise_for_status()
+        return loads(response.content)
+
+    async def _quiesce(self, old, new):
+        # Wait for requests already sent to the old owner of a moving key
+        deadline = time.monotonic() + self.timeout
+        while any(old.node_for(key) != new.node_for(key) for key in self._inflight):
+            if time.monotonic() > deadline:
+                logger.warning("Requests still running on moving conversations; handing off anyway")
+                return
+            await asyncio.sleep(0.01)
+
+    async def rebalance(self, add=(), remove=(), force=False):
+        """
+        Change the nodes, handing each moving conversation to its new owner
+        first. With force, a node that is being removed and can't be reached
+        is dropped without handing its conversations over.
+        """
+        async with self._rebalance_lock:
+            old = self.ring
+            new = old.with_nodes(add, remove)
+            if not new.nodes:
+                raise RebalanceError("At least one node must remain")
+            if new.nodes == old.nodes:
+                return {"nodes": list(new.nodes), "conversations": None, "moved": 0}
+
+            start = time.perf_counter()
+            done = asyncio.Event()
+            self._transition = (old, new, done)
+            try:
+                await self._quiesce(old, new)
+                moves = defaultdict(list)  # (old owner, new owner) -> keys
+                total = 0
+                for node in old.nodes:
+                    try:
+                        held = (await self._call(node, "GET", "/internal/conversations"))["conversations"]
+                    except (httpx.HTTPError, ValueError, KeyError) as e:
+                        if force and node in remove:
+                            logger.warning(f"Removing unreachable node {node}; its conversations are lost")
+                            continue
+                        raise RebalanceError(f"Cannot list the conversations of {node}: {e!r}")
+                    total += len(held)
+                    for key in held:
+                        target = new.node_for(key)
+                        if target != node:
+                            moves[(node, target)].append(key)
+
+                for (source, target), keys in moves.items():
+                    try:
+                        exported = await self._call(source, "POST", "/internal/handoff/export",
+                                                    {"conversations": keys})
+                        await self._call(target, "POST", "/internal/handoff/import", exported)
+                    except (httpx.HTTPError, ValueError) as e:
+                        raise RebalanceError(f"Handoff from {source} to {target} failed: {e!r}")
+                self.ring = new
+            finally:
+                self._transition = None
+                done.set()
+
+            # The new owners serve these now; a node that keeps a stale copy only wastes memory
+            for (source, _), keys in moves.items():
+                try:
+                    await self._call(source, "POST", "/internal/handoff/release", {"conversations": keys})
+                except (httpx.HTTPError, ValueError) as e:
+                    logger.warning(f"{source} did not release {len(keys)} conversations: {e!r}")
+
+            moved = sum(len(keys) for keys in moves.values())
+            self.stats['rebalances'] += 1
+            self.stats['moved'] += moved
+            self.stats['last_rebalance'] = time.time()
+            logger.info(f"Nodes now {list(new.nodes)}: moved {moved} of {total} conversations", extra={
+                "event": "rebalance", "moved": moved, "conversations": total,
+                "timings_ms": {"total": round((time.perf_counter() - start) * 1000, 2)}})
+            return {"nodes": list(new.nodes), "conversations": total, "moved": moved}
+
+    def report(self):
+        return dict(self.stats, nodes=list(self.ring.nodes), vnodes=self.ring.vnodes,
+                    in_flight=sum(self._inflight.values()), rebalancing=self._transition is not None)
+
+
+def _error_response(error, status):
+    return FastJSONResponse({"success": False, "error": error}, status_code=status)
+
+
+def _conversation_id(body, fields):
+    # First string among fields of a JSON body, or None (the node rejects bad bodies itself)
+    try:
+        data = loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    for field in fields:
+        if isinstance(data.get(field), str) and data[field]:
+            return data[field]
+    return None
+
+
+def parse_nodes(value):
+    return [node.strip().rstrip("/") for node in value.split(",") if node.strip()]
+
+
+router = AffinityRouter(parse_nodes(config.ROUTER_NODES))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    router.start()
+    yield
+    await router.close()
+
+
+app = FastAPI(title="Customer Support Bot Router", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+def require_admin(request: Request):
+    """Same rule as the nodes: 'Authorization: Bearer <ADMIN_TOKEN>', off without one"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled: set ADMIN_TOKEN")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {config.ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+
+@app.get("/router/status")
+async def router_status():
+    return router.report()
+
+
+@app.post("/router/nodes", dependencies=[Depends(require_admin)])
+async def change_nodes(http_request: Request):
+    """Add and/or remove nodes: {"add": [url, ...], "remove": [url, ...], "force": false}"""
+    try:
+        data = loads(await http_request.body())
+    except ValueError:
+        return _error_response("Request body must be JSON", 400)
+    if not isinstance(data, dict):
+        return _error_response("Request body must be a JSON object", 400)
+    lists = {}
+    for field in ("add", "remove"):
+        value = data.get(field, [])
+        if not isinstance(value, list) or not all(isinstance(node, str) for node in value):
+            return _error_response(f"'{field}' must be a list of node URLs", 400)
+        lists[field] = [node.rstrip("/") for node in value]
+    try:
+        result = await router.rebalance(lists["add"], lists["remove"], force=data.get("force") is True)
+    except RebalanceError as e:
+        logger.error(f"Rebalance failed: {e}")
+        return _error_response(str(e), 502)
+    return dict(result, success=True)
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+async def forward(path: str, http_request: Request):
+    """Everything else goes to the node owning the request's conversation (any node if it has none)"""
+    body = await http_request.body()
+    parts = path.split("/")
+    conversation_id = None
+    if path == "chat/batch" and http_request.method == "POST":
+        return await router.proxy_batch(http_request, body)
+    if path == "chat" and http_request.method == "POST":
+        conversation_id = _conversation_id(body, ("conversation_id",)) or "default"
+    elif len(parts) == 2 and parts[0] == "clear":
+        conversation_id = parts[1]
+    elif len(parts) == 3 and parts[:2] == ["agent", "reply"]:
+        conversation_id = parts[2]
+    elif len(parts) == 2 and parts[0] == "webhooks" and http_request.method == "POST":
+        conversation_id = _conversation_id(body, ("conversation_id",))
+        sender = _conversation_id(body, ("from",))
+        if conversation_id is None and sender is not None:
+            conversation_id = f"{parts[1]}-{sender}"
+    keys = [router.routing_key(http_request, conversation_id)] if conversation_id else []
+    return await router.proxy(http_request, body, keys)
+
+
+def _simulate(nodes=4, conversations=100000, vnodes=None):
+    """Share of conversations each node owns, and how many move when one joins or leaves"""
+    keys = [f"conversation-{i}" for i in range(conversations)]
+    ring = HashRing([f"http://node-{i}:8000" for i in range(nodes)], vnodes)
+    owners = {key: ring.node_for(key) for key in keys}
+    shares = Counter(owners.values())
+    print(f"{nodes} nodes x {ring.vnodes} vnodes, {conversations} conversations")
+    print(f"  per node: min {min(shares.values())}, max {max(shares.values())} "
+          f"(even share {conversations // nodes})")
+
+    for label, changed in (("join", ring.with_nodes(add=[f"http://node-{nodes}:8000"])),
+                           ("leave", ring.with_nodes(remove=[ring.nodes[0]]))):
+        moved = sum(owners[key] != changed.node_for(key) for key in keys)
+        ideal = conversations / max(len(changed.nodes), len(ring.nodes))
+        print(f"  one node {label}s: {moved} moved ({moved / conversations:.1%}; ideal {ideal / conversations:.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate conversation placement on the hash ring")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--vnodes", type=int, default=None)
+    args = parser.parse_args()
+    _simulate(args.nodes, args.conversations, args.vnodes)
@@ -0,0 +1,301 @@
+# answer_pack.py
+# Pre-generated answers to the most frequent questions, so they never need a
+# live upstream call. Built offline from chat logs (JSONL with a "message"
+# per line) and/or a journal directory:
+#
+#   python answer_pack.py build chats.jsonl journal/ --top 200 --out answers.pack
+#   python answer_pack.py show answers.pack
+#   python answer_pack.py ask answers.pack "what are your support hours?"
+#
+# then set ANSWER_PACK_FILE=answers.pack. Questions are matched after
+# normalizing (lowercase, punctuation and extra spaces dropped).
+#
+# Answers are generated without any history, so only opening messages are
+# mined, and the bot consults the pack only on a conversation's first turn:
+# a follow-up like "yes" or "it still doesn't work" depends on what came before.
+#
+# The pack is one file, read through mmap: a header, JSON metadata, an
+# open-addressing hash index of (hash, offset, length) slots and the records.
+# Opening it parses only the header and metadata, and forked workers share
+# its pages. A build writes a new file and renames it over the old one, so
+# a running worker keeps the version it mapped until the runtime config
+# watcher (runtime_config.py) notices the new one and swaps it in.
+#
+# Answers are for the default tenant's preamble; a pack built for another
+# company name or product info is not used.
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import Counter
+
+import config
+
+logger = logging.getLogger("answer_pack")
+
+MAGIC = b"ANSPACK\0"
+FORMAT = 1
+HEADER = struct.Struct("<8sIIII")  # magic, format, slots, entries, metadata length
+SLOT = struct.Struct("<QII")  # question hash (0 = empty), record offset, record length
+QUESTION_LENGTH = struct.Struct("<I")
+
+WORD_PATTERN = re.compile(r"\b\w+\b")
+# Entries the bot keeps per conversation (bot._record_turn)
+HISTORY_TURNS = 10
+
+
+class PackError(ValueError):
+    """The file is not an answer pack this version can read"""
+
+
+def normalize(message):
+    """The form questions are counted and looked up in"""
+    return " ".join(WORD_PATTERN.findall(message.lower()))
+
+
+def preamble_digest(preamble):
+    return hashlib.blake2b(preamble.encode(), digest_size=16).hexdigest()
+
+
+def _hash(question):
+    # Never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(question, digest_size=8).digest(), "little") or 1
+
+
+def write_pack(path, answers, meta):
+    """Write {normalized question: answer} to path, replacing any existing pack atomically"""
+    slots = 8
+    while slots < 2 * len(answers):
+        slots *= 2
+    meta = dict(meta, entries=len(answers))
+    meta_bytes = json.dumps(meta).encode()
+    index_offset = HEADER.size + len(meta_bytes)
+    index_offset += -index_offset % 8
+    offset = index_offset + slots * SLOT.size
+
+    index = [(0, 0, 0)] * slots
+    records = []
+    for question, answer in answers.items():
+        question_bytes = question.encode()
+        record = QUESTION_LENGTH.pack(len(question_bytes)) + question_bytes + answer.encode()
+        hashed = _hash(question_bytes)
+        slot = hashed & (slots - 1)
+        while index[slot][0]:
+            slot = (slot + 1) & (slots - 1)
+        index[slot] = (hashed, offset, len(record))
+        records.append(record)
+        offset += len(record)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, slots, len(answers), len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(b"\0" * (index_offset - HEADER.size - len(meta_bytes)))
+        f.write(b"".join(SLOT.pack(*entry) for entry in index))
+        f.write(b"".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class AnswerPack:
+    """A mapped answer pack; lookups read the index and record in place"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise PackError(f"{path}: empty file")
+        if len(self._data) < HEADER.size:
+            raise PackError(f"{path}: truncated")
+        magic, version, slots, entries, meta_length = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != FORMAT:
+            raise PackError(f"{path}: not an answer pack (format {FORMAT})")
+        self.meta = json.loads(self._data[HEADER.size:HEADER.size + meta_length])
+        self.version = self.meta.get("version")
+        self.entries = entries
+        self._mask = slots - 1
+        self._index_offset = HEADER.size + meta_length + (-(HEADER.size + meta_length) % 8)
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0}
+
+    def lookup(self, message):
+        """Stored answer for message, or None"""
+        question = normalize(message).encode()
+        answer = self._find(question) if question else None
+        with self._lock:
+            self.stats['lookups'] += 1
+            if answer is not None:
+                self.stats['hits'] += 1
+        return answer
+
+    def _find(self, question):
+        data = self._data
+        hashed = _hash(question)
+        slot = hashed & self._mask
+        while True:
+            stored, offset, length = SLOT.unpack_from(data, self._index_offset + slot * SLOT.size)
+            if not stored:
+                return None
+            if stored == hashed:
+                (question_length,) = QUESTION_LENGTH.unpack_from(data, offset)
+                start = offset + QUESTION_LENGTH.size
+                if data[start:start + question_length] == question:
+                    return data[start + question_length:offset + length].decode()
+            slot = (slot + 1) & self._mask
+
+    def items(self):
+        """(question, answer) for every entry, in index order"""
+        for slot in range(self._mask + 1):
+            stored, offset, length = SLOT.unpack_from(self._data, self._index_offset + slot * SLOT.size)
+            if stored:
+                (question_length,) = QUESTION_LENGTH.unpack_from(self._data, offset)
+                start = offset + QUESTION_LENGTH.size
+                yield (self._data[start:start + question_length].decode(),
+                       self._data[start + question_length:offset + length].decode())
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return dict(stats, version=self.version, entries=self.entries,
+                    hit_rate=round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0)
+
+
+def load(path, preamble):
+    """
+    The pack at path for a bot using preamble: None if path is empty or the
+    pack was built for a different preamble. Raises PackError or OSError.
+    """
+    if not path:
+        return None
+    pack = AnswerPack(path)
+    if pack.meta.get("preamble") != preamble_digest(preamble):
+        logger.warning(f"Answer pack {path} (version {pack.version}) was built for other company info; not using it")
+        return None
+    logger.info(f"Answer pack {path}: version {pack.version}, {pack.entries} answers")
+    return pack
+
+
+def read_questions(path):
+    """
+    Opening user messages in a JSONL chat log, or in the conversations of a
+    journal directory. Log lines with a "conversation_id" count only the
+    first message of each conversation; lines without one all count.
+    """
+    from journal import FILE_PATTERN, read_records
+
+    if not os.path.isdir(path):
+        seen = set()
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    conversation_id = entry.get("conversation_id")
+                    if conversation_id is not None:
+                        if conversation_id in seen:
+                            continue
+                        seen.add(conversation_id)
+                    if entry.get("message"):
+                        yield entry["message"]
+        return
+    for name in sorted(os.listdir(path)):
+        match = FILE_PATTERN.match(name)
+        if not match:
+            continue
+        for record in read_records(os.path.join(path, name))[0]:
+            if record.get("t") != "conv":
+                continue
+            history = record["h"]
+            # A log record follows one turn, so a two-entry history is the opening one. A snapshot
+            # holds whole conversations, but a full one (HISTORY_TURNS entries) may have lost its start
+            if match.group(1) == "snapshot" and len(history) >= HISTORY_TURNS:
+                continue
+            if (match.group(1) == "snapshot" or len(history) == 2) and history and history[0]["role"] == "USER":
+                yield history[0]["message"]
+
+
+def mine_questions(paths, top=200, min_count=2):
+    """[(normalized question, count, most common wording)] for the top most frequent questions"""
+    counts = Counter()
+    wordings = {}
+    for path in paths:
+        for message in read_questions(path):
+            question = normalize(message)
+            if question:
+                counts[question] += 1
+                wordings.setdefault(question, Counter())[message.strip()] += 1
+    return [(question, count, wordings[question].most_common(1)[0][0])
+            for question, count in counts.most_common(top) if count >= min_count]
+
+
+def build(bot, questions, path, version=None):
+    """Generate answers for mined questions through bot and write the pack; returns the metadata"""
+    answers = {}
+    skipped = {'human': 0, 'failed': 0}
+    tenant = bot.tenants.default
+    for question, _, wording in questions:
+        # Messages that go to a human agent are never answered by the bot
+        if bot.fallback_handler.should_transfer_to_human(wording, tenant.rules)[0]:
+            skipped['human'] += 1
+            continue
+        try:
+            answer = bot.answer_once(wording)
+        except Exception as e:
+            logger.warning(f"No answer for {question!r}: {e}")
+            answer = None
+        if not answer:
+            skipped['failed'] += 1
+            continue
+        answers[question] = answer
+    meta = {
+        "version": int(time.time()) if version is None else version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "company_name": tenant.company_name,
+        "preamble": preamble_digest(tenant.preamble),
+        "skipped": skipped
+    }
+    write_pack(path, answers, meta)
+    return dict(meta, entries=len(answers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a pre-generated answer pack")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build_parser = subcommands.add_parser("build", help="mine frequent questions and generate their answers")
+    build_parser.add_argument("sources", nargs="+", help="JSONL chat logs and/or journal directories")
+    build_parser.add_argument("--out", default=config.ANSWER_PACK_FILE or "answers.pack")
+    build_parser.add_argument("--top", type=int, default=200, help="most frequent questions to answer")
+    build_parser.add_argument("--min-count", type=int, default=2, help="skip questions seen fewer times")
+    build_parser.add_argument("--version", type=int, help="pack version (default: build time)")
+    show_parser = subcommands.add_parser("show", help="print a pack's metadata and questions")
+    show_parser.add_argument("pack")
+    ask_parser = subcommands.add_parser("ask", help="look a message up in a pack")
+    ask_parser.add_argument("pack")
+    ask_parser.add_argument("message")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from bot import CustomerSupportBot
+        from log_pipeline import setup_logging
+        setup_logging()
+        questions = mine_questions(args.sources, args.top, args.min_count)
+        print(f"Generating answers for {len(questions)} questions...")
+        meta = build(CustomerSupportBot(), questions, args.out, args.version)
+        print(f"Wrote {meta['entries']} answers to {args.out} (version {meta['version']}, skipped {meta['skipped']})")
+    elif args.command == "show":
+        pack = AnswerPack(args.pack)
+        print(json.dumps(pack.meta, indent=2))
+        for question, answer in pack.items():
+            print(f"- {question}: {answer}")
+    else:
+        answer = AnswerPack(args.pack).lookup(args.message)
+        print(answer if answer is not None else "(not in pack)")
@@ -1,21 +1,127 @@
 # api.py
-# FastAPI web interface for the customer support bot
+# ASGI application for the customer support bot: the website (web_server.py),
+# the JSON API and the operational endpoints share one process, one bot and
+# one upstream connection pool.
 
-from fastapi import FastAPI, HTTPException
+import gc
+import hmac
+import logging
+import math
+import re
+import time
+from contextlib import asynccontextmanager
+
+import anyio.to_thread
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
-from bot import CustomerSupportBot
-import uvicorn
+import admission
+from admission import Rejected, client_key
+import batch
+import channel_inbox
+import bot as bot_module
+import idempotency
+from cancellation import Cancelled, CancelToken, run_until_disconnect
+from bot import get_bot, try_get_bot
+import chat_sessions
+import config
+import log_pipeline
+import memory_diagnostics
+from serialization import FastJSONResponse, InvalidBody, dumps, loads, parse_object
+from tenants import TENANT_HEADER, UnknownTenant
+import web_server
+from web_server import unknown_tenant_response
+
+logger = logging.getLogger("api")
+
+
+def preload():
+    """
+    Build shared read-only state before gunicorn forks its workers.
+
+    The bot is otherwise created lazily on the first request. Freezing the GC
+    afterwards keeps the preloaded objects (compiled preamble, fallback
+    matchers, intent model) out of collections, so their pages stay shared between workers
+    instead of being copied on write.
+    """
+    bot = get_bot()
+    bot.fallback_handler
+    bot.intent_router
+    gc.collect()
+    gc.freeze()
+
 
+@asynccontextmanager
+async def lifespan(app):
+    log_pipeline.setup_logging()
+    # bot.chat blocks, so it runs in the threadpool; size it to match the upstream pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = config.THREADPOOL_SIZE
+    # Pick up conversations from before the restart (each worker, after the fork)
+    if config.JOURNAL_DIR:
+        bot = try_get_bot()
+        if bot:
+            await run_in_threadpool(bot.open_journal)
+    # Watch the runtime config files; the SIGHUP handler can only be installed from the main thread
+    if config.RUNTIME_CONFIG_FILE or config.TENANTS_FILE or config.ANSWER_PACK_FILE:
+        bot = try_get_bot()
+        if bot:
+            bot.watch_config()
+    # Work through channel messages queued before the restart (each worker, after the fork)
+    inbox = channel_inbox.get_inbox()
+    if inbox is not None:
+        inbox.start()
+    # Memory trend samples for finding leaks (each worker, after the fork)
+    sampler = None
+    if config.MEMORY_SAMPLE_FILE:
+        sampler = memory_diagnostics.MemorySampler(get_bot).start()
+    # Usage totals to the shared store, and the other workers' totals back (each worker, after the fork)
+    if config.USAGE_DB:
+        bot = try_get_bot()
+        if bot:
+            await run_in_threadpool(bot.usage_ledger.start)
+    yield
+    if sampler is not None:
+        sampler.stop()
+    if inbox is not None:
+        await run_in_threadpool(inbox.close, config.GRACEFUL_TIMEOUT)
+    # Let upstream calls that outlived their HTTP request finish before the worker exits
+    await run_in_threadpool(bot_module.shutdown, config.GRACEFUL_TIMEOUT)
+    log_pipeline.shutdown_logging()
 
-# Initialize the bot
-bot = CustomerSupportBot()
 
 # Initialize FastAPI
 app = FastAPI(
     title="Customer Support Bot API",
-    description="Simple API for a customer support chatbot using Hugging Face models",
-    version="1.0.0"
+    description="Customer support chatbot (Cohere) with website, JSON API and human agent fallback",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST", "OPTIONS"],
+                   allow_headers=["Content-Type", "Authorization", idempotency.HEADER, TENANT_HEADER])
+app.include_router(web_server.router)
+
+
+@app.middleware("http")
+async def security_headers(request: Request, call_next):
+    """Add security headers to every response"""
+    response = await call_next(request)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['X-Frame-Options'] = 'DENY'
+    response.headers['X-XSS-Protection'] = '1; mode=block'
+    return response
+
+
+def require_admin(request: Request):
+    """Agent/admin endpoints need 'Authorization: Bearer <ADMIN_TOKEN>', and are off without one"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled: set ADMIN_TOKEN")
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied, f"Bearer {config.ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
 
 class ChatRequest(BaseModel):
     message: str
@@ -23,31 +129,438 @@ class ChatRequest(BaseModel):
 
 
 class ChatResponse(BaseModel):
+    # API clients read response/conversation_id, the web widget also reads success
+    success: bool = True
     response: str
     conversation_id: str
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+# Body of POST /chat: field -> default (None = required)
+CHAT_FIELDS = {"message": None, "conversation_id": "default"}
+
+
+def rejected_response(rejected):
+    return FastJSONResponse({
+        "success": False,
+        "error": rejected.reason
+    }, status_code=rejected.status, headers=rejected.headers())
+
+
+@app.post("/chat", response_model=ChatResponse, openapi_extra={
+    "requestBody": {"required": True, "content": {"application/json": {"schema": ChatRequest.model_json_schema()}}}
+})
+async def chat(http_request: Request):
     """
     Process a customer support query and return a helpful response.
 
     - Use different conversation_id values to maintain separate conversation threads
     - The system will remember the context of recent messages
+    - Send an Idempotency-Key header to retry safely: a repeat gets the first reply
+    - Send X-Tenant-ID to talk to another company's assistant (else chosen by Host)
     """
+    # Decoded with orjson and checked by hand; ChatRequest only documents the body
+    try:
+        request = parse_object(await http_request.body(), CHAT_FIELDS)
+    except InvalidBody as e:
+        return FastJSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=400)
+    conversation_id = request["conversation_id"]
+
+    bot = try_get_bot()
+    if not bot:
+        return FastJSONResponse({
+            "success": False,
+            "error": "AI assistant is not available. Please try again later."
+        }, status_code=503)
+
+    message = request["message"].strip()
+    if not message:
+        return FastJSONResponse({
+            "success": False,
+            "error": "Message cannot be empty"
+        }, status_code=400)
+
+    try:
+        tenant = bot.tenants.resolve(http_request)
+    except UnknownTenant:
+        return unknown_tenant_response()
+    # Rate limits, locks and history are per tenant
+    conversation_key = tenant.key(conversation_id)
+
+    start = time.perf_counter()
+    timings = {}
+
+    async def run_turn():
+        async with admission.chat_admission.turn(client_key(http_request), conversation_key, tenant.tenant_id):
+            timings["queued"] = round((time.perf_counter() - start) * 1000, 2)
+            # Stops the turn (retries, backoff, upstream generation) if the client hangs up
+            return await run_until_disconnect(http_request, bot.chat, message, conversation_id,
+                                              show_typing=False, tenant=tenant)
+
     try:
-        response = bot.chat(request.message, request.conversation_id)
-        return {
+        key, ttl = idempotency.request_key(http_request.headers.get(idempotency.HEADER), conversation_key, message)
+        if key is None:
+            response, replayed = await run_turn(), False
+        else:
+            # A duplicate of a running or recent request shares its reply instead of running again
+            response, replayed = await idempotency.chat_idempotency.run(key, message, ttl, run_turn)
+        timings["total"] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info("chat request", extra={
+            "event": "chat_request",
+            "conversation_id": conversation_id,
+            "tenant": tenant.tenant_id,
+            "message_chars": len(message),
+            "replayed": replayed,
+            "timings_ms": timings
+        })
+        # Returned as a response object, so FastAPI skips re-validating it against ChatResponse
+        return FastJSONResponse({
+            "success": True,
             "response": response,
-            "conversation_id": request.conversation_id
-        }
+            "conversation_id": conversation_id
+        }, headers={"Idempotent-Replayed": "true"} if replayed else None)
+    except idempotency.Conflict:
+        return FastJSONResponse({
+            "success": False,
+            "error": "Idempotency-Key was already used for a different message"
+        }, status_code=422)
+    except Cancelled:
+        logger.info("chat request cancelled", extra={
+            "event": "chat_cancelled", "conversation_id": conversation_id,
+            "timings_ms": {"total": round((time.perf_counter() - start) * 1000, 2)}})
+        # Nobody reads this; 499 is the usual "client closed request" code in access logs
+        return FastJSONResponse({
+            "success": False,
+            "error": "Request cancelled"
+        }, status_code=499)
+    except Rejected as rejected:
+        logger.warning("chat request rejected", extra={
+            "event": "chat_rejected", "conversation_id": conversation_id,
+            "status": rejected.status, "reason": rejected.reason})
+        return rejected_response(rejected)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+        logger.exception(f"Error in chat endpoint: {str(e)}")
+        return FastJSONResponse({
+            "success": False,
+            "error": "Internal server error. Please try again."
+        }, status_code=500)
+
+
+@app.post("/chat/batch")
+async def chat_batch(http_request: Request):
+    """
+    Process many messages at once: {"items": [{"conversation_id", "message"}, ...]}.
+
+    Conversations run concurrently and each one's messages in order. Results
+    stream back as NDJSON, one line per item as it finishes ({"index", "id",
+    "conversation_id", "success", "response" or "error", "status"}), then a
+    final {"done": true, ...} line.
+    """
+    try:
+        items = batch.parse_batch(await http_request.body())
+    except InvalidBody as e:
+        return FastJSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=400)
+
+    bot = try_get_bot()
+    if not bot:
+        return FastJSONResponse({
+            "success": False,
+            "error": "AI assistant is not available. Please try again later."
+        }, status_code=503)
+    try:
+        tenant = bot.tenants.resolve(http_request)
+    except UnknownTenant:
+        return unknown_tenant_response()
+
+    # The batch is one request from its client; each item is still limited per conversation and tenant
+    try:
+        admission.chat_admission.check_client(client_key(http_request))
+    except Rejected as rejected:
+        return rejected_response(rejected)
+    # Fired when the client goes away, so running turns stop like they do for /chat
+    cancel = CancelToken()
+
+    async def run_item(index, item):
+        result = {"index": index, "id": item["id"] or None, "conversation_id": item["conversation_id"]}
+        message = item["message"].strip()
+        if not message:
+            return dict(result, success=False, error="Message cannot be empty", status=400)
+        conversation_key = tenant.key(item["conversation_id"])
+
+        async def run_turn():
+            async with admission.chat_admission.turn(None, conversation_key, tenant.tenant_id):
+                return await run_in_threadpool(bot.chat, message, item["conversation_id"], show_typing=False,
+                                               cancel=cancel, tenant=tenant)
+
+        try:
+            key, ttl = idempotency.request_key(item["idempotency_key"], conversation_key, message)
+            if key is None:
+                response, replayed = await run_turn(), False
+            else:
+                response, replayed = await idempotency.chat_idempotency.run(key, message, ttl, run_turn)
+            return dict(result, success=True, response=response, replayed=replayed, status=200)
+        except idempotency.Conflict:
+            return dict(result, success=False, status=422,
+                        error="Idempotency-Key was already used for a different message")
+        except Cancelled:
+            return dict(result, success=False, error="Request cancelled", status=499)
+        except Rejected as rejected:
+            return dict(result, success=False, error=rejected.reason, status=rejected.status,
+                        retry_after=max(1, math.ceil(rejected.retry_after)))
+        except Exception as e:
+            logger.exception(f"Error in chat batch item: {str(e)}")
+            return dict(result, success=False, error="Internal server error. Please try again.", status=500)
+
+    async def stream():
+        start = time.perf_counter()
+        failed = 0
+        try:
+            async for result in batch.stream_results(items, run_item, key=lambda item: item["conversation_id"]):
+                failed += not result["success"]
+                yield dumps(result) + b"\n"
+            yield dumps({"done": True, "items": len(items), "failed": failed}) + b"\n"
+        finally:
+            cancel.cancel()
+            logger.info("chat batch", extra={
+                "event": "chat_batch", "tenant": tenant.tenant_id, "items": len(items), "failed": failed,
+                "timings_ms": {"total": round((time.perf_counter() - start) * 1000, 2)}})
+
+    # X-Accel-Buffering: no keeps nginx from holding lines back until the batch ends
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+# Body of POST /webhooks/{channel}: field -> default (None = required)
+WEBHOOK_FIELDS = {"id": None, "from": None, "text": None, "conversation_id": ""}
+
+
+@app.post("/webhooks/{channel}")
+async def channel_webhook(channel: str, http_request: Request):
+    """
+    Inbound message from a messaging gateway: {"id", "from", "text", "conversation_id"?}.
+
+    Answered as soon as the message is stored; the reply is generated in the
+    background and posted to CHANNEL_SEND_URL. A redelivered id is
+    acknowledged again without a second reply.
+    """
+    inbox = channel_inbox.get_inbox()
+    if inbox is None:
+        return FastJSONResponse({
+            "success": False,
+            "error": "Channel webhooks are not configured"
+        }, status_code=404)
+    if config.CHANNEL_WEBHOOK_TOKEN and not hmac.compare_digest(
+            http_request.headers.get("x-webhook-token", ""), config.CHANNEL_WEBHOOK_TOKEN):
+        return FastJSONResponse({
+            "success": False,
+            "error": "Invalid webhook token"
+        }, status_code=401)
+    if not channel_inbox.CHANNEL_PATTERN.match(channel):
+        return FastJSONResponse({
+            "success": False,
+            "error": "Invalid channel name"
+        }, status_code=400)
+    try:
+        message = parse_object(await http_request.body(), WEBHOOK_FIELDS)
+    except InvalidBody as e:
+        return FastJSONResponse({
+            "success": False,
+            "error": str(e)
+        }, status_code=400)
+    text = message["text"].strip()
+    if not text:
+        # Media and status callbacks have no text; acknowledge them so the gateway doesn't resend
+        return {"success": True, "queued": False}
+
+    bot = try_get_bot()
+    if not bot:
+        return FastJSONResponse({
+            "success": False,
+            "error": "AI assistant is not available. Please try again later."
+        }, status_code=503)
+    try:
+        tenant = bot.tenants.resolve(http_request)
+    except UnknownTenant:
+        return unknown_tenant_response()
+
+    conversation_id = message["conversation_id"] or f"{channel}-{message['from']}"
+    message_id, duplicate = await run_in_threadpool(inbox.submit, channel, message["id"], tenant,
+                                                    conversation_id, message["from"], text)
+    return {"success": True, "queued": True, "id": message_id, "duplicate": duplicate}
+
+
+@app.get("/admin/inbox/dead", dependencies=[Depends(require_admin)])
+async def dead_letters(limit: int = 100):
+    """Channel messages that ran out of attempts, oldest first"""
+    inbox = channel_inbox.get_inbox()
+    if inbox is None:
+        return {"messages": []}
+    return {"messages": await run_in_threadpool(inbox.store.dead, limit)}
+
+
+@app.post("/admin/inbox/dead/{message_id}/retry", dependencies=[Depends(require_admin)])
+async def retry_dead_letter(message_id: int):
+    """Give a dead-lettered channel message another set of attempts"""
+    inbox = channel_inbox.get_inbox()
+    if inbox is None or not await run_in_threadpool(inbox.requeue, message_id):
+        return FastJSONResponse({
+            "success": False,
+            "error": "No dead-lettered message with this id"
+        }, status_code=404)
+    return {"success": True}
+
+
+class AgentReply(BaseModel):
+    message: str
+    agent: str = "Support Agent"
+
+
+@app.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Persistent chat channel for the web widget (see chat_sessions.py for the protocol)"""
+    bot = try_get_bot()
+    if not bot:
+        await websocket.close(code=1013)
+        return
+    try:
+        tenant = bot.tenants.resolve(websocket)
+    except UnknownTenant:
+        await websocket.close(code=chat_sessions.CLOSE_FORBIDDEN)
+        return
+    await chat_sessions.handle_websocket(websocket, bot, tenant)
+
+
+@app.post("/agent/reply/{conversation_id}", dependencies=[Depends(require_admin)])
+async def agent_reply(conversation_id: str, reply: AgentReply):
+    """
+    Push a human agent's message to the customer's chat window.
+
+    Only reaches sessions held by this worker: run a single worker
+    (WEB_CONCURRENCY=1) or route agents to the customer's worker.
+    """
+    session = chat_sessions.hub.sessions.get(conversation_id)
+    delivered = chat_sessions.hub.publish(conversation_id, {
+        "type": "agent",
+        "text": reply.message,
+        "agent": reply.agent
+    })
+    if delivered is None:
+        return FastJSONResponse({
+            "success": False,
+            "error": "No chat session for this conversation on this worker"
+        }, status_code=404)
+
+    # Session ids are server-issued, so the session knows its tenant
+    get_bot().add_agent_message(conversation_id, reply.message, tenant=session.tenant)
+    return {"success": True, "delivered": delivered}
+
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def reload_config():
+    """Rebuild the runtime configuration of this worker now (the old one stays if it fails)"""
+    bot = get_bot()
+    reloader = bot.config_reloader or bot.watch_config()
+    reloaded = await run_in_threadpool(reloader.reload)
+    return FastJSONResponse({
+        "success": reloaded,
+        "version": reloader.version,
+        "error": reloader.stats['last_error']
+    }, status_code=200 if reloaded else 422)
+
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+async def memory_report():
+    """What this worker's long-lived structures, threads and pools hold (see memory_diagnostics.py)"""
+    return await run_in_threadpool(memory_diagnostics.structures, get_bot())
+
+
+@app.post("/admin/memory/trace/start", dependencies=[Depends(require_admin)])
+async def start_memory_trace(frames: int = None):
+    """Start tracemalloc in this worker; allocations get slower until it is stopped"""
+    return await run_in_threadpool(memory_diagnostics.trace_diff.start, frames)
+
+
+@app.get("/admin/memory/trace", dependencies=[Depends(require_admin)])
+async def memory_trace(top: int = 20, group_by: str = "lineno"):
+    """Allocation sites that grew most since the previous call (or the start)"""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    diff = await run_in_threadpool(memory_diagnostics.trace_diff.snapshot, top, group_by)
+    if diff is None:
+        return FastJSONResponse({
+            "success": False,
+            "error": "Tracing is off: POST /admin/memory/trace/start first"
+        }, status_code=409)
+    return diff
+
+
+@app.post("/admin/memory/trace/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_trace():
+    return memory_diagnostics.trace_diff.stop()
+
+
+@app.get("/admin/usage", dependencies=[Depends(require_admin)])
+async def usage_report(day: str = None, top: int = 10):
+    """Tokens and cost by tenant and tier, and the costliest conversations, for a UTC day (today)"""
+    if day is not None and not re.fullmatch(r"\d{4}-\d{2}-\d{2}", day):
+        raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+    return await run_in_threadpool(get_bot().usage_ledger.report, day, top)
+
+
+# Conversation handoff between bot nodes, driven by the affinity router
+# (affinity_router.py) when a node joins or leaves. Keys are the bot's
+# conversation keys ("<tenant>:<conversation_id>" outside the default tenant).
+
+async def handoff_body(http_request, expected):
+    """The 'conversations' field of a handoff request, which must be of type expected"""
+    try:
+        data = loads(await http_request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be JSON")
+    conversations = data.get("conversations") if isinstance(data, dict) else None
+    if not isinstance(conversations, expected):
+        raise HTTPException(status_code=400, detail="'conversations' is missing or of the wrong type")
+    return conversations
+
+
+@app.get("/internal/conversations", dependencies=[Depends(require_admin)])
+async def held_conversations():
+    """Keys of the conversations this node holds"""
+    return {"conversations": get_bot().conversation_keys()}
+
+
+@app.post("/internal/handoff/export", dependencies=[Depends(require_admin)])
+async def export_conversations(http_request: Request):
+    """History and flags of the given conversations, once their running turns finish"""
+    keys = await handoff_body(http_request, list)
+    return {"conversations": await run_in_threadpool(get_bot().export_conversations, keys)}
+
+
+@app.post("/internal/handoff/import", dependencies=[Depends(require_admin)])
+async def import_conversations(http_request: Request):
+    """Take over conversations exported by another node"""
+    conversations = await handoff_body(http_request, dict)
+    if not all(isinstance(state, dict) for state in conversations.values()):
+        raise HTTPException(status_code=400, detail="'conversations' must map conversation keys to their state")
+    return {"imported": await run_in_threadpool(get_bot().import_conversations, conversations)}
+
+
+@app.post("/internal/handoff/release", dependencies=[Depends(require_admin)])
+async def release_conversations(http_request: Request):
+    """Forget conversations that another node now owns"""
+    keys = await handoff_body(http_request, list)
+    return {"released": await run_in_threadpool(get_bot().drop_conversations, keys)}
 
 
 @app.get("/")
-async def root():
-    """Check if the API is running"""
+async def root(request: Request):
+    """Serve the website to browsers; report API status to everyone else"""
+    if "text/html" in request.headers.get("accept", ""):
+        return HTMLResponse(web_server.INDEX_HTML)
     return {
         "status": "online",
         "message": "Customer Support Bot API is running. Use /chat endpoint to interact."
@@ -56,10 +569,24 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for monitoring"""
-    return {"status": "healthy"}
+    """Health check endpoint for monitoring and the web widget"""
+    bot = try_get_bot()
+    if not bot:
+        return FastJSONResponse({
+            "status": "unhealthy",
+            "healthy": False,
+            "message": "AI assistant not initialized"
+        }, status_code=503)
+
+    is_healthy, message = bot.health_check()
+    return FastJSONResponse({
+        "status": "healthy" if is_healthy else "unhealthy",
+        "healthy": is_healthy,
+        "message": message
+    }, status_code=200 if is_healthy else 503)
 
 
-# Run the API server
+# Run the API server (development only - production uses gunicorn.conf.py)
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,79 @@
+# batch.py
+# Many chat messages in one request (POST /chat/batch), for integrations that
+# forward messages from several conversations at once:
+#
+#   {"items": [{"conversation_id": "wa-254700000001", "message": "Hi"},
+#              {"conversation_id": "wa-254700000002", "message": "Where is my order?",
+#               "id": "msg-81", "idempotency_key": "msg-81"}]}
+#
+# Conversations run concurrently (at most BATCH_CONCURRENCY turns of one batch
+# at a time, each still going through admission control); the items of one
+# conversation run in the order given. Each result is streamed back as one
+# NDJSON line as soon as it is ready, tagged with the item's index (and id).
+
+import asyncio
+from collections import OrderedDict
+
+import config
+from serialization import InvalidBody, loads
+
+ITEM_FIELDS = {"message": None, "conversation_id": "default", "id": "", "idempotency_key": ""}
+
+
+def parse_batch(body, max_items=None):
+    """The items of a batch body, each with every field of ITEM_FIELDS; raises InvalidBody"""
+    max_items = config.BATCH_MAX_ITEMS if max_items is None else max_items
+    try:
+        data = loads(body)
+    except ValueError:
+        raise InvalidBody("Request body must be JSON")
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise InvalidBody("'items' must be a non-empty list")
+    if len(items) > max_items:
+        raise InvalidBody(f"At most {max_items} items per batch")
+
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise InvalidBody(f"Item {index} must be a JSON object")
+        values = {}
+        for name, default in ITEM_FIELDS.items():
+            value = item.get(name, default)
+            if value is None:
+                raise InvalidBody(f"Item {index}: '{name}' is required")
+            if not isinstance(value, str):
+                raise InvalidBody(f"Item {index}: '{name}' must be a string")
+            values[name] = value
+        parsed.append(values)
+    return parsed
+
+
+async def stream_results(items, run_item, key, concurrency=None):
+    """
+    Yield await run_item(index, item) for every item as soon as each is done.
+    Items with the same key(item) run one after another, in order; run_item
+    must not raise. Closing the generator cancels the items still running.
+    """
+    concurrency = config.BATCH_CONCURRENCY if concurrency is None else concurrency
+    groups = OrderedDict()
+    for index, item in enumerate(items):
+        groups.setdefault(key(item), []).append((index, item))
+
+    results = asyncio.Queue()
+    # Held per item, not per conversation, so a long conversation doesn't hold a slot throughout
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_group(group):
+        for index, item in group:
+            async with slots:
+                result = await run_item(index, item)
+            results.put_nowait(result)
+
+    tasks = [asyncio.ensure_future(run_group(group)) for group in groups.values()]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
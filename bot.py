@@ -5,183 +5,617 @@ import time
 import json
 import threading
 import sys
+import os
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+import answer_pack
+from cancellation import Cancelled, pause
+from conversation_locks import ConversationLocks
 from human_fallback import HumanFallbackHandler
-
-# Set up logging to only go to file (completely silent console)
-logging.basicConfig(
-    level=logging.ERROR,  # Only log errors
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("bot.log")]
-)
+from providers import (AuthError, ConversationNotFound, ProviderConnectionError, ProviderError, ProviderTimeout,
+                       RateLimited, build_model_router)
+from remote_conversations import RemoteConversations
+import runtime_config
+import traffic_trace
+from tenants import build_preamble
+from usage_ledger import UsageLedger
+
+# Handlers are set up by the entry point (log_pipeline.setup_logging), not on import
 logger = logging.getLogger("customer_support_bot")
-# Disable all logging for requests library too
-logging.getLogger("urllib3").setLevel(logging.WARNING)
-
-
-class TypingIndicator:
-    def __init__(self, message="🤖 Bot is typing"):
-        self.message = message
-        self.is_typing = False
-        self.thread = None
-
-    def start(self):
-        self.is_typing = True
-        self.thread = threading.Thread(target=self._animate)
-        self.thread.daemon = True
-        self.thread.start()
-
-    def stop(self):
-        self.is_typing = False
-        if self.thread:
-            self.thread.join()
-        # Clear the line completely
-        print('\r' + ' ' * 60 + '\r', end='', flush=True)
-
-    def _animate(self):
-        dots = ""
-        while self.is_typing:
-            for i in range(4):
-                if not self.is_typing:
-                    break
-                dots = "." * i
-                print(f'\r{self.message}{dots}   ', end='', flush=True)
-                time.sleep(0.4)
+
+
+class FailedReply(str):
+    """
+    What the user is told when a turn couldn't be answered (upstream down,
+    timing out, rejecting the key). It is still the text to show, but callers
+    that store or deliver replies (idempotency, the channel inbox) must not
+    treat it as the answer.
+    """
+    failed = True
 
 
 class CustomerSupportBot:
     def __init__(self):
         self.api_key = config.COHERE_API_KEY
-        if not self.api_key or self.api_key == "your_cohere_api_key_here":
+        if config.LLM_PROVIDER == "cohere" and (not self.api_key or self.api_key == "your_cohere_api_key_here"):
             raise ValueError("Please set a valid Cohere API key in your .env file")
 
-        self.api_url = "https://api.cohere.ai/v1/chat"
+        self.api_url = config.COHERE_API_URL
         self.conversations = {}
-        self.max_retries = 3
-        self.typing_indicator = TypingIndicator()
-        self.fallback_handler = HumanFallbackHandler()
+        # Turns of one conversation are serialized; different conversations are not
+        self.conversation_locks = ConversationLocks()
+        self.max_retries = config.MAX_RETRIES
+        # Terminal typing animation: only the CLI sets one (cli.py); the server never touches the terminal
+        self.typing_indicator = None
+        self._fallback_handler = None
+        self._intent_router = None
+        self._init_lock = threading.Lock()
+
+        # Companies served by this process, each with its preamble and transfer rules compiled,
+        # the pre-generated answers to frequent questions (answer_pack.py, mapped, not parsed)
+        # and the tuning knobs from RUNTIME_CONFIG_FILE. Replaced whole on a reload.
+        tenants, tuning = runtime_config.build()
+        pack = None
+        try:
+            pack = answer_pack.load(config.ANSWER_PACK_FILE, tenants.default.preamble)
+        except (OSError, ValueError) as e:
+            logger.error(f"Answer pack not loaded: {e}")
+        self.runtime = runtime_config.RuntimeConfig(tenants, pack, tuning)
+        self.config_reloader = None
+
+        # Connection pool is per process (created lazily, so it is never shared across a fork)
+        self._session = None
+        self._session_pid = None
+
+        # Fast and strong model tiers, picked per message (see providers.py)
+        self.model_router = build_model_router(self.api_key, self._get_session)
+        # Tokens and cost per conversation, tenant and tier, and the budgets on them (see usage_ledger.py)
+        self.usage_ledger = UsageLedger()
+        runtime_config.apply_tuning(self, self.tuning)
+
+        # Conversations the provider keeps server-side (UPSTREAM_HISTORY_MODE=server)
+        self.remote_conversations = RemoteConversations() if config.UPSTREAM_HISTORY_MODE == "server" else None
+
+        # Conversation journal for warm restarts; opened by open_journal()
+        self.journal = None
+
+        # Anonymized record of every turn for capacity planning (TRACE_FILE, see traffic_trace.py)
+        self.traffic_trace = traffic_trace.TraceRecorder() if config.TRACE_FILE else None
+
+        # Work stopped (or thrown away) because the client disconnected
+        self.cancellations = {'before_upstream': 0, 'during_upstream': 0,
+                              'reply_discarded': 0, 'reply_recorded': 0}
+        self._stats_lock = threading.Lock()
+
+        # In-flight upstream calls, so shutdown can drain them
+        self.draining = False
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+
+    @property
+    def fallback_handler(self):
+        # Created on first use so constructing the bot stays cheap
+        if self._fallback_handler is None:
+            with self._init_lock:
+                if self._fallback_handler is None:
+                    self._fallback_handler = HumanFallbackHandler()
+        return self._fallback_handler
+
+    @property
+    def intent_router(self):
+        # Trained on first use (or in the gunicorn master by api.preload); None when disabled
+        if self._intent_router is None and config.INTENT_ROUTER_ENABLED:
+            with self._init_lock:
+                if self._intent_router is None:
+                    from intent_router import load_router
+                    self._intent_router = load_router()
+                    runtime_config.apply_tuning(self, self.tuning, ("intent_confidence", "intent_max_words"))
+        return self._intent_router
+
+    @property
+    def tenants(self):
+        return self.runtime.tenants
+
+    @property
+    def answer_pack(self):
+        return self.runtime.answer_pack
+
+    @property
+    def tuning(self):
+        return self.runtime.tuning
+
+    @property
+    def system_message(self):
+        # Built once per (re)load and reused for every upstream payload of the default tenant
+        return self.tenants.default.preamble
+
+    def watch_config(self):
+        """Reload the runtime config when its files change or on SIGHUP; call from the main thread"""
+        if self.config_reloader is None:
+            self.config_reloader = runtime_config.ConfigReloader(self)
+            if self.config_reloader.watched():
+                self.config_reloader.start()
+            self.config_reloader.install_sighup()
+        return self.config_reloader
+
+    def _get_session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.UPSTREAM_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def drain(self, timeout=30):
+        """Stop retrying and wait for in-flight upstream calls to finish"""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        with self._inflight_cond:
+            while self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._inflight_cond.wait(remaining)
+            return self._inflight == 0
 
     def create_system_message(self):
-        return f"""You are a helpful customer support assistant for {config.COMPANY_NAME}.
-
-INSTRUCTIONS:
-- Be friendly, professional, and concise
-- Provide clear, actionable answers
-- If you don't know something, say so and offer to connect with a human agent
-- Keep responses under 3 sentences when possible
-- Be specific and helpful
-
-COMPANY INFO:
-{config.PRODUCT_INFO}
-
-Always prioritize being helpful and accurate over being verbose."""
-
-    def chat(self, user_message, conversation_id="default", show_typing=True):
+        return build_preamble(config.COMPANY_NAME, config.PRODUCT_INFO)
+
+    def chat(self, user_message, conversation_id="default", show_typing=False, cancel=None, tenant=None):
+        """
+        Reply to user_message in one of tenant's conversations (the default
+        tenant if None). With a cancel token (cancellation.CancelToken),
+        raises Cancelled once it fires instead of finishing the turn.
+        show_typing runs the bot's typing_indicator, if it has one, during the upstream call.
+        """
+        tenant = tenant or self.tenants.default
+        conversation_id = tenant.key(conversation_id)
+        turn = self._trace_begin(conversation_id, tenant, user_message)
+        outcome = "ok"
         try:
-            # Check if message should go to human first
-            should_transfer, reason = self.fallback_handler.should_transfer_to_human(user_message)
-
-            if should_transfer:
-                    # Flag conversation for human agent
-                self.fallback_handler.flag_conversation(conversation_id, user_message, reason)
-
-                    # Categorize and respond appropriately
-                category = self.fallback_handler.categorize_request(user_message, reason)
-                return self.fallback_handler.get_human_transfer_message(category)
-            if conversation_id not in self.conversations:
-                self.conversations[conversation_id] = []
-
-            history = self.conversations[conversation_id]
-
-            if show_typing:
-                self.typing_indicator.start()
-
-            try:
-                response_text = self._generate_response(user_message, history)
-            finally:
-                if show_typing:
-                    self.typing_indicator.stop()
-
-            history.append({"role": "USER", "message": user_message})
-            history.append({"role": "CHATBOT", "message": response_text})
-
-            if len(history) > 10:
-                history = history[-10:]
-
-            self.conversations[conversation_id] = history
-            return response_text
-
+            with self.conversation_locks.hold(conversation_id):
+                return self._chat_turn(user_message, conversation_id, show_typing, cancel, tenant, turn)
+        except Cancelled:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            return FailedReply("I'm sorry, I experienced a technical issue. Please try again.")
+        finally:
+            if turn is not None:
+                self.traffic_trace.finish(turn, outcome)
+
+    def _chat_turn(self, user_message, conversation_id, show_typing, cancel=None, tenant=None, turn=None):
+        # Caller holds the conversation's lock, so history can't change underneath
+        timings = {}
+        start = time.perf_counter()
+        transfer_message = self._human_transfer(user_message, conversation_id, tenant)
+        timings['fallback'] = _elapsed_ms(start)
+        if transfer_message is not None:
+            self._log_turn(conversation_id, "human", timings, turn)
+            return transfer_message
+
+        if conversation_id not in self.conversations:
+            self.conversations[conversation_id] = []
+
+        history = self.conversations[conversation_id]
+
+        stage = time.perf_counter()
+        local_answer = self._local_answer(user_message, tenant, history)
+        timings['intent'] = _elapsed_ms(stage)
+        if local_answer is not None:
+            self._remote_covered(conversation_id, history)
+            self._record_turn(conversation_id, history, user_message, local_answer)
+            self._log_turn(conversation_id, "local", timings, turn)
+            return local_answer
+
+        budget = self._check_budget(conversation_id, tenant)
+        if budget == "limit":
+            self._remote_covered(conversation_id, history)
+            self._record_turn(conversation_id, history, user_message, config.USAGE_LIMIT_MESSAGE)
+            self._log_turn(conversation_id, "limit", timings, turn)
+            return config.USAGE_LIMIT_MESSAGE
+
+        typing = self.typing_indicator if show_typing else None
+        if typing is not None:
+            typing.start()
+
+        stage = time.perf_counter()
+        try:
+            with self._upstream_call():
+                response_text = self._generate_response(user_message, history, cancel, conversation_id=conversation_id,
+                                                        tenant=tenant, turn=turn, cheap=budget == "budget")
+        finally:
+            if typing is not None:
+                typing.stop()
+        timings['upstream'] = _elapsed_ms(stage)
+
+        self._finish_abandoned(cancel)
+        # A failed turn leaves the history as it was, so a retry doesn't see the apology
+        if not isinstance(response_text, FailedReply):
+            self._record_turn(conversation_id, history, user_message, response_text)
+        elif self.remote_conversations is not None:
+            self.remote_conversations.failed(conversation_id)
+        timings['total'] = _elapsed_ms(start)
+        self._log_turn(conversation_id, "llm", timings, turn)
+        return response_text
+
+    def _finish_abandoned(self, cancel):
+        """A reply finished after its client left: keep it in history, or raise Cancelled"""
+        if cancel is None or not cancel.cancelled:
+            return
+        if config.RECORD_ABANDONED_TURNS:
+            self._count_cancelled('reply_recorded')
+            return
+        self._count_cancelled('reply_discarded')
+        raise Cancelled()
+
+    def _count_cancelled(self, name):
+        with self._stats_lock:
+            self.cancellations[name] += 1
+
+    def _log_turn(self, conversation_id, route, timings, turn=None):
+        logger.info("chat turn", extra={"event": "chat_turn", "conversation_id": conversation_id,
+                                        "route": route, "timings_ms": timings})
+        if turn is not None:
+            turn["route"] = route
+
+    def _trace_begin(self, conversation_id, tenant, user_message, stream=False):
+        # Trace record for this turn when traffic recording is on (traffic_trace.py), else None
+        if self.traffic_trace is None:
+            return None
+        return self.traffic_trace.begin(conversation_id, tenant.tenant_id, user_message, stream)
+
+    def _check_budget(self, conversation_id, tenant):
+        # "ok", "budget" (fast tier only) or "limit" (canned answer) for this turn
+        budget = self.usage_ledger.check(conversation_id, tenant.tenant_id)
+        if budget != "ok":
+            logger.info("usage budget", extra={"event": "usage_budget", "conversation_id": conversation_id,
+                                               "tenant": tenant.tenant_id, "budget": budget})
+        return budget
+
+    def _record_call(self, provider, start, turn=None, failed=False, usage=None, conversation_id=None, tenant=None):
+        seconds = time.perf_counter() - start
+        self.model_router.record(provider, seconds, failed=failed)
+        usage = usage or {}
+        self.usage_ledger.record(conversation_id, tenant.tenant_id if tenant is not None else None, provider.name,
+                                 usage.get("input_tokens", 0), usage.get("output_tokens", 0), seconds * 1000, failed)
+        if turn is not None:
+            turn["calls"].append({"tier": provider.name, "ms": round(seconds * 1000, 2), "ok": not failed})
+
+    def chat_stream(self, user_message, conversation_id="default", cancel=None, tenant=None):
+        """
+        Stream a reply as ("token", text) events followed by one ("done", full_text).
+
+        Human transfers and errors produce only the "done" event. The cleaned
+        full text is what gets stored in the conversation history. If cancel
+        fires, the stream just ends (no "done").
+        """
+        start = time.perf_counter()
+        tenant = tenant or self.tenants.default
+        conversation_id = tenant.key(conversation_id)
+        turn = self._trace_begin(conversation_id, tenant, user_message, stream=True)
+        # Until a reply is handed over, an ending stream means the client went away
+        outcome = "cancelled"
+        try:
+            with self.conversation_locks.hold(conversation_id):
+                transfer_message = self._human_transfer(user_message, conversation_id, tenant)
+                if transfer_message is not None:
+                    self._log_turn(conversation_id, "human", {'total': _elapsed_ms(start)}, turn)
+                    outcome = "ok"
+                    yield "done", transfer_message
+                    return
+
+                if conversation_id not in self.conversations:
+                    self.conversations[conversation_id] = []
+
+                history = self.conversations[conversation_id]
+
+                local_answer = self._local_answer(user_message, tenant, history)
+                if local_answer is not None:
+                    self._remote_covered(conversation_id, history)
+                    self._record_turn(conversation_id, history, user_message, local_answer)
+                    self._log_turn(conversation_id, "local", {'total': _elapsed_ms(start)}, turn)
+                    outcome = "ok"
+                    yield "done", local_answer
+                    return
+
+                budget = self._check_budget(conversation_id, tenant)
+                if budget == "limit":
+                    self._remote_covered(conversation_id, history)
+                    self._record_turn(conversation_id, history, user_message, config.USAGE_LIMIT_MESSAGE)
+                    self._log_turn(conversation_id, "limit", {'total': _elapsed_ms(start)}, turn)
+                    outcome = "ok"
+                    yield "done", config.USAGE_LIMIT_MESSAGE
+                    return
+
+                pieces = []
+                with self._upstream_call():
+                    for piece in self._stream_response(user_message, history, cancel, conversation_id=conversation_id,
+                                                       tenant=tenant, turn=turn, cheap=budget == "budget"):
+                        pieces.append(piece)
+                        yield "token", piece
+
+                response_text = self._clean_response("".join(pieces).strip())
+                self._finish_abandoned(cancel)
+                self._record_turn(conversation_id, history, user_message, response_text)
+                self._log_turn(conversation_id, "llm", {'total': _elapsed_ms(start)}, turn)
+            outcome = "ok"
+            yield "done", response_text
+
+        except Cancelled:
+            return
         except Exception:
-            if show_typing:
-                self.typing_indicator.stop()
-            return "I'm sorry, I experienced a technical issue. Please try again."
+            outcome = "error"
+            yield "done", "I'm sorry, I experienced a technical issue. Please try again."
+        finally:
+            if turn is not None:
+                self.traffic_trace.finish(turn, outcome)
+
+    def _human_transfer(self, user_message, conversation_id, tenant=None):
+        """Return the transfer message if this should go to a human agent, else None"""
+        rules = tenant.rules if tenant is not None else None
+        # Check if message should go to human first
+        should_transfer, reason = self.fallback_handler.should_transfer_to_human(user_message, rules)
+
+        if should_transfer:
+            # Flag conversation for human agent
+            self.fallback_handler.flag_conversation(conversation_id, user_message, reason)
+            self._journal({"t": "flag", "c": conversation_id,
+                           "f": self.fallback_handler.flagged_conversations[conversation_id]})
+
+            # Categorize and respond appropriately
+            category = self.fallback_handler.categorize_request(user_message, reason)
+            return self.fallback_handler.get_human_transfer_message(category, rules)
+        return None
+
+    def _local_answer(self, user_message, tenant=None, history=()):
+        """Answer from the answer pack or the intent router's templates, or None to ask the LLM"""
+        runtime = self.runtime
+        pack = runtime.answer_pack
+        # Pack answers were generated without history, so they only fit an opening message.
+        # They were checked against this snapshot's default preamble, so a tenant from
+        # before a reload doesn't get them.
+        if pack is not None and not history and (tenant is None or tenant is runtime.tenants.default):
+            answer = pack.lookup(user_message)
+            if answer is not None:
+                return answer
+        router = self.intent_router
+        if router is None:
+            return None
+        return router.answer(user_message, tenant.templates if tenant is not None else None)
+
+    def answer_once(self, user_message):
+        """
+        Answer a standalone question outside any conversation, from the strong
+        tier (offline work such as building an answer pack). Raises ProviderError.
+        """
+        payload = self._build_payload(user_message, [])
+        provider = self.model_router.strong
+        start = time.perf_counter()
+        usage = {}
+        try:
+            text = provider.complete(payload, usage=usage)
+        except ProviderError:
+            self._record_call(provider, start, failed=True)
+            raise
+        self._record_call(provider, start, usage=usage)
+        return self._clean_response((text or "").strip())
+
+    def _record_turn(self, conversation_id, history, user_message, response_text):
+        previous = history[-1] if history else None
+        history.append({"role": "USER", "message": user_message})
+        history.append({"role": "CHATBOT", "message": response_text})
+
+        if len(history) > 10:
+            history = history[-10:]
+
+        self.conversations[conversation_id] = history
+        self._journal({"t": "conv", "c": conversation_id, "h": history})
+        if self.remote_conversations is not None:
+            self.remote_conversations.recorded(conversation_id, previous, history[-1])
+
+    def _remote_id(self, conversation_id, history):
+        # Provider-side conversation to continue, or None to send the history
+        if self.remote_conversations is None or conversation_id is None:
+            return None
+        return self.remote_conversations.begin(conversation_id, history)
+
+    def _remote_covered(self, conversation_id, history):
+        # Local template answers need no context from (or for) the provider
+        if self.remote_conversations is not None:
+            self.remote_conversations.covered(conversation_id, history)
+
+    @contextmanager
+    def _upstream_call(self):
+        # Counts in-flight upstream calls so drain() can wait for them
+        with self._inflight_cond:
+            self._inflight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._inflight_cond:
+                self._inflight -= 1
+                if not self._inflight:
+                    self._inflight_cond.notify_all()
+            # Upstream latency is the baseline for what the intent router saves
+            if self._intent_router is not None:
+                self._intent_router.record_upstream(time.perf_counter() - start)
+
+    def _build_payload(self, user_message, history, remote_id=None, tenant=None):
+        # The provider adds the model for its tier
+        payload = {
+            "message": user_message,
+            "preamble": tenant.preamble if tenant is not None else self.system_message,
+            "temperature": 0.3,
+            "max_tokens": 200,
+            "connectors": []
+        }
+        if remote_id is not None:
+            # The provider has the history; the preamble isn't stored with it
+            payload["conversation_id"] = remote_id
+            return payload
+
+        chat_history = []
+        for msg in history[-6:]:
+            chat_history.append({
+                "role": msg["role"],
+                "message": msg["message"]
+            })
+        payload["chat_history"] = chat_history
+        return payload
+
+    def _generate_response(self, user_message, history, cancel=None, conversation_id=None, tenant=None, turn=None,
+                           cheap=False):
+        remote_id = self._remote_id(conversation_id, history)
+        payload = self._build_payload(user_message, history, remote_id, tenant)
+        providers = self._route(user_message, history, cheap)
 
-    def _generate_response(self, user_message, history):
         for attempt in range(self.max_retries):
+            # A draining worker finishes the current attempt but starts no new ones
+            if attempt and self.draining:
+                break
+            # Each retry fails over to the next tier
+            provider = providers[attempt % len(providers)]
+            start = time.perf_counter()
+            calling = False
+            usage = {}
             try:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-
-                chat_history = []
-                for msg in history[-6:]:
-                    chat_history.append({
-                        "role": msg["role"],
-                        "message": msg["message"]
-                    })
-
-                payload = {
-                    "model": "command-r",
-                    "message": user_message,
-                    "chat_history": chat_history,
-                    "preamble": self.create_system_message(),
-                    "temperature": 0.3,
-                    "max_tokens": 200,
-                    "connectors": []
-                }
-
-                # Small delay to show typing indicator
-                time.sleep(0.8)
-
-                response = requests.post(self.api_url, headers=headers, json=payload, timeout=30)
-
-                if response.status_code == 401:
-                    return "Authentication error. Please check your API key."
-
-                if response.status_code == 429:
-                    time.sleep(2 ** attempt)
-                    continue
-
-                if response.status_code != 200:
-                    if attempt < self.max_retries - 1:
-                        time.sleep(2 ** attempt)
-                        continue
-                    return "I'm having trouble connecting right now. Please try again."
-
-                result = response.json()
-
-                if "text" in result:
-                    generated_text = result["text"].strip()
-                    return self._clean_response(generated_text)
+                if cancel is not None:
+                    cancel.check()
+
+                calling = True
+                text = provider.complete(payload, cancel=cancel, usage=usage)
+                self._record_call(provider, start, turn, usage=usage, conversation_id=conversation_id, tenant=tenant)
+                logger.info("llm call", extra={"event": "llm_call", "model": provider.model, "tier": provider.name,
+                                               "attempt": attempt + 1, "ms": _elapsed_ms(start)})
+
+                if text is not None:
+                    if remote_id is not None:
+                        self.remote_conversations.covered(conversation_id)
+                    return self._clean_response(text.strip())
                 else:
                     return "I couldn't process that request. Could you try rephrasing?"
 
-            except requests.exceptions.Timeout:
+            except Cancelled:
+                self._count_cancelled('during_upstream' if calling else 'before_upstream')
+                raise
+
+            except ConversationNotFound:
+                # Server-side state is gone: send the history from here (not a tier failure)
+                self._remote_lost(conversation_id, provider)
+                remote_id = None
+                payload = self._build_payload(user_message, history, tenant=tenant)
+                continue
+
+            except AuthError:
+                return FailedReply("Authentication error. Please check your API key.")
+
+            except ProviderError as e:
+                self._record_call(provider, start, turn, failed=True, conversation_id=conversation_id, tenant=tenant)
+                logger.warning(f"Model {provider.model} failed (attempt {attempt + 1}): {e}",
+                               extra={"event": "llm_error", "model": provider.model, "tier": provider.name,
+                                      "attempt": attempt + 1, "ms": _elapsed_ms(start)})
                 if attempt < self.max_retries - 1:
-                    time.sleep(2 ** attempt)
+                    try:
+                        self._backoff(attempt, providers, cancel)
+                    except Cancelled:
+                        self._count_cancelled('before_upstream')
+                        raise
                     continue
-                return "The request took too long. Please try again."
+                if isinstance(e, RateLimited):
+                    break
+                if isinstance(e, ProviderTimeout):
+                    return FailedReply("The request took too long. Please try again.")
+                if isinstance(e, ProviderConnectionError):
+                    return FailedReply("Connection error. Please try again.")
+                return FailedReply("I'm having trouble connecting right now. Please try again.")
 
-            except requests.exceptions.RequestException:
+            except Exception:
+                return FailedReply("An unexpected error occurred. Please try again.")
+
+        return FailedReply("I wasn't able to process your request. Please try again later.")
+
+    def _route(self, user_message, history, cheap=False):
+        # Over a usage budget, only the fast tier: no routing (or failing over) to the strong one
+        if cheap:
+            return [self.model_router.fast]
+        return self.model_router.route(user_message, history)
+
+    def _remote_lost(self, conversation_id, provider):
+        self.remote_conversations.lost(conversation_id)
+        logger.warning(f"Provider lost conversation {conversation_id}; sending history instead",
+                       extra={"event": "remote_conversation_lost", "conversation_id": conversation_id,
+                              "model": provider.model})
+
+    def _backoff(self, attempt, providers, cancel=None):
+        # Failing over to a different tier can go straight away; retrying the same one backs off
+        if len(providers) == 1 or (attempt + 1) % len(providers) == 0:
+            pause(2 ** (attempt // len(providers)), cancel)
+
+    def _stream_response(self, user_message, history, cancel=None, conversation_id=None, tenant=None, turn=None,
+                         cheap=False):
+        """Yield text pieces from the routed model tier, failing over between tiers"""
+        remote_id = self._remote_id(conversation_id, history)
+        payload = self._build_payload(user_message, history, remote_id, tenant)
+        providers = self._route(user_message, history, cheap)
+
+        for attempt in range(self.max_retries):
+            if attempt and self.draining:
+                break
+            provider = providers[attempt % len(providers)]
+            start = time.perf_counter()
+            streamed_any = False
+            calling = False
+            usage = {}
+            try:
+                if cancel is not None:
+                    cancel.check()
+                calling = True
+                for piece in provider.stream(payload, cancel=cancel, usage=usage):
+                    streamed_any = True
+                    yield piece
+                self._record_call(provider, start, turn, usage=usage, conversation_id=conversation_id, tenant=tenant)
+                if remote_id is not None:
+                    self.remote_conversations.covered(conversation_id)
+                return
+
+            except Cancelled:
+                self._count_cancelled('during_upstream' if calling else 'before_upstream')
+                raise
+
+            except ConversationNotFound:
+                self._remote_lost(conversation_id, provider)
+                remote_id = None
+                payload = self._build_payload(user_message, history, tenant=tenant)
+                continue
+
+            except AuthError:
+                yield "Authentication error. Please check your API key."
+                return
+
+            except ProviderError as e:
+                self._record_call(provider, start, turn, failed=True, conversation_id=conversation_id, tenant=tenant)
+                # Once text has reached the client a retry would repeat it, so stop there
+                if streamed_any:
+                    return
                 if attempt < self.max_retries - 1:
-                    time.sleep(2 ** attempt)
+                    try:
+                        self._backoff(attempt, providers, cancel)
+                    except Cancelled:
+                        self._count_cancelled('before_upstream')
+                        raise
                     continue
-                return "Connection error. Please try again."
-
-            except Exception:
-                return "An unexpected error occurred. Please try again."
+                if isinstance(e, ProviderConnectionError):
+                    yield "Connection error. Please try again."
+                else:
+                    yield "I'm having trouble connecting right now. Please try again."
+                return
 
-        return "I wasn't able to process your request. Please try again later."
+        yield "I wasn't able to process your request. Please try again later."
 
     def _clean_response(self, response_text):
         if not response_text:
@@ -205,41 +639,173 @@ Always prioritize being helpful and accurate over being verbose."""
 
         return response
 
-    def stream_response(self, response_text, delay=0.02):
-        """Stream response with typewriter effect"""
-        for char in response_text:
-            print(char, end='', flush=True)
-            time.sleep(delay)
-        print()
-
-    def chat_with_effects(self, user_message, conversation_id="default", stream_output=True):
-        """Clean chat with visual effects"""
-        response = self.chat(user_message, conversation_id, show_typing=True)
+    def health_check(self):
+        """Cheap local health check: (is_healthy, message), no upstream call"""
+        if self.draining:
+            return False, "Shutting down"
+        return True, "AI assistant is ready"
+
+    def add_agent_message(self, conversation_id, message, tenant=None):
+        """Record a human agent's reply so the bot sees it as context"""
+        conversation_id = (tenant or self.tenants.default).key(conversation_id)
+        history = self.conversations.setdefault(conversation_id, [])
+        history.append({"role": "CHATBOT", "message": message})
+        self.conversations[conversation_id] = history[-10:]
+        self._journal({"t": "conv", "c": conversation_id, "h": history[-10:]})
+
+    def clear_conversation(self, conversation_id, tenant=None):
+        """Forget the history of one conversation"""
+        conversation_id = (tenant or self.tenants.default).key(conversation_id)
+        self.conversations.pop(conversation_id, None)
+        self._journal({"t": "clear", "c": conversation_id})
+
+    def conversation_keys(self):
+        """Keys of every conversation with history or a human-transfer flag here"""
+        keys = set(self.conversations)
+        if self._fallback_handler is not None:
+            keys.update(self._fallback_handler.flagged_conversations)
+        return sorted(keys)
+
+    def export_conversations(self, keys):
+        """
+        History and flag of each conversation in keys that is held here, for a
+        handoff to another node (affinity_router.py). Waits for running turns.
+        """
+        flagged = self.fallback_handler.flagged_conversations
+        exported = {}
+        for key in keys:
+            with self.conversation_locks.hold(key):
+                history, flag = self.conversations.get(key), flagged.get(key)
+                if history is not None or flag is not None:
+                    exported[key] = {"history": list(history or []), "flag": flag}
+        return exported
+
+    def import_conversations(self, conversations):
+        """Take over conversations exported by another node; returns how many"""
+        flagged = self.fallback_handler.flagged_conversations
+        for key, state in conversations.items():
+            with self.conversation_locks.hold(key):
+                if state.get("history"):
+                    history = list(state["history"])[-10:]
+                    self.conversations[key] = history
+                    self._journal({"t": "conv", "c": key, "h": history})
+                if state.get("flag"):
+                    flagged[key] = state["flag"]
+                    self._journal({"t": "flag", "c": key, "f": state["flag"]})
+        return len(conversations)
+
+    def drop_conversations(self, keys):
+        """Forget conversations another node has taken over; returns how many were held"""
+        flagged = self.fallback_handler.flagged_conversations
+        dropped = 0
+        for key in keys:
+            with self.conversation_locks.hold(key):
+                held = self.conversations.pop(key, None) is not None
+                held = flagged.pop(key, None) is not None or held
+                if held:
+                    dropped += 1
+                    self._journal({"t": "drop", "c": key})
+        return dropped
+
+    def open_journal(self, directory=None):
+        """
+        Restore conversations and flags from the journal in directory
+        (JOURNAL_DIR by default), then keep journaling every change.
+
+        Returns the number of records replayed, or None if journaling is off
+        or another process already owns the directory.
+        """
+        from journal import Journal, JournalLocked
+
+        directory = directory or config.JOURNAL_DIR
+        if not directory or self.journal is not None:
+            return None
+        try:
+            journal = Journal(directory, config.JOURNAL_SYNC_INTERVAL, config.JOURNAL_COMPACT_BYTES)
+        except JournalLocked:
+            logger.warning(f"Journal {directory} is held by another process; running without it")
+            return None
+
+        records = journal.replay()
+        flagged = self.fallback_handler.flagged_conversations
+        for record in records:
+            kind, conversation_id = record["t"], record["c"]
+            if kind == "conv":
+                self.conversations[conversation_id] = record["h"]
+            elif kind == "clear":
+                self.conversations.pop(conversation_id, None)
+            elif kind == "drop":
+                self.conversations.pop(conversation_id, None)
+                flagged.pop(conversation_id, None)
+            elif kind == "flag":
+                flagged[conversation_id] = record["f"]
+
+        journal.start(snapshot_source=self._journal_snapshot)
+        self.journal = journal
+        logger.info(f"Restored {len(self.conversations)} conversations and {len(flagged)} flags from {directory}")
+        return len(records)
+
+    def close_journal(self):
+        """Flush the journal to disk and stop journaling"""
+        if self.journal is not None:
+            journal, self.journal = self.journal, None
+            journal.close()
+
+    def _journal(self, record):
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def _journal_snapshot(self):
+        # Called on the journal's writer thread; copy before iterating
+        for conversation_id, history in list(self.conversations.items()):
+            yield {"t": "conv", "c": conversation_id, "h": list(history)}
+        if self._fallback_handler is not None:
+            for conversation_id, flag in list(self._fallback_handler.flagged_conversations.items()):
+                yield {"t": "flag", "c": conversation_id, "f": flag}
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+_shared_bot = None
+_shared_lock = threading.Lock()
+
+
+def get_bot():
+    """Return the process-wide bot, creating it on first use"""
+    global _shared_bot
+    if _shared_bot is None:
+        with _shared_lock:
+            if _shared_bot is None:
+                _shared_bot = CustomerSupportBot()
+    return _shared_bot
+
+
+def try_get_bot():
+    """Like get_bot(), but log and return None if the bot can't be created"""
+    try:
+        return get_bot()
+    except Exception as e:
+        logger.error(f"Failed to initialize bot: {e}")
+        return None
 
-        if stream_output:
-            print("Bot: ", end='', flush=True)
-            self.stream_response(response)
-        else:
-            print(f"Bot: {response}")
 
-        return response
+def shutdown(timeout=30):
+    """Drain the shared bot if it was ever created, then flush its journal, traffic trace and usage totals"""
+    if _shared_bot is not None:
+        drained = _shared_bot.drain(timeout)
+        if _shared_bot.config_reloader is not None:
+            _shared_bot.config_reloader.stop()
+        _shared_bot.close_journal()
+        if _shared_bot.traffic_trace is not None:
+            _shared_bot.traffic_trace.flush()
+        _shared_bot.usage_ledger.stop()
+        return drained
+    return True
 
 
-# Simple usage example
 if __name__ == "__main__":
-    try:
-        bot = CustomerSupportBot()
-        print("🤖 Customer Support Bot Ready!")
-        print("Type 'quit' to exit\n")
-
-        while True:
-            user_input = input("You: ")
-            if user_input.lower() in ['quit', 'exit']:
-                print("Bot: Goodbye! 👋")
-                break
-
-            if user_input.strip():
-                bot.chat_with_effects(user_input)
-
-    except Exception as e:
-        print(f"Error starting bot: {e}")
\ No newline at end of file
+    # The interactive terminal chat lives in cli.py
+    from cli import main
+    main()
@@ -0,0 +1,94 @@
+# cancellation.py
+# Cancelling a chat turn when nobody is waiting for the answer any more.
+#
+# A CancelToken is handed to bot.chat / bot.chat_stream. The retry loop checks
+# it before every attempt and sleeps on it instead of time.sleep, and the
+# provider closes the upstream response when it fires, which stops the
+# generation on Cohere's side. The interrupted call raises Cancelled.
+
+import asyncio
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+import config
+
+
+class Cancelled(Exception):
+    """The turn was cancelled because its client went away"""
+
+
+class CancelToken:
+    """Thread-safe, one-way cancellation flag with callbacks"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        """Run callback when cancelled (now, if already); returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raise Cancelled if the token has fired"""
+        if self._event.is_set():
+            raise Cancelled()
+
+    def sleep(self, seconds):
+        """time.sleep that wakes up and raises Cancelled as soon as the token fires"""
+        if self._event.wait(seconds):
+            raise Cancelled()
+
+
+def pause(seconds, cancel=None):
+    """Sleep, cut short by cancel if one is given"""
+    if cancel is None:
+        time.sleep(seconds)
+    else:
+        cancel.sleep(seconds)
+
+
+async def run_until_disconnect(request, fn, *args, **kwargs):
+    """
+    Run the blocking fn(*args, cancel=token, **kwargs) in the threadpool and
+    fire the token if the HTTP client disconnects first. Returns fn's result
+    or raises Cancelled.
+    """
+    cancel = CancelToken()
+    work = asyncio.ensure_future(run_in_threadpool(fn, *args, cancel=cancel, **kwargs))
+    while True:
+        done, _ = await asyncio.wait({work}, timeout=config.DISCONNECT_POLL_INTERVAL)
+        if done:
+            return work.result()
+        if await request.is_disconnected():
+            cancel.cancel()
+            # The worker thread notices within one check and raises Cancelled
+            return await work
@@ -0,0 +1,404 @@
+# channel_inbox.py
+# Inbound messages from messaging channels (WhatsApp and SMS gateways).
+# Gateways want their webhook answered within a second or two, and a bot turn
+# takes longer, so POST /webhooks/{channel} (api.py) only checks the message
+# and commits it to a local SQLite queue before answering. Worker threads then
+# run the turns through the bot and hand the replies to an outbound sender.
+#
+# - Durable: a message is acknowledged only once it is committed. If a
+#   process dies while handling one, another worker takes it over when its
+#   lease (INBOX_LEASE seconds) runs out.
+# - Ordered: one message per conversation is in progress at a time, taken
+#   in arrival order; different conversations run in parallel.
+# - Deduplicated: a gateway redelivering a message (same channel and id) is
+#   acknowledged without queueing it again.
+# - Retried: a failed send (or turn: the bot's FailedReply apology is never
+#   sent as the answer) is retried with exponential backoff up
+#   to INBOX_MAX_ATTEMPTS times, then dead-lettered until an operator
+#   requeues it (POST /admin/inbox/dead/{id}/retry). A reply that was
+#   generated is kept, so retrying the send doesn't run the turn again.
+#
+#   python channel_inbox.py --messages 2000    # ack latency and drain throughput
+
+import argparse
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import requests
+
+from bot import FailedReply
+import config
+
+logger = logging.getLogger("channel_inbox")
+
+CHANNEL_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    conversation_key TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    reply TEXT,
+    error TEXT,
+    received REAL NOT NULL,
+    finished REAL,
+    UNIQUE (channel, external_id)
+);
+CREATE INDEX IF NOT EXISTS messages_open ON messages (conversation_key, id) WHERE state IN ('queued', 'claimed');
+CREATE INDEX IF NOT EXISTS messages_finished ON messages (finished) WHERE state = 'done';
+"""
+
+# The oldest unfinished message of each conversation, if it is due (or its lease ran out)
+CLAIM = """
+SELECT * FROM messages AS m
+WHERE ((m.state = 'queued' AND m.next_attempt <= :now) OR (m.state = 'claimed' AND m.lease_until <= :now))
+  AND m.id = (SELECT MIN(id) FROM messages
+              WHERE conversation_key = m.conversation_key AND state IN ('queued', 'claimed'))
+ORDER BY m.id
+LIMIT 1
+"""
+
+
+class TurnFailed(Exception):
+    """The bot couldn't answer the message (upstream down or timing out)"""
+
+
+class InboxStore:
+    """The SQLite queue; safe to share between threads and between processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _conn(self):
+        # One connection per process (never used across a fork), serialized by _lock
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            # Messages are acknowledged once committed, so a commit has to survive a power cut
+            db.execute("PRAGMA synchronous=FULL")
+            db.executescript(SCHEMA)
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn().execute(sql, params)
+
+    def enqueue(self, channel, external_id, tenant, conversation_id, conversation_key, sender, text):
+        """(message id, duplicate); a known (channel, external_id) is not queued again"""
+        with self._lock:
+            db = self._conn()
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO messages (channel, external_id, tenant, conversation_id, conversation_key,"
+                " sender, text, received) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (channel, external_id, tenant, conversation_id, conversation_key, sender, text, time.time()))
+            if cursor.rowcount:
+                return cursor.lastrowid, False
+            row = db.execute("SELECT id FROM messages WHERE channel = ? AND external_id = ?",
+                             (channel, external_id)).fetchone()
+            return row["id"], True
+
+    def claim(self, lease):
+        """The next message to work on (as a dict), leased for lease seconds; None if none is due"""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(CLAIM, {"now": now}).fetchone()
+                if row is not None:
+                    db.execute("UPDATE messages SET state = 'claimed', lease_until = ?, attempts = attempts + 1"
+                               " WHERE id = ?", (now + lease, row["id"]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        message = dict(row)
+        message["attempts"] += 1
+        return message
+
+    def save_reply(self, message_id, reply, lease):
+        self._execute("UPDATE messages SET reply = ?, lease_until = ? WHERE id = ?",
+                      (reply, time.time() + lease, message_id))
+
+    def finish(self, message_id):
+        self._execute("UPDATE messages SET state = 'done', finished = ?, error = NULL WHERE id = ?",
+                      (time.time(), message_id))
+
+    def fail(self, message_id, error, retry_in):
+        """Queue the message again in retry_in seconds, or dead-letter it if retry_in is None"""
+        if retry_in is None:
+            self._execute("UPDATE messages SET state = 'dead', error = ?, finished = ? WHERE id = ?",
+                          (error, time.time(), message_id))
+        else:
+            self._execute("UPDATE messages SET state = 'queued', error = ?, next_attempt = ? WHERE id = ?",
+                          (error, time.time() + retry_in, message_id))
+
+    def requeue(self, message_id):
+        """Give a dead-lettered message a fresh set of attempts; False if it isn't dead-lettered"""
+        cursor = self._execute("UPDATE messages SET state = 'queued', attempts = 0, next_attempt = 0, finished = NULL"
+                               " WHERE id = ? AND state = 'dead'", (message_id,))
+        return cursor.rowcount == 1
+
+    def dead(self, limit=100):
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT id, channel, external_id, tenant, conversation_id, sender, text, attempts, error, received"
+                " FROM messages WHERE state = 'dead' ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        """Messages by state, and the age of the oldest one still open"""
+        with self._lock:
+            db = self._conn()
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall())
+            oldest = db.execute("SELECT MIN(received) FROM messages WHERE state IN ('queued', 'claimed')").fetchone()[0]
+        return counts, (time.time() - oldest if oldest is not None else 0.0)
+
+    def prune(self, older_than):
+        """Drop delivered messages finished more than older_than seconds ago"""
+        return self._execute("DELETE FROM messages WHERE state = 'done' AND finished < ?",
+                             (time.time() - older_than,)).rowcount
+
+
+class WebhookSender:
+    """Post each reply as JSON to the gateway's send endpoint"""
+
+    def __init__(self, url, token="", timeout=10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, message, reply):
+        headers = {"Idempotency-Key": f"{message['channel']}:{message['external_id']}"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        response = self.session.post(self.url, json={
+            "channel": message["channel"],
+            "to": message["sender"],
+            "conversation_id": message["conversation_id"],
+            "in_reply_to": message["external_id"],
+            "text": reply
+        }, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class ChannelInbox:
+    """
+    Accepts channel messages into the store and works through them on a pool
+    of threads: bot turn, then sender.send(message, reply). get_bot returns
+    the bot; any sender with that send method can be plugged in.
+    """
+
+    def __init__(self, store, sender, get_bot, workers=config.INBOX_WORKERS, max_attempts=config.INBOX_MAX_ATTEMPTS,
+                 retry_backoff=config.INBOX_RETRY_BACKOFF, lease=config.INBOX_LEASE, poll_interval=0.5):
+        self.store = store
+        self.sender = sender
+        self.get_bot = get_bot
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self.stats = {'received': 0, 'duplicates': 0, 'processed': 0, 'sent': 0, 'retried': 0, 'dead': 0}
+        self._lock = threading.Lock()
+        # Finish times and seconds from receipt to delivery, for throughput and latency
+        self._delivered = deque(maxlen=10000)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._last_prune = time.monotonic()
+
+    def submit(self, channel, external_id, tenant, conversation_id, sender, text):
+        """Queue one inbound message durably; returns (message id, duplicate)"""
+        message_id, duplicate = self.store.enqueue(channel, external_id, tenant.tenant_id, conversation_id,
+                                                   tenant.key(conversation_id), sender, text)
+        self._count('duplicates' if duplicate else 'received')
+        if not duplicate:
+            self.start()
+            self._wake.set()
+        return message_id, duplicate
+
+    def start(self):
+        """Start the workers (again in a child after a fork); they also pick up messages left from before"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"inbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def requeue(self, message_id):
+        """Retry a dead-lettered message; False if there is no such message"""
+        if not self.store.requeue(message_id):
+            return False
+        self.start()
+        self._wake.set()
+        return True
+
+    def close(self, timeout=30):
+        """Stop claiming messages and wait for the ones in progress"""
+        self._stop.set()
+        self._wake.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _worker(self):
+        stop = self._stop
+        while not stop.is_set():
+            message = self.store.claim(self.lease)
+            if message is None:
+                self._maybe_prune()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._handle(message)
+
+    def _handle(self, message):
+        try:
+            reply = message["reply"]
+            if reply is None:
+                bot = self.get_bot()
+                reply = bot.chat(message["text"], message["conversation_id"], show_typing=False,
+                                 tenant=bot.tenants.get(message["tenant"]))
+                if isinstance(reply, FailedReply):
+                    raise TurnFailed(reply)
+                self.store.save_reply(message["id"], reply, self.lease)
+                self._count('processed')
+            self.sender.send(message, reply)
+        except Exception as e:
+            self._failed(message, e)
+            return
+        self.store.finish(message["id"])
+        now = time.time()
+        with self._lock:
+            self.stats['sent'] += 1
+            self._delivered.append((now, now - message["received"]))
+
+    def _failed(self, message, error):
+        if message["attempts"] >= self.max_attempts:
+            self.store.fail(message["id"], str(error), None)
+            self._count('dead')
+            logger.error(f"Dead-lettered {message['channel']} message {message['external_id']} "
+                         f"after {message['attempts']} attempts: {error}",
+                         extra={"event": "inbox_dead", "conversation_id": message["conversation_id"]})
+            return
+        retry_in = self.retry_backoff * (2 ** (message["attempts"] - 1))
+        self.store.fail(message["id"], str(error), retry_in)
+        self._count('retried')
+        logger.warning(f"{message['channel']} message {message['external_id']} failed "
+                       f"(attempt {message['attempts']}), retrying in {retry_in:.1f}s: {error}")
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune < 60:
+                return
+            self._last_prune = now
+        self.store.prune(config.INBOX_RETENTION)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def report(self):
+        counts, oldest = self.store.counts()
+        now = time.time()
+        with self._lock:
+            stats = dict(self.stats)
+            recent = [latency for finished, latency in self._delivered if now - finished <= 60]
+        return dict(stats, queued=counts.get('queued', 0), in_progress=counts.get('claimed', 0),
+                    dead_lettered=counts.get('dead', 0), oldest_open_seconds=round(oldest, 1),
+                    delivered_last_minute=len(recent),
+                    avg_delivery_seconds=round(sum(recent) / len(recent), 3) if recent else None)
+
+
+_default_inbox = None
+_default_lock = threading.Lock()
+
+
+def get_inbox():
+    """The process-wide inbox, or None while CHANNEL_SEND_URL (where replies go) is unset"""
+    global _default_inbox
+    if _default_inbox is None and config.CHANNEL_SEND_URL:
+        with _default_lock:
+            if _default_inbox is None:
+                from bot import get_bot
+                _default_inbox = ChannelInbox(InboxStore(config.INBOX_DB),
+                                              WebhookSender(config.CHANNEL_SEND_URL, config.CHANNEL_SEND_TOKEN),
+                                              get_bot)
+                atexit.register(_default_inbox.close, 5)
+    return _default_inbox
+
+
+def _benchmark(messages, workers):
+    import tempfile
+    from tenants import TenantRegistry
+
+    class EchoBot:
+        tenants = TenantRegistry()
+
+        def chat(self, message, conversation_id, show_typing=True, tenant=None):
+            time.sleep(0.002)
+            return f"Echo: {message}"
+
+    class NullSender:
+        def send(self, message, reply):
+            pass
+
+    bot = EchoBot()
+    with tempfile.TemporaryDirectory() as directory:
+        inbox = ChannelInbox(InboxStore(os.path.join(directory, "inbox.db")), NullSender(), lambda: bot,
+                             workers=workers)
+        acks = []
+        start = time.perf_counter()
+        for i in range(messages):
+            began = time.perf_counter()
+            inbox.submit("sms", f"m{i}", bot.tenants.default, f"c{i % 50}", f"+2547{i % 50:08d}", "hello")
+            acks.append(time.perf_counter() - began)
+        while inbox.stats['sent'] < messages:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        inbox.close()
+    acks.sort()
+    print(f"{messages} messages, 50 conversations, {workers} workers")
+    print(f"ack latency: p50 {acks[len(acks) // 2] * 1000:.2f} ms, p99 {acks[int(len(acks) * 0.99)] * 1000:.2f} ms")
+    print(f"drained in {elapsed:.2f}s ({messages / elapsed:.0f} messages/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Channel inbox ack latency and throughput")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=config.INBOX_WORKERS)
+    args = parser.parse_args()
+    _benchmark(args.messages, args.workers)
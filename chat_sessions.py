@@ -0,0 +1,343 @@
+# chat_sessions.py
+# WebSocket chat channel: one persistent, resumable connection per chat session
+#
+# A client opens /ws with no parameters to start a session. The hello event
+# carries the server-issued conversation_id and a secret session token. To
+# reconnect, it opens /ws?conversation_id=...&token=... and then asks for what
+# it missed with {"type": "resume", "last_seq": n}. Only the token holder can
+# attach to a session or see its replay buffer.
+#
+# Server -> client events: hello, typing, token, done, agent, ping, pong, status
+# Client -> server events: message, resume, ping, pong
+#
+# Every event except hello/ping/pong carries a per-session "seq" and is kept
+# in the replay buffer. Sessions live in one worker's memory, so pushing agent
+# replies needs a single worker (WEB_CONCURRENCY=1) or sticky routing.
+
+import asyncio
+import hmac
+import logging
+import secrets
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+import admission
+from admission import Rejected, client_key
+from cancellation import CancelToken
+import config
+from serialization import dumps, loads
+from tenants import DEFAULT_TENANT
+
+logger = logging.getLogger("chat_sessions")
+
+# Close codes (4000-4999 are free for applications)
+CLOSE_REPLACED = 4000
+CLOSE_FORBIDDEN = 4403
+
+
+class ChatSession:
+    """Event log and current connection for one conversation"""
+
+    def __init__(self, conversation_id, token, replay_size, tenant=None):
+        self.conversation_id = conversation_id
+        self.token = token
+        # tenants.Tenant the session was opened for (None: the default one)
+        self.tenant = tenant
+        self.seq = 0
+        self.buffer = deque(maxlen=replay_size)
+        self.websocket = None
+        self.outbox = None
+        self.last_active = time.monotonic()
+        # Replies in progress; asyncio keeps only weak references to tasks
+        self.pending = set()
+        # Cancel tokens of those replies, fired if the client does not come back
+        self.cancels = set()
+        # The bot answers one customer message at a time per session
+        self.turn_lock = asyncio.Lock()
+
+    def publish(self, event):
+        """Number, buffer and (if connected) send an event; event-loop thread only"""
+        self.seq += 1
+        event = dict(event, seq=self.seq)
+        self.buffer.append(event)
+        self.last_active = time.monotonic()
+        if self.outbox is not None:
+            self.outbox.put_nowait(event)
+        return event
+
+    def attach(self, websocket):
+        """Make websocket the session's connection, replacing any previous one"""
+        previous = self.websocket
+        if self.outbox is not None:
+            self.outbox.put_nowait(None)
+        self.websocket = websocket
+        self.outbox = asyncio.Queue()
+        self.last_active = time.monotonic()
+        return self.outbox, previous
+
+    def detach(self, outbox):
+        if self.outbox is outbox:
+            self.websocket = None
+            self.outbox = None
+        self.last_active = time.monotonic()
+
+    def replay(self, last_seq):
+        """Buffered events after last_seq, flagged with a gap status if some were dropped"""
+        events = [event for event in self.buffer if event['seq'] > last_seq]
+        if events and events[0]['seq'] > last_seq + 1:
+            events.insert(0, {'type': 'status', 'state': 'gap', 'seq': events[0]['seq'] - 1})
+        return events
+
+
+class ChatSessionHub:
+    """All WebSocket chat sessions in this worker (used from the event loop only)"""
+
+    def __init__(self, replay_size=config.WS_REPLAY_BUFFER, session_ttl=config.WS_SESSION_TTL):
+        self.replay_size = replay_size
+        self.session_ttl = session_ttl
+        self.sessions = {}
+        self._last_prune = time.monotonic()
+
+    def create(self, tenant=None):
+        """Start a session with a server-issued conversation id and token"""
+        self._prune()
+        conversation_id = f"web_{secrets.token_urlsafe(12)}"
+        session = ChatSession(conversation_id, secrets.token_urlsafe(24), self.replay_size, tenant)
+        self.sessions[conversation_id] = session
+        return session
+
+    def authenticate(self, conversation_id, token):
+        """The session for conversation_id if token matches it, else None"""
+        self._prune()
+        session = self.sessions.get(conversation_id)
+        if session is None or not token or not hmac.compare_digest(session.token, token):
+            return None
+        return session
+
+    def publish(self, conversation_id, event):
+        """
+        Publish to an existing session.
+
+        Returns None if this worker has no such session, otherwise whether a
+        client is connected to receive the event right away.
+        """
+        session = self.sessions.get(conversation_id)
+        if session is None:
+            return None
+        session.publish(event)
+        return session.outbox is not None
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        expired = [cid for cid, session in self.sessions.items()
+                   if session.outbox is None and now - session.last_active > self.session_ttl]
+        for cid in expired:
+            del self.sessions[cid]
+
+
+hub = ChatSessionHub()
+
+
+def origin_allowed(websocket):
+    """Browsers must come from this site (or WS_ALLOWED_ORIGINS); other clients send no Origin"""
+    origin = websocket.headers.get('origin')
+    if not origin:
+        return True
+    if origin in config.WS_ALLOWED_ORIGINS:
+        return True
+    return urlsplit(origin).netloc == websocket.headers.get('host')
+
+
+async def handle_websocket(websocket: WebSocket, bot, tenant=None):
+    """Serve one chat connection until the client leaves or goes quiet"""
+    if not origin_allowed(websocket):
+        await websocket.close(code=CLOSE_FORBIDDEN)
+        return
+
+    # Accept first so a refused client sees the close code and starts a new session
+    await websocket.accept()
+    conversation_id = websocket.query_params.get('conversation_id')
+    if conversation_id:
+        session = hub.authenticate(conversation_id, websocket.query_params.get('token'))
+        if session is None or _tenant_id(session.tenant) != _tenant_id(tenant):
+            await _close_quietly(websocket, code=CLOSE_FORBIDDEN)
+            return
+    else:
+        session = hub.create(tenant)
+
+    outbox, previous = session.attach(websocket)
+    if previous is not None:
+        await _close_quietly(previous, code=CLOSE_REPLACED)
+
+    sender = asyncio.create_task(_send_loop(websocket, outbox))
+    # Tells the client its session and whether it missed anything
+    outbox.put_nowait({
+        'type': 'hello',
+        'conversation_id': session.conversation_id,
+        'token': session.token,
+        'last_seq': session.seq
+    })
+
+    last_seen = time.monotonic()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=config.WS_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_seen > config.WS_IDLE_TIMEOUT:
+                    break
+                outbox.put_nowait({'type': 'ping'})
+                continue
+
+            if message['type'] == 'websocket.disconnect':
+                break
+            last_seen = time.monotonic()
+
+            data = _parse_event(message)
+            if data is None:
+                outbox.put_nowait(_error('Invalid event'))
+                continue
+
+            kind = data.get('type')
+            if kind == 'message':
+                text = str(data.get('text', '')).strip()
+                if text:
+                    _start_reply(session, bot, text, outbox, client_key(websocket))
+            elif kind == 'resume':
+                last_seq = data.get('last_seq', 0)
+                if not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0:
+                    outbox.put_nowait(_error('last_seq must be a non-negative integer'))
+                    continue
+                for event in session.replay(last_seq):
+                    outbox.put_nowait(event)
+            elif kind == 'ping':
+                outbox.put_nowait({'type': 'pong'})
+            elif kind != 'pong':
+                outbox.put_nowait(_error(f'Unknown event: {kind}'))
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.detach(outbox)
+        outbox.put_nowait(None)
+        await sender
+        await _close_quietly(websocket)
+        if session.pending:
+            # Replies keep going for a client that resumes; otherwise they are cancelled
+            _keep(asyncio.create_task(_cancel_if_abandoned(session)))
+
+
+def _parse_event(message):
+    # Only JSON objects in text frames are events
+    text = message.get('text')
+    if text is None:
+        return None
+    try:
+        data = loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _tenant_id(tenant):
+    return tenant.tenant_id if tenant is not None else DEFAULT_TENANT
+
+
+def _conversation_key(session):
+    # Rate limits are per tenant conversation, like the bot's history
+    return session.tenant.key(session.conversation_id) if session.tenant is not None else session.conversation_id
+
+
+def _error(message):
+    return {'type': 'status', 'state': 'error', 'message': message}
+
+
+def _busy(rejected):
+    # Not buffered: the message was never accepted, so there is nothing to replay
+    return {'type': 'status', 'state': 'busy', 'message': rejected.reason,
+            'retry_after': max(1, round(rejected.retry_after))}
+
+
+def _start_reply(session, bot, text, outbox, client):
+    if len(session.pending) >= config.WS_MAX_PENDING_TURNS:
+        outbox.put_nowait(_error('Too many messages waiting for a reply, please wait'))
+        return
+    try:
+        admission.chat_admission.check_rate(client, _conversation_key(session), _tenant_id(session.tenant))
+    except Rejected as rejected:
+        outbox.put_nowait(_busy(rejected))
+        return
+    task = asyncio.create_task(_bot_reply(session, bot, text))
+    session.pending.add(task)
+    task.add_done_callback(session.pending.discard)
+
+
+# Background tasks not owned by a session
+_background = set()
+
+
+def _keep(task):
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _cancel_if_abandoned(session):
+    await asyncio.sleep(config.WS_RESUME_GRACE)
+    if session.outbox is None:
+        for cancel in list(session.cancels):
+            cancel.cancel()
+
+
+async def _bot_reply(session, bot, text):
+    loop = asyncio.get_running_loop()
+    cancel = CancelToken()
+
+    def stream():
+        # Worker thread: hand each event back to the loop in order
+        for kind, piece in bot.chat_stream(text, session.conversation_id, cancel=cancel, tenant=session.tenant):
+            loop.call_soon_threadsafe(session.publish, {'type': kind, 'text': piece})
+
+    async with session.turn_lock:
+        try:
+            async with admission.chat_admission.controller.admit(_tenant_id(session.tenant)):
+                session.publish({'type': 'typing', 'state': True})
+                session.cancels.add(cancel)
+                try:
+                    await run_in_threadpool(stream)
+                except Exception as e:
+                    logger.error(f"WebSocket reply failed - Conv: {session.conversation_id}: {e}")
+                    session.publish({'type': 'done',
+                                     'text': "I'm sorry, I experienced a technical issue. Please try again."})
+                finally:
+                    session.cancels.discard(cancel)
+                    session.publish({'type': 'typing', 'state': False})
+        except Rejected as rejected:
+            # Sent to whichever connection the session has now
+            if session.outbox is not None:
+                session.outbox.put_nowait(_busy(rejected))
+
+
+async def _send_loop(websocket, outbox):
+    while True:
+        event = await outbox.get()
+        if event is None:
+            return
+        try:
+            await websocket.send_text(dumps(event).decode())
+        except Exception:
+            # Connection is gone; whatever was buffered can be resumed
+            return
+
+
+async def _close_quietly(websocket, code=1000):
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass
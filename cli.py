@@ -1,31 +1,118 @@
 # cli.py
-# Command-line interface for testing the bot
+# Command-line interface for testing the bot. Everything that draws on the
+# terminal (typing animation, typewriter output) lives here; the bot itself
+# never starts a thread or writes to stdout for a reply.
+#
+#   python cli.py            # animated
+#   python cli.py --plain    # replies printed as they are
+
+import argparse
+import threading
+import time
 
 from bot import CustomerSupportBot
+from log_pipeline import setup_logging
+
+
+class TypingIndicator:
+    """
+    "Bot is typing..." animation while a reply is generated, shown for at
+    least min_visible seconds so a fast reply doesn't just flicker it.
+    One conversation at a time: the terminal has only one bottom line.
+    """
+
+    def __init__(self, message="🤖 Bot is typing", min_visible=0.8):
+        self.message = message
+        self.min_visible = min_visible
+        self.is_typing = False
+        self.thread = None
+        self.started = None
+
+    def start(self):
+        self.is_typing = True
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._animate)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.started is not None:
+            time.sleep(max(0, self.min_visible - (time.monotonic() - self.started)))
+        self.is_typing = False
+        if self.thread:
+            self.thread.join()
+        # Clear the line completely
+        print('\r' + ' ' * 60 + '\r', end='', flush=True)
+
+    def _animate(self):
+        dots = ""
+        while self.is_typing:
+            for i in range(4):
+                if not self.is_typing:
+                    break
+                dots = "." * i
+                print(f'\r{self.message}{dots}   ', end='', flush=True)
+                time.sleep(0.4)
+
 
+def stream_response(response_text, delay=0.02):
+    """Stream response with typewriter effect"""
+    for char in response_text:
+        print(char, end='', flush=True)
+        time.sleep(delay)
+    print()
 
-def run_cli():
+
+def chat_with_effects(bot, user_message, conversation_id="default", stream_output=True):
+    """Clean chat with visual effects"""
+    response = bot.chat(user_message, conversation_id, show_typing=True)
+
+    if stream_output:
+        print("Bot: ", end='', flush=True)
+        stream_response(response)
+    else:
+        print(f"Bot: {response}")
+
+    return response
+
+
+def run_cli(effects=True):
     """Simple command-line interface for testing the bot"""
     print("Customer Support Bot CLI")
     print("Type 'exit' to quit")
     print("-" * 50)
 
     bot = CustomerSupportBot()
+    if effects:
+        bot.typing_indicator = TypingIndicator()
     conversation_id = "cli-session"
 
     while True:
         user_input = input("\nYou: ")
 
-        if user_input.lower() == "exit":
+        if user_input.lower() in ("exit", "quit"):
             print("Thank you for using the Customer Support Bot!")
             break
+        if not user_input.strip():
+            continue
 
         try:
-            response = bot.chat(user_input, conversation_id)
-            print(f"\nBot: {response}")
+            if effects:
+                chat_with_effects(bot, user_input, conversation_id)
+            else:
+                response = bot.chat(user_input, conversation_id)
+                print(f"\nBot: {response}")
         except Exception as e:
             print(f"\nError: {str(e)}")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Chat with the bot in the terminal")
+    parser.add_argument("--plain", action="store_true", help="no typing animation or typewriter output")
+    args = parser.parse_args()
+    setup_logging()
+    run_cli(effects=not args.plain)
+
+
 if __name__ == "__main__":
-    run_cli()
\ No newline at end of file
+    main()
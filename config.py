@@ -1,13 +1,35 @@
 # config.py - Updated for Cohere API
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+
+def _find_env_file():
+    """ENV_FILE if set, else the nearest .env in this directory or a parent (as load_dotenv() does)"""
+    if os.getenv("ENV_FILE"):
+        return os.getenv("ENV_FILE")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(directory, ".env")
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+# Only pay for python-dotenv when there is a .env file to read; on platforms that
+# inject config vars (Heroku, containers) this keeps the import free.
+ENV_FILE = _find_env_file()
+if ENV_FILE and os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 
 # Updated to use Cohere instead of Hugging Face
 COHERE_API_KEY = os.getenv("COHERE_API_KEY", "")
 COMPANY_NAME = os.getenv("COMPANY_NAME", "Mshauri Tech")
 MAX_HISTORY = int(os.getenv("MAX_HISTORY", 5))
+COHERE_API_URL = os.getenv("COHERE_API_URL", "https://api.cohere.ai/v1/chat")
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))  # upstream attempts per turn
 
 PRODUCT_INFO = """
 # Mshauri Tech Products & Services
@@ -19,4 +41,161 @@ PRODUCT_INFO = """
 - Support email: support@mshauri.tech
 
 Our solutions help businesses automate customer support, gain insights from customer interactions, and manage multi-channel communications efficiently.
-"""
\ No newline at end of file
+"""
+
+# Human agent notifications (see notifications.py)
+NOTIFY_WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL", "")
+NOTIFY_SMTP_HOST = os.getenv("NOTIFY_SMTP_HOST", "")
+NOTIFY_SMTP_PORT = int(os.getenv("NOTIFY_SMTP_PORT", 25))
+NOTIFY_SMTP_USER = os.getenv("NOTIFY_SMTP_USER", "")
+NOTIFY_SMTP_PASSWORD = os.getenv("NOTIFY_SMTP_PASSWORD", "")
+NOTIFY_SMTP_TLS = os.getenv("NOTIFY_SMTP_TLS", "false").lower() == "true"
+NOTIFY_EMAIL_FROM = os.getenv("NOTIFY_EMAIL_FROM", "bot@mshauri.tech")
+NOTIFY_EMAIL_TO = [addr.strip() for addr in os.getenv("NOTIFY_EMAIL_TO", "").split(",") if addr.strip()]
+NOTIFY_FILE = os.getenv("NOTIFY_FILE", "")
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 20))
+NOTIFY_BATCH_INTERVAL = float(os.getenv("NOTIFY_BATCH_INTERVAL", 1.0))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", 5))
+NOTIFY_DEDUPE_WINDOW = int(os.getenv("NOTIFY_DEDUPE_WINDOW", 300))
+
+
+# Production server (see gunicorn.conf.py)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 0))  # 0 = size to CPU cores
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", 40))  # blocking bot.chat calls per worker
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", THREADPOOL_SIZE))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", 5000))
+MAX_WORKER_MEMORY_MB = int(os.getenv("MAX_WORKER_MEMORY_MB", 512))
+
+# Startup budget checked by startup_report.py --check
+STARTUP_BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", 1500))
+
+# WebSocket chat channel (see chat_sessions.py)
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 20))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 60))
+WS_REPLAY_BUFFER = int(os.getenv("WS_REPLAY_BUFFER", 200))
+WS_SESSION_TTL = int(os.getenv("WS_SESSION_TTL", 1800))
+WS_MAX_PENDING_TURNS = int(os.getenv("WS_MAX_PENDING_TURNS", 3))
+# Extra origins allowed to open the socket (same-origin pages are always allowed)
+WS_ALLOWED_ORIGINS = [o.strip() for o in os.getenv("WS_ALLOWED_ORIGINS", "").split(",") if o.strip()]
+
+# Bearer token for agent/admin endpoints; they are disabled while it is empty
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Admission control for chat turns (see admission.py)
+MAX_INFLIGHT_CHATS = int(os.getenv("MAX_INFLIGHT_CHATS", THREADPOOL_SIZE))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 50))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+# Messages per minute and burst size; a rate of 0 turns that limit off
+RATE_LIMIT_CLIENT_PER_MIN = float(os.getenv("RATE_LIMIT_CLIENT_PER_MIN", 30))
+RATE_LIMIT_CLIENT_BURST = int(os.getenv("RATE_LIMIT_CLIENT_BURST", 10))
+RATE_LIMIT_CONVERSATION_PER_MIN = float(os.getenv("RATE_LIMIT_CONVERSATION_PER_MIN", 12))
+RATE_LIMIT_CONVERSATION_BURST = int(os.getenv("RATE_LIMIT_CONVERSATION_BURST", 5))
+RATE_LIMIT_TENANT_PER_MIN = float(os.getenv("RATE_LIMIT_TENANT_PER_MIN", 0))
+RATE_LIMIT_TENANT_BURST = int(os.getenv("RATE_LIMIT_TENANT_BURST", 50))
+# Most turns one tenant may have waiting for a slot (0 = only ADMISSION_QUEUE_SIZE applies);
+# set it below ADMISSION_QUEUE_SIZE when serving several tenants
+TENANT_QUEUE_SIZE = int(os.getenv("TENANT_QUEUE_SIZE", 0))
+
+# Tenants (see tenants.py): JSON file of companies served besides the default one
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+
+# Runtime config file (company info, transfer rules, tuning) reloaded without a restart; see runtime_config.py
+RUNTIME_CONFIG_FILE = os.getenv("RUNTIME_CONFIG_FILE", "")
+# Seconds between checks of the runtime config and tenants files for changes
+RUNTIME_CONFIG_POLL = float(os.getenv("RUNTIME_CONFIG_POLL", 2))
+
+# Pre-generated answers to frequent questions, built by answer_pack.py (reloaded when it changes)
+ANSWER_PACK_FILE = os.getenv("ANSWER_PACK_FILE", "")
+
+# Duplicate POST /chat suppression (see idempotency.py)
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 300))  # replay window for an Idempotency-Key
+IDEMPOTENCY_WINDOW = float(os.getenv("IDEMPOTENCY_WINDOW", 10))  # same message, no key; 0 = off
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000))
+
+# POST /chat/batch (see batch.py)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))  # turns of one batch running at once
+
+# Messaging channel webhooks (see channel_inbox.py); off while CHANNEL_SEND_URL is empty
+CHANNEL_SEND_URL = os.getenv("CHANNEL_SEND_URL", "")  # gateway endpoint replies are posted to
+CHANNEL_SEND_TOKEN = os.getenv("CHANNEL_SEND_TOKEN", "")  # sent as a bearer token with each reply
+CHANNEL_WEBHOOK_TOKEN = os.getenv("CHANNEL_WEBHOOK_TOKEN", "")  # required X-Webhook-Token on inbound calls
+INBOX_DB = os.getenv("INBOX_DB", "inbox.db")
+INBOX_WORKERS = int(os.getenv("INBOX_WORKERS", 4))
+INBOX_MAX_ATTEMPTS = int(os.getenv("INBOX_MAX_ATTEMPTS", 5))
+INBOX_RETRY_BACKOFF = float(os.getenv("INBOX_RETRY_BACKOFF", 2))  # seconds, doubled per attempt
+INBOX_LEASE = float(os.getenv("INBOX_LEASE", 120))  # seconds before another worker takes over a message
+INBOX_RETENTION = float(os.getenv("INBOX_RETENTION", 86400))  # seconds delivered messages are kept
+
+# Traffic traces for capacity planning (see traffic_trace.py)
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # JSON line per chat turn; "{pid}" gives each worker its own; empty = off
+TRACE_SALT = os.getenv("TRACE_SALT", "")  # key for hashing conversation ids; random per process if empty
+
+# Token and cost accounting, and budgets (see usage_ledger.py)
+USAGE_DB = os.getenv("USAGE_DB", "")  # SQLite file the workers flush their totals to; empty = in memory only
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 10))  # seconds of totals a crash can lose
+USAGE_STRIPES = int(os.getenv("USAGE_STRIPES", 16))  # independently locked shards of the totals
+# USD per million input/output tokens, by model tier
+USAGE_PRICES = os.getenv("USAGE_PRICES", "fast=0.0375/0.15,strong=0.15/0.6")
+# Tokens a day (0 = no budget): past a budget, turns use the fast tier only;
+# past a limit, they get USAGE_LIMIT_MESSAGE instead of an LLM call
+USAGE_CONVERSATION_BUDGET = int(os.getenv("USAGE_CONVERSATION_BUDGET", 0))
+USAGE_CONVERSATION_LIMIT = int(os.getenv("USAGE_CONVERSATION_LIMIT", 0))
+USAGE_TENANT_BUDGET = int(os.getenv("USAGE_TENANT_BUDGET", 0))
+USAGE_TENANT_LIMIT = int(os.getenv("USAGE_TENANT_LIMIT", 0))
+USAGE_LIMIT_MESSAGE = os.getenv(
+    "USAGE_LIMIT_MESSAGE",
+    "I can't look into this any further right now. If you need more help, ask for a human agent and our team "
+    "will take it from here.")
+
+# Memory diagnostics (see memory_diagnostics.py)
+MEMORY_SAMPLE_FILE = os.getenv("MEMORY_SAMPLE_FILE", "")  # JSON lines; "{pid}" gives each worker its own; empty = off
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", 300))  # seconds between samples
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", 1))  # frames kept per allocation while tracing
+
+# Affinity router in front of several bot nodes (see affinity_router.py)
+ROUTER_NODES = os.getenv("ROUTER_NODES", "")  # comma-separated node base URLs
+ROUTER_VNODES = int(os.getenv("ROUTER_VNODES", 160))  # ring points per node; more = more even spread
+ROUTER_POOL_SIZE = int(os.getenv("ROUTER_POOL_SIZE", 100))  # pooled connections to the nodes
+ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", 60))  # seconds per proxied request, and per handoff wait
+
+# Local intent router (see intent_router.py)
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "")
+INTENT_CONFIDENCE = float(os.getenv("INTENT_CONFIDENCE", 0.8))
+INTENT_MAX_WORDS = int(os.getenv("INTENT_MAX_WORDS", 10))
+
+# LLM providers and model tiers (see providers.py)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "cohere")  # "cohere" or "mock" (no network, no API key)
+MODEL_FAST = os.getenv("MODEL_FAST", "command-r7b-12-2024")
+MODEL_STRONG = os.getenv("MODEL_STRONG", "command-r")
+MODEL_COMPLEX_WORDS = int(os.getenv("MODEL_COMPLEX_WORDS", 25))  # longer messages go to the strong tier
+MODEL_SLOW_MS = float(os.getenv("MODEL_SLOW_MS", 5000))  # tiers slower than this are tried second
+MODEL_MAX_FAILURES = int(os.getenv("MODEL_MAX_FAILURES", 3))  # consecutive failures before a tier is down
+MODEL_COOLDOWN = float(os.getenv("MODEL_COOLDOWN", 30))
+
+# Logging (see log_pipeline.py)
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")  # "-" for stderr; "{pid}" gives each worker its own file
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+# Share of high-volume events to keep; warnings, errors and escalations are always kept
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "chat_request=0.1,chat_turn=0.1,llm_call=0.1")
+
+# Conversation journal for warm restarts (see journal.py); empty = off
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "")
+JOURNAL_SYNC_INTERVAL = float(os.getenv("JOURNAL_SYNC_INTERVAL", 0.05))  # seconds of turns a crash can lose
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", 64 * 1024 * 1024))
+
+# Client disconnects (see cancellation.py)
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.25))
+# Keep a reply in history when it finishes after the client has gone
+RECORD_ABANDONED_TURNS = os.getenv("RECORD_ABANDONED_TURNS", "false").lower() == "true"
+# How long a disconnected WebSocket session may take to resume before its pending replies are cancelled
+WS_RESUME_GRACE = float(os.getenv("WS_RESUME_GRACE", 15))
+
+# Conversation state upstream (see remote_conversations.py): "client" sends the
+# recent history with every call, "server" lets the provider keep it (Cohere conversation_id)
+UPSTREAM_HISTORY_MODE = os.getenv("UPSTREAM_HISTORY_MODE", "client")
+REMOTE_CONVERSATIONS_MAX = int(os.getenv("REMOTE_CONVERSATIONS_MAX", 10000))  # ids remembered per worker
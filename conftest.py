@@ -0,0 +1,45 @@
+# conftest.py
+# Shared pytest fixtures: the local Cohere stand-in (mock_upstream.py) and a bot wired to it
+
+import os
+
+import pytest
+
+# The bot refuses to start without a key; nothing here talks to the real API
+os.environ.setdefault("COHERE_API_KEY", "test-key")
+# App logs go to stderr (captured by pytest) instead of bot.log in the checkout
+os.environ.setdefault("LOG_FILE", "-")
+
+import admission  # noqa: E402
+import bot as bot_module  # noqa: E402
+import config  # noqa: E402
+import idempotency  # noqa: E402
+from mock_upstream import MockUpstream  # noqa: E402
+
+
+@pytest.fixture
+def upstream():
+    stand_in = MockUpstream()
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def bot(upstream, monkeypatch):
+    """A fresh bot talking to the stand-in, installed as the shared bot"""
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    instance = bot_module.CustomerSupportBot()
+    monkeypatch.setattr(bot_module, "_shared_bot", instance)
+    return instance
+
+
+@pytest.fixture(autouse=True)
+def fresh_admission(monkeypatch):
+    """Rate-limit buckets and in-flight counts don't carry over between tests"""
+    monkeypatch.setattr(admission, "chat_admission", admission.ChatAdmission())
+
+
+@pytest.fixture(autouse=True)
+def fresh_idempotency(monkeypatch):
+    """Replies stored for duplicate suppression don't leak into the next test"""
+    monkeypatch.setattr(idempotency, "chat_idempotency", idempotency.IdempotencyStore())
@@ -0,0 +1,43 @@
+# conversation_locks.py
+# Per-conversation ordering: turns of one conversation run one at a time, in
+# the order they arrived, while different conversations run fully in parallel.
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class ConversationLocks:
+    """
+    A FIFO lock per key, created on first use and dropped when nobody holds or
+    waits for it, so memory follows the number of busy conversations.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    @contextmanager
+    def hold(self, key):
+        """Wait for every earlier holder of key, then hold it for the with block"""
+        ticket = threading.Event()
+        with self._lock:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(ticket)
+            if len(queue) == 1:
+                ticket.set()
+        ticket.wait()
+        try:
+            yield
+        finally:
+            with self._lock:
+                queue.popleft()
+                if queue:
+                    queue[0].set()
+                else:
+                    del self._queues[key]
+
+    def busy(self):
+        """Number of conversations with a turn running or waiting"""
+        with self._lock:
+            return len(self._queues)
@@ -0,0 +1,66 @@
+# gunicorn.conf.py
+# Production server: multiple uvicorn workers with preload, graceful draining
+# and memory-aware worker recycling.
+#
+#   gunicorn -c gunicorn.conf.py api:app
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import config as bot_config  # "config" is itself a gunicorn setting name
+from memory_diagnostics import current_rss
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# bot.chat is I/O bound and runs in each worker's threadpool, so one worker
+# per core is enough to use the box; WEB_CONCURRENCY overrides it.
+workers = bot_config.WEB_CONCURRENCY or multiprocessing.cpu_count()
+
+# Import the app (and build the bot, prompts and matchers) once in the master
+preload_app = True
+
+# SIGTERM: stop accepting, finish in-flight requests, then drain upstream calls
+graceful_timeout = bot_config.GRACEFUL_TIMEOUT
+timeout = 60
+keepalive = 5
+
+# Recycle workers periodically (jittered so they don't all restart together)
+max_requests = bot_config.MAX_REQUESTS
+max_requests_jitter = max(1, bot_config.MAX_REQUESTS // 10)
+
+MEMORY_CHECK_INTERVAL = 15
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported, before any worker forks"""
+    import api
+    api.preload()
+    server.log.info(f"Preloaded shared state, starting {workers} workers")
+
+
+def post_worker_init(worker):
+    """Start the per-worker memory watchdog"""
+    if bot_config.MAX_WORKER_MEMORY_MB <= 0:
+        return
+    thread = threading.Thread(target=_memory_watchdog, args=(worker,),
+                              name="memory-watchdog", daemon=True)
+    thread.start()
+
+
+def _memory_watchdog(worker):
+    limit = bot_config.MAX_WORKER_MEMORY_MB * 1024 * 1024
+    while True:
+        time.sleep(MEMORY_CHECK_INTERVAL)
+        rss = current_rss()
+        if rss > limit:
+            worker.log.warning(
+                f"Worker {worker.pid} RSS {rss // (1024 * 1024)} MB over "
+                f"{bot_config.MAX_WORKER_MEMORY_MB} MB, recycling gracefully"
+            )
+            # Same path as a normal shutdown: in-flight requests finish, the master respawns
+            os.kill(worker.pid, signal.SIGTERM)
+            return
@@ -7,51 +7,103 @@ import time
 from datetime import datetime
 import json
 
+from notifications import get_dispatcher
+
 logger = logging.getLogger("human_fallback")
 
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+
+# Keywords that trigger human agent fallback
+TRIGGER_KEYWORDS = [
+    # Purchase/Sales related
+    'buy', 'purchase', 'price', 'cost', 'pricing', 'quote', 'demo', 'trial',
+    'sales', 'sell', 'order', 'payment', 'billing', 'invoice', 'contract',
+
+    # Human agent requests
+    'human', 'agent', 'person', 'representative', 'speak to someone',
+    'talk to human', 'real person', 'customer service', 'support team',
+
+    # Complex issues
+    'urgent', 'emergency', 'complaint', 'refund', 'cancel', 'problem',
+    'issue', 'help me', 'technical support', 'not working', 'broken'
+]
+
+# Phrases that indicate need for human intervention
+TRIGGER_PHRASES = [
+    'speak to a human',
+    'talk to someone',
+    'human agent',
+    'real person',
+    'customer service',
+    'I want to buy',
+    'how much does it cost',
+    'get a quote',
+    'schedule a demo',
+    'technical issue',
+    'not satisfied',
+    'cancel my',
+    'refund my'
+]
+
+# A single one of these is enough to transfer
+STRONG_KEYWORDS = ['buy', 'purchase', 'human', 'agent', 'urgent', 'complaint']
+
+TRANSFER_MESSAGES = {
+    'sales': """I'll connect you with our sales team for detailed pricing and demos! 
 
-class HumanFallbackHandler:
-    def __init__(self):
-        # Keywords that trigger human agent fallback
-        self.trigger_keywords = [
-            # Purchase/Sales related
-            'buy', 'purchase', 'price', 'cost', 'pricing', 'quote', 'demo', 'trial',
-            'sales', 'sell', 'order', 'payment', 'billing', 'invoice', 'contract',
-
-            # Human agent requests
-            'human', 'agent', 'person', 'representative', 'speak to someone',
-            'talk to human', 'real person', 'customer service', 'support team',
-
-            # Complex issues
-            'urgent', 'emergency', 'complaint', 'refund', 'cancel', 'problem',
-            'issue', 'help me', 'technical support', 'not working', 'broken'
-        ]
-
-        # Phrases that indicate need for human intervention
-        self.trigger_phrases = [
-            'speak to a human',
-            'talk to someone',
-            'human agent',
-            'real person',
-            'customer service',
-            'I want to buy',
-            'how much does it cost',
-            'get a quote',
-            'schedule a demo',
-            'technical issue',
-            'not satisfied',
-            'cancel my',
-            'refund my'
-        ]
+📞 **Immediate Help:**
+• Call: +254703201180
+• Email: mutetie510@gmail.com
+• Book a demo: mutetie56@gmail.com
 
-        # Store conversations flagged for human review
-        self.flagged_conversations = {}
+A sales representative will contact you within 1 hour during business hours (9 AM - 6 PM EAT).""",
 
-    def should_transfer_to_human(self, message):
-        """
-        Check if message should be transferred to human agent
-        Returns: (should_transfer: bool, reason: str)
-        """
+    'support': """I'm connecting you with a human support specialist who can better assist you.
+
+👨‍💼 **Human Support:**
+• Live chat will connect shortly
+• Email: support@mshauritech.com  
+• Phone: +1 (555) 123-4567
+
+Expected response time: 15-30 minutes during business hours.""",
+
+    'technical': """This requires our technical team's expertise. I'm escalating this for you.
+
+🔧 **Technical Support:**
+• Priority ticket created
+• Email: tech@mshauritech.com
+• Your ticket ID: #{ticket_id}
+
+A technical specialist will reach out within 2 hours.""",
+
+    'general': """I'm connecting you with a human agent who can provide more personalized assistance.
+
+💬 **Human Agent:**
+• Transferring now...
+• Email: hello@mshauritech.com
+• Phone: +1 (555) 123-4567
+
+Please hold while I connect you."""
+}
+
+
+class TransferRules:
+    """
+    One company's transfer keywords, phrases and messages, compiled once.
+    Anything not given falls back to the defaults above.
+    """
+
+    def __init__(self, trigger_keywords=None, trigger_phrases=None, strong_keywords=None, transfer_messages=None):
+        self.trigger_keywords = list(TRIGGER_KEYWORDS if trigger_keywords is None else trigger_keywords)
+        self.trigger_phrases = list(TRIGGER_PHRASES if trigger_phrases is None else trigger_phrases)
+        # Set lookup for the per-word scan (built once, shared by forked workers)
+        self.keyword_set = frozenset(self.trigger_keywords)
+        self.strong_keywords = frozenset(STRONG_KEYWORDS if strong_keywords is None else strong_keywords)
+        self.transfer_messages = dict(TRANSFER_MESSAGES, **(transfer_messages or {}))
+
+    def should_transfer(self, message):
+        """(should_transfer, reason) for message"""
         message_lower = message.lower().strip()
 
         # Check for direct phrases first
@@ -60,8 +112,8 @@ class HumanFallbackHandler:
                 return True, f"Phrase detected: '{phrase}'"
 
         # Check for individual keywords
-        words = re.findall(r'\b\w+\b', message_lower)
-        triggered_keywords = [word for word in words if word in self.trigger_keywords]
+        words = WORD_PATTERN.findall(message_lower)
+        triggered_keywords = [word for word in words if word in self.keyword_set]
 
         if triggered_keywords:
             # Multiple keywords increase confidence
@@ -69,12 +121,37 @@ class HumanFallbackHandler:
                 return True, f"Multiple keywords: {', '.join(triggered_keywords)}"
 
             # Single strong keywords
-            strong_keywords = ['buy', 'purchase', 'human', 'agent', 'urgent', 'complaint']
-            if any(keyword in triggered_keywords for keyword in strong_keywords):
-                return True, f"Strong keyword: {triggered_keywords[0]}"
+            strong = [keyword for keyword in triggered_keywords if keyword in self.strong_keywords]
+            if strong:
+                return True, f"Strong keyword: {strong[0]}"
 
         return False, None
 
+    def transfer_message(self, reason_category):
+        return self.transfer_messages.get(reason_category, self.transfer_messages['general'])
+
+
+class HumanFallbackHandler:
+    def __init__(self, notifier=None, rules=None):
+        # Rules of the default tenant; other tenants pass their own (see tenants.py)
+        self.rules = rules or TransferRules()
+        self.trigger_keywords = self.rules.trigger_keywords
+        self.trigger_phrases = self.rules.trigger_phrases
+        self.keyword_set = self.rules.keyword_set
+
+        # Store conversations flagged for human review
+        self.flagged_conversations = {}
+
+        # Notifications are delivered in the background, never on the request thread
+        self.notifier = notifier or get_dispatcher()
+
+    def should_transfer_to_human(self, message, rules=None):
+        """
+        Check if message should be transferred to human agent
+        Returns: (should_transfer: bool, reason: str)
+        """
+        return (rules or self.rules).should_transfer(message)
+
     def flag_conversation(self, conversation_id, user_message, reason):
         """Flag conversation for human agent review"""
         timestamp = datetime.now().isoformat()
@@ -87,14 +164,14 @@ class HumanFallbackHandler:
             'urgency': self.get_urgency_level(user_message)
         }
 
-        # Log for human agent notification
-        logger.info(f"HUMAN AGENT NEEDED - Conv: {conversation_id}, Reason: {reason}")
+        # Escalations are never sampled out
+        logger.info(f"HUMAN AGENT NEEDED - Conv: {conversation_id}, Reason: {reason}",
+                    extra={"event": "escalation", "conversation_id": conversation_id, "reason": reason,
+                           "urgency": self.flagged_conversations[conversation_id]['urgency'], "always": True})
 
-        # Here you could integrate with:
-        # - Email notifications
-        # - Slack/Teams alerts
-        # - Ticketing systems
-        # - SMS notifications
+        # Only enqueues; webhook/email/file delivery happens on the dispatcher's workers
+        self.notifier.notify(dict(self.flagged_conversations[conversation_id],
+                                  conversation_id=conversation_id))
 
     def get_urgency_level(self, message):
         """Determine urgency level of the request"""
@@ -110,47 +187,9 @@ class HumanFallbackHandler:
         else:
             return 'normal'
 
-    def get_human_transfer_message(self, reason_category):
+    def get_human_transfer_message(self, reason_category, rules=None):
         """Get appropriate message for human transfer"""
-        messages = {
-            'sales': """I'll connect you with our sales team for detailed pricing and demos! 
-
-📞 **Immediate Help:**
-• Call: +254703201180
-• Email: mutetie510@gmail.com
-• Book a demo: mutetie56@gmail.com
-
-A sales representative will contact you within 1 hour during business hours (9 AM - 6 PM EAT).""",
-
-            'support': """I'm connecting you with a human support specialist who can better assist you.
-
-👨‍💼 **Human Support:**
-• Live chat will connect shortly
-• Email: support@mshauritech.com  
-• Phone: +1 (555) 123-4567
-
-Expected response time: 15-30 minutes during business hours.""",
-
-            'technical': """This requires our technical team's expertise. I'm escalating this for you.
-
-🔧 **Technical Support:**
-• Priority ticket created
-• Email: tech@mshauritech.com
-• Your ticket ID: #{ticket_id}
-
-A technical specialist will reach out within 2 hours.""",
-
-            'general': """I'm connecting you with a human agent who can provide more personalized assistance.
-
-💬 **Human Agent:**
-• Transferring now...
-• Email: hello@mshauritech.com
-• Phone: +1 (555) 123-4567
-
-Please hold while I connect you."""
-        }
-
-        return messages.get(reason_category, messages['general'])
+        return (rules or self.rules).transfer_message(reason_category)
 
     def categorize_request(self, message, reason):
         """Categorize the type of human assistance needed"""
@@ -226,40 +265,8 @@ def add_fallback_to_existing_bot():
 
 # Simple notification system (optional)
 def send_agent_notification(conversation_data):
-    """Send notification to human agents - customize based on your setup"""
-
-    # Email notification example
-    def send_email_alert():
-        subject = f"Human Agent Needed - {conversation_data['urgency'].upper()} Priority"
-        body = f"""
-        New conversation needs human attention:
-
-        Conversation ID: {conversation_data.get('conversation_id')}
-        Timestamp: {conversation_data['timestamp']}
-        User Message: {conversation_data['user_message']}
-        Reason: {conversation_data['reason']}
-        Urgency: {conversation_data['urgency']}
-
-        Please respond promptly.
-        """
-        # Implement your email sending logic here
-        pass
-
-    # Slack notification example
-    def send_slack_alert():
-        slack_message = {
-            "text": f"🚨 Human Agent Needed - {conversation_data['urgency'].upper()} Priority",
-            "attachments": [{
-                "color": "warning",
-                "fields": [
-                    {"title": "Message", "value": conversation_data['user_message'], "short": False},
-                    {"title": "Reason", "value": conversation_data['reason'], "short": True},
-                    {"title": "Urgency", "value": conversation_data['urgency'], "short": True}
-                ]
-            }]
-        }
-        # Implement your Slack webhook logic here
-        pass
+    """Queue a notification to human agents - sinks are configured in config.py"""
+    return get_dispatcher().notify(conversation_data)
 
 
 # Usage example:
@@ -0,0 +1,117 @@
+# idempotency.py
+# Duplicate-submit suppression for POST /chat: a double-clicked Send, a retry
+# after a slow answer or a mobile client resending on a flaky network gets
+# the original turn's reply instead of running (and recording) the turn again.
+#
+# A request is identified by its Idempotency-Key header, scoped to the
+# conversation and kept for IDEMPOTENCY_TTL seconds. Without a header the key
+# is derived from the conversation and the message, and is kept only for
+# IDEMPOTENCY_WINDOW seconds after the reply, so asking the same thing again
+# later is a new turn. A duplicate that arrives while the original is still
+# running waits for it; one that arrives later gets the stored reply. A turn
+# that failed (bot.FailedReply) is not kept, so "try again" really does.
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import config
+
+HEADER = "Idempotency-Key"
+
+
+class Conflict(Exception):
+    """An Idempotency-Key was reused for a different request"""
+
+
+def request_key(header_key, conversation_id, message):
+    """(key, ttl) for a chat request, or (None, 0) if it shouldn't be deduplicated"""
+    if header_key:
+        return f"key:{conversation_id}:{header_key}", config.IDEMPOTENCY_TTL
+    if config.IDEMPOTENCY_WINDOW <= 0:
+        return None, 0
+    digest = hashlib.blake2b(f"{conversation_id}\0{message}".encode(), digest_size=16).hexdigest()
+    return f"auto:{digest}", config.IDEMPOTENCY_WINDOW
+
+
+class IdempotencyStore:
+    """
+    Results of recent requests by key, bounded to max_entries (oldest dropped
+    first). Only successful results are kept: an exception, or a result with a
+    true `failed` attribute, reaches the waiting duplicates but is then
+    forgotten. Used from the event loop only.
+    """
+
+    def __init__(self, max_entries=config.IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._last_prune = time.monotonic()
+        self.stats = {'executed': 0, 'attached': 0, 'replayed': 0, 'conflicts': 0}
+
+    async def run(self, key, fingerprint, ttl, fn):
+        """
+        (result, replayed): the result of await fn(), or of the earlier request
+        with the same key. Raises Conflict if that request's fingerprint differs.
+        """
+        while True:
+            entry = self._lookup(key)
+            if entry is None:
+                break
+            if entry['fingerprint'] != fingerprint:
+                self.stats['conflicts'] += 1
+                raise Conflict(key)
+            future = entry['future']
+            if future.done():
+                self.stats['replayed'] += 1
+                return future.result(), True
+            self.stats['attached'] += 1
+            await asyncio.wait({future})
+            if not future.cancelled():
+                return future.result(), True
+            # The original failed or its client went away: run the request here instead
+
+        future = asyncio.get_running_loop().create_future()
+        entry = {'fingerprint': fingerprint, 'future': future, 'expires': None}
+        self._entries[key] = entry
+        self.stats['executed'] += 1
+        try:
+            result = await fn()
+        except BaseException:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            future.cancel()
+            raise
+        future.set_result(result)
+        if getattr(result, "failed", False):
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            return result, False
+        entry['expires'] = time.monotonic() + ttl
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result, False
+
+    def _lookup(self, key):
+        now = time.monotonic()
+        self._prune(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry['expires'] is not None and entry['expires'] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _prune(self, now):
+        if now - self._last_prune < 1:
+            return
+        self._last_prune = now
+        expired = [key for key, entry in self._entries.items()
+                   if entry['expires'] is not None and entry['expires'] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def report(self):
+        return dict(self.stats, stored=len(self._entries))
+
+
+chat_idempotency = IdempotencyStore()
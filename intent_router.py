@@ -0,0 +1,252 @@
+# intent_router.py
+# Local intent router: answers greetings, thanks and simple company questions
+# (support hours, email, products) from templates built from config.PRODUCT_INFO,
+# so they never reach the Cohere API. Everything else falls through to the LLM.
+#
+# The classifier is a linear softmax model over hashed word and word-pair
+# counts. It ships trained on SEED_EXAMPLES and can be retrained from labelled
+# chat logs (one {"message": ..., "intent": ...} JSON object per line):
+#
+#   python intent_router.py train labelled.jsonl --out intent_model.npz
+#   python intent_router.py eval labelled.jsonl --model intent_model.npz
+#
+# then set INTENT_MODEL_PATH=intent_model.npz.
+
+import argparse
+import json
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import config
+
+WORD_PATTERN = re.compile(r"\b\w+\b")
+N_FEATURES = 2 ** 12
+
+# Messages the model should leave to the LLM are labelled "other"
+OTHER = "other"
+
+SEED_EXAMPLES = [
+    ("hi", "greeting"), ("hello", "greeting"), ("hey", "greeting"), ("hello there", "greeting"),
+    ("hi there", "greeting"), ("good morning", "greeting"), ("good afternoon", "greeting"),
+    ("good evening", "greeting"), ("hey there", "greeting"), ("hi, anyone there?", "greeting"),
+    ("hello, is anyone there", "greeting"), ("habari", "greeting"), ("jambo", "greeting"),
+
+    ("thanks", "thanks"), ("thank you", "thanks"), ("thank you so much", "thanks"),
+    ("thanks a lot", "thanks"), ("many thanks", "thanks"), ("great, thanks", "thanks"),
+    ("ok thank you", "thanks"), ("that helps, thanks", "thanks"), ("asante", "thanks"),
+    ("thanks for your help", "thanks"), ("cheers", "thanks"),
+
+    ("bye", "goodbye"), ("goodbye", "goodbye"), ("see you", "goodbye"), ("that's all, bye", "goodbye"),
+    ("have a nice day", "goodbye"), ("talk to you later", "goodbye"), ("ok bye", "goodbye"),
+
+    ("what are your support hours", "support_hours"), ("when are you open", "support_hours"),
+    ("what time do you open", "support_hours"), ("what are your working hours", "support_hours"),
+    ("opening hours", "support_hours"), ("are you open on weekends", "support_hours"),
+    ("when is support available", "support_hours"), ("what hours is support available", "support_hours"),
+    ("what time does support close", "support_hours"), ("business hours?", "support_hours"),
+    ("are you open on saturday", "support_hours"), ("when can i reach support", "support_hours"),
+
+    ("what is your email", "support_email"), ("what is your support email", "support_email"),
+    ("how can i email you", "support_email"), ("email address?", "support_email"),
+    ("how do i contact support by email", "support_email"), ("where do i send an email", "support_email"),
+    ("can i get your email address", "support_email"), ("support email", "support_email"),
+    ("how do i contact you", "support_email"), ("contact details", "support_email"),
+
+    ("what products do you offer", "products"), ("what do you sell", "products"),
+    ("what services do you have", "products"), ("tell me about your products", "products"),
+    ("what does mshauri tech do", "products"), ("list your services", "products"),
+    ("what solutions do you offer", "products"), ("which products are available", "products"),
+
+    ("how do i reset my password", OTHER), ("my dashboard is not loading", OTHER),
+    ("can mshauri assistant integrate with whatsapp", OTHER), ("how does analytics handle my data", OTHER),
+    ("i can't log in to my account", OTHER), ("does connect support sms", OTHER),
+    ("how do i export my reports", OTHER), ("why was my message not delivered", OTHER),
+    ("can you explain how the assistant learns", OTHER), ("is my data stored in kenya", OTHER),
+    ("how many users can i add", OTHER), ("what languages does the assistant speak", OTHER),
+    ("how do i set up the widget on my site", OTHER), ("the app keeps crashing on android", OTHER),
+    ("what is the difference between analytics and connect", OTHER), ("do you have an api", OTHER),
+    ("hello, my reports are empty since yesterday", OTHER), ("hi, how do i add a new agent account", OTHER),
+    ("thanks, but how do i change my email address", OTHER), ("when will the outage be fixed", OTHER),
+]
+
+
+def tokenize(text):
+    words = WORD_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def featurize(texts):
+    """Hashed, L2-normalised unigram+bigram counts: one row per text"""
+    matrix = np.zeros((len(texts), N_FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in tokenize(text):
+            matrix[row, zlib.crc32(token.encode()) % N_FEATURES] += 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-6)
+
+
+class IntentModel:
+    """Multinomial logistic regression on hashed features"""
+
+    def __init__(self, intents, weights, bias):
+        self.intents = list(intents)
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, examples, epochs=300, learning_rate=2.0, l2=1e-4):
+        """Fit on (message, intent) pairs with full-batch gradient descent"""
+        intents = sorted({intent for _, intent in examples})
+        index = {intent: i for i, intent in enumerate(intents)}
+        features = featurize([message for message, _ in examples])
+        targets = np.zeros((len(examples), len(intents)), dtype=np.float32)
+        targets[np.arange(len(examples)), [index[intent] for _, intent in examples]] = 1.0
+
+        weights = np.zeros((N_FEATURES, len(intents)), dtype=np.float32)
+        bias = np.zeros(len(intents), dtype=np.float32)
+        for _ in range(epochs):
+            error = (_softmax(features @ weights + bias) - targets) / len(examples)
+            weights -= learning_rate * (features.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(intents, weights, bias)
+
+    def predict(self, texts):
+        """(intent, probability) of the most likely intent for each text"""
+        probabilities = _softmax(featurize(texts) @ self.weights + self.bias)
+        best = probabilities.argmax(axis=1)
+        return [(self.intents[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    def save(self, path):
+        np.savez_compressed(path, intents=np.array(self.intents), weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["intents"].tolist(), data["weights"], data["bias"])
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def build_templates(company_name=None, product_info=None):
+    """Answers for each intent, filled in from product_info (config.PRODUCT_INFO by default)"""
+    company_name = config.COMPANY_NAME if company_name is None else company_name
+    product_info = config.PRODUCT_INFO if product_info is None else product_info
+    facts = {}
+    products = []
+    for line in product_info.splitlines():
+        line = line.strip()
+        if not line.startswith("- "):
+            continue
+        name, _, detail = line[2:].partition(":")
+        if name.lower().startswith("support "):
+            facts[name.lower()] = detail.strip()
+        else:
+            products.append(f"• {name.strip()}: {detail.strip()}")
+
+    templates = {
+        "greeting": f"Hello! Welcome to {company_name} support. How can I help you today?",
+        "thanks": "You're welcome! Is there anything else I can help you with?",
+        "goodbye": f"Thank you for contacting {company_name}. Have a great day!",
+    }
+    if "support hours" in facts:
+        templates["support_hours"] = f"Our support team is available {facts['support hours']}."
+    if "support email" in facts:
+        templates["support_email"] = f"You can reach our support team at {facts['support email']}."
+    if products:
+        templates["products"] = f"Here is what {company_name} offers:\n" + "\n".join(products)
+    return templates
+
+
+class IntentRouter:
+    """Answers high-confidence intents locally and keeps count of what it saved"""
+
+    def __init__(self, model=None, threshold=config.INTENT_CONFIDENCE, max_words=config.INTENT_MAX_WORDS):
+        self.model = model or IntentModel.train(SEED_EXAMPLES)
+        self.templates = build_templates()
+        self.threshold = threshold
+        self.max_words = max_words
+        self._lock = threading.Lock()
+        self.stats = {'messages': 0, 'answered': 0, 'local_seconds': 0.0,
+                      'upstream_calls': 0, 'upstream_seconds': 0.0}
+
+    def answer(self, message, templates=None):
+        """Template answer for message (from templates, a tenant's, if given), or None to let the LLM handle it"""
+        start = time.perf_counter()
+        reply = None
+        # Long messages carry more than a greeting or a single fact; leave them to the LLM
+        if len(WORD_PATTERN.findall(message)) <= self.max_words:
+            intent, probability = self.model.predict([message])[0]
+            if probability >= self.threshold:
+                reply = (self.templates if templates is None else templates).get(intent)
+
+        with self._lock:
+            self.stats['messages'] += 1
+            if reply is not None:
+                self.stats['answered'] += 1
+                self.stats['local_seconds'] += time.perf_counter() - start
+        return reply
+
+    def record_upstream(self, seconds):
+        """Count one LLM call and how long it took"""
+        with self._lock:
+            self.stats['upstream_calls'] += 1
+            self.stats['upstream_seconds'] += seconds
+
+    def report(self):
+        """Share of messages kept off the upstream API and the latency that saved"""
+        with self._lock:
+            stats = dict(self.stats)
+        answered = stats['answered']
+        avg_upstream = stats['upstream_seconds'] / stats['upstream_calls'] if stats['upstream_calls'] else 0.0
+        avg_local = stats['local_seconds'] / answered if answered else 0.0
+        return {
+            'messages': stats['messages'],
+            'answered_locally': answered,
+            'offload_share': round(answered / stats['messages'], 4) if stats['messages'] else 0.0,
+            'avg_upstream_ms': round(avg_upstream * 1000, 1),
+            'avg_local_ms': round(avg_local * 1000, 3),
+            'saved_seconds': round(answered * max(avg_upstream - avg_local, 0.0), 2)
+        }
+
+
+def load_router():
+    """The router configured by INTENT_MODEL_PATH (seed model if unset)"""
+    model = IntentModel.load(config.INTENT_MODEL_PATH) if config.INTENT_MODEL_PATH else None
+    return IntentRouter(model)
+
+
+def read_examples(path):
+    with open(path) as f:
+        return [(item["message"], item["intent"]) for item in map(json.loads, f) if item.get("message")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or evaluate the local intent model")
+    parser.add_argument("command", choices=["train", "eval", "try"])
+    parser.add_argument("path", nargs="?", help="Labelled JSONL (train/eval) or a message (try)")
+    parser.add_argument("--out", default="intent_model.npz")
+    parser.add_argument("--model", default=config.INTENT_MODEL_PATH)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        # Seed examples stay in, so the built-in intents keep working
+        model = IntentModel.train(SEED_EXAMPLES + read_examples(args.path))
+        model.save(args.out)
+        print(f"Saved {len(model.intents)} intents to {args.out}")
+    else:
+        model = IntentModel.load(args.model) if args.model else IntentModel.train(SEED_EXAMPLES)
+        if args.command == "try":
+            print(model.predict([args.path or "hello"])[0])
+        else:
+            examples = read_examples(args.path)
+            predictions = model.predict([message for message, _ in examples])
+            correct = sum(predicted == intent for (predicted, _), (_, intent) in zip(predictions, examples))
+            print(f"Accuracy: {correct}/{len(examples)} ({correct / max(len(examples), 1):.1%})")
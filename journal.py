@@ -0,0 +1,266 @@
+# journal.py
+# Append-only journal of conversation state, so a restarted worker picks up
+# every conversation and escalation where it left off.
+#
+# Files in JOURNAL_DIR:
+#   snapshot-<gen>.bin   full state when generation <gen> started
+#   journal-<gen>.log    changes made during generation <gen>
+#
+# Both hold length-prefixed records: a header of (payload length, crc32)
+# followed by a compact JSON payload. Records carry whole values (a
+# conversation's full trimmed history, a flag), so replaying one twice is
+# harmless and the last record for a key wins.
+#
+# Appends are buffered and written by one thread that fsyncs once per
+# sync_interval (group commit). When the log passes compact_bytes the writer
+# starts a new generation, writes a snapshot of the current state and removes
+# the older files. Replay reads the newest complete snapshot and the logs
+# from its generation on through mmap, and drops a torn record at the tail.
+
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+import config
+from serialization import dumps, loads
+
+logger = logging.getLogger("journal")
+
+HEADER = struct.Struct("<II")
+FILE_PATTERN = re.compile(r"^(snapshot|journal)-(\d+)\.(bin|log)$")
+
+
+class JournalLocked(Exception):
+    """Another process is already writing this journal directory"""
+
+
+def encode(record):
+    payload = dumps(record)
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    """
+    (records, good_length) for one file, read through mmap.
+
+    Reading stops at the first truncated or corrupt record, which is what a
+    crash in the middle of a write leaves behind.
+    """
+    records = []
+    size = os.path.getsize(path)
+    if size == 0:
+        return records, 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offset = 0
+        while offset + HEADER.size <= size:
+            length, crc = HEADER.unpack_from(data, offset)
+            start = offset + HEADER.size
+            end = start + length
+            if end > size:
+                break
+            payload = data[start:end]
+            if zlib.crc32(payload) != crc:
+                break
+            records.append(loads(payload))
+            offset = end
+    return records, offset
+
+
+class Journal:
+    """Single-writer journal for one directory (guarded by a lock file)"""
+
+    def __init__(self, directory, sync_interval=config.JOURNAL_SYNC_INTERVAL,
+                 compact_bytes=config.JOURNAL_COMPACT_BYTES):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.compact_bytes = compact_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock_file = open(os.path.join(directory, "LOCK"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise JournalLocked(directory)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._durable = 0
+        self._stop = False
+        self._log = None
+        self._log_size = 0
+        self._thread = None
+        self._snapshot_source = None
+        self.generation = self._latest_snapshot_generation()
+        self.stats = {'records': 0, 'commits': 0, 'compactions': 0}
+
+    def _files(self):
+        found = []
+        for name in os.listdir(self.directory):
+            match = FILE_PATTERN.match(name)
+            if match:
+                found.append((int(match.group(2)), match.group(1), os.path.join(self.directory, name)))
+        # Within a generation the snapshot comes before the log that continues it
+        return sorted(found, key=lambda item: (item[0], item[1] != "snapshot"))
+
+    def _latest_snapshot_generation(self):
+        generations = [gen for gen, kind, _ in self._files() if kind == "snapshot"]
+        return max(generations, default=0)
+
+    def replay(self):
+        """Every record since the newest snapshot, oldest first"""
+        records = []
+        for gen, kind, path in self._files():
+            if gen < self.generation or (kind == "snapshot" and gen != self.generation):
+                continue
+            file_records, good_length = read_records(path)
+            if kind == "journal" and good_length < os.path.getsize(path):
+                logger.warning(f"Dropping torn tail of {path} at byte {good_length}")
+                os.truncate(path, good_length)
+            records.extend(file_records)
+        # Later generations' logs continue where this one left off
+        logs = [gen for gen, kind, _ in self._files() if kind == "journal"]
+        self.generation = max(logs + [self.generation])
+        return records
+
+    def start(self, snapshot_source=None):
+        """Open the current log for appending and start the writer thread"""
+        self._snapshot_source = snapshot_source
+        self._open_log(self.generation)
+        self._thread = threading.Thread(target=self._writer, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def _open_log(self, gen):
+        path = os.path.join(self.directory, f"journal-{gen}.log")
+        self._log = open(path, "ab")
+        self._log_size = self._log.tell()
+
+    def append(self, record):
+        """Queue a record; returns its sequence number (see wait_durable)"""
+        data = encode(record)
+        with self._cond:
+            self._pending.append(data)
+            self._appended += 1
+            if len(self._pending) == 1:
+                self._cond.notify_all()
+            return self._appended
+
+    def wait_durable(self, seq, timeout=None):
+        """Block until record seq is fsynced; False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._durable >= seq, timeout)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stop)
+                if self._stop and not self._pending:
+                    return
+            # Let more appends pile up so one fsync covers them all
+            if not self._stop:
+                time.sleep(self.sync_interval)
+            self._commit()
+            if self._snapshot_source is not None and self._log_size >= self.compact_bytes:
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.error(f"Journal compaction failed: {e}")
+
+    def _commit(self):
+        with self._cond:
+            batch, self._pending = self._pending, []
+            seq = self._appended
+        if batch:
+            data = b"".join(batch)
+            self._log.write(data)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._log_size += len(data)
+        with self._cond:
+            self._durable = seq
+            self.stats['records'] += len(batch)
+            self.stats['commits'] += 1
+            self._cond.notify_all()
+
+    def compact(self):
+        """Start a new generation with a snapshot of the current state (writer thread)"""
+        self._commit()
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        # Changes from here on go to the new log; the snapshot taken after
+        # the switch already includes everything in the old one
+        self._log.close()
+        self._open_log(new_generation)
+        self.generation = new_generation
+
+        final_path = os.path.join(self.directory, f"snapshot-{new_generation}.bin")
+        temp_path = final_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for record in self._snapshot_source():
+                f.write(encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, final_path)
+        self._fsync_directory()
+
+        for gen, _, path in self._files():
+            if gen < new_generation:
+                os.remove(path)
+        self.stats['compactions'] += 1
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Write and fsync everything queued, then release the directory"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._log is not None:
+            self._log.close()
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+
+def _benchmark(directory, conversations):
+    """Write a journal for n conversations, then time how long replay takes"""
+    history = [{"role": role, "message": "How do I export last month's analytics report to CSV? " * 2}
+               for role in ("USER", "CHATBOT") * 5]
+    journal = Journal(directory, sync_interval=0.01)
+    journal.start()
+    start = time.perf_counter()
+    for i in range(conversations):
+        journal.append({"t": "conv", "c": f"conv-{i}", "h": history})
+    journal.close()
+    written = time.perf_counter() - start
+
+    start = time.perf_counter()
+    journal = Journal(directory)
+    records = journal.replay()
+    replayed = time.perf_counter() - start
+    journal.close()
+    print(f"{conversations} conversations: wrote in {written:.2f}s, replayed {len(records)} records in {replayed:.2f}s")
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Journal write/replay benchmark")
+    parser.add_argument("--conversations", type=int, default=100000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        _benchmark(directory, args.conversations)
@@ -0,0 +1,80 @@
+# loadtest.py
+# Simple concurrent load test for the /chat endpoint
+#
+#   python loadtest.py --url http://localhost:8000 --concurrency 50 --requests 1000
+
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+import requests
+
+MESSAGES = [
+    "How does Mshauri Analytics work?",
+    "What channels does Mshauri Connect support?",
+    "Can the assistant answer in Swahili?",
+    "How do I reset my dashboard password?",
+]
+
+
+def run_load_test(url, concurrency=20, total_requests=200, conversations=50, timeout=60):
+    """Send total_requests chat messages from `concurrency` threads and report throughput"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+    conversation_ids = [f"load-{uuid.uuid4().hex[:8]}" for _ in range(conversations)]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            payload = {
+                "message": MESSAGES[i % len(MESSAGES)],
+                "conversation_id": conversation_ids[i % len(conversation_ids)]
+            }
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{url}/chat", json=payload, timeout=timeout)
+                ok = response.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "errors": len(errors),
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(len(latencies) / duration, 1) if duration else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoint")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=50)
+    args = parser.parse_args()
+
+    report = run_load_test(args.url, args.concurrency, args.requests, args.conversations)
+    for key, value in report.items():
+        print(f"{key:>15}: {value}")
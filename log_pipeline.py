@@ -0,0 +1,183 @@
+# log_pipeline.py
+# Application logging: JSON lines written by a background thread.
+#
+# Loggers only put records on a queue (QueueHandler); a QueueListener thread
+# formats and writes them to a rotating file, so request threads never wait
+# on file I/O. High-volume events are sampled before they reach the queue;
+# warnings, errors and records logged with always=True (escalations) are
+# always kept.
+#
+# Structured fields go in `extra`:
+#   logger.info("chat turn", extra={"event": "chat_turn", "conversation_id": cid,
+#                                   "timings_ms": {...}, "route": "llm"})
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import config
+
+# LogRecord attributes that are not caller-supplied fields
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message plus any extra fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key != "always":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a share of records per event name; warnings, errors and always=True pass untouched"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, "always", False):
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None:
+            return True
+        # Readers scale counts back up by 1/sample_rate
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """QueueHandler that keeps the record's extra fields and defers formatting to the listener"""
+
+    def prepare(self, record):
+        # Resolve the message and traceback here (args may not be safe to use later),
+        # but leave JSON encoding to the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sample_rates(spec):
+    """'chat_request=0.1,llm_call=0.5' -> {'chat_request': 0.1, 'llm_call': 0.5}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def build_file_handler(path=None):
+    """Rotating JSON file handler for LOG_FILE ('-' logs to stderr, '{pid}' is the process id)"""
+    path = config.LOG_FILE if path is None else path
+    if path == "-":
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = RotatingFileHandler(path.format(pid=os.getpid()), maxBytes=config.LOG_MAX_BYTES,
+                                      backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging(handlers=None):
+    """Route every logger through the queue to the file writer (idempotent per process)"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return _queue_handler
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _PreparedQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(parse_sample_rates(config.LOG_SAMPLE_RATES)))
+        _listener = QueueListener(log_queue, *(handlers or [build_file_handler()]), respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        root.setLevel(config.LOG_LEVEL)
+        root.addHandler(_queue_handler)
+        logging.getLogger("urllib3").setLevel(logging.WARNING)
+        atexit.register(shutdown_logging)
+        return _queue_handler
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
+
+
+def benchmark(records=20000):
+    """Per-record cost on the calling thread: direct file handler vs the queue pipeline"""
+    import tempfile
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bench_logger = logging.getLogger("log_pipeline.benchmark")
+        bench_logger.propagate = False
+        bench_logger.setLevel(logging.INFO)
+        fields = {"event": "chat_request", "conversation_id": "conv-123", "timings_ms": {"total": 812.5}}
+
+        def run(name, handler):
+            bench_logger.handlers = [handler]
+            start = time.perf_counter()
+            for _ in range(records):
+                bench_logger.info("chat request", extra=fields)
+            results[name] = (time.perf_counter() - start) / records * 1e6
+
+        direct = build_file_handler(os.path.join(directory, "direct.log"))
+        run("direct file handler", direct)
+        direct.close()
+
+        for name, rates in (("queue pipeline", {}), ("queue pipeline, 10% sampled", {"chat_request": 0.1})):
+            log_queue = queue.SimpleQueue()
+            writer = build_file_handler(os.path.join(directory, "queued.log"))
+            listener = QueueListener(log_queue, writer)
+            listener.start()
+            handler = _PreparedQueueHandler(log_queue)
+            handler.addFilter(SamplingFilter(rates))
+            run(name, handler)
+            listener.stop()
+            writer.close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, micros in benchmark().items():
+        print(f"{name:32s} {micros:7.1f} µs per record on the request thread")
@@ -0,0 +1,281 @@
+# memory_diagnostics.py
+# Finding out why a worker grows, without attaching a debugger.
+#
+# Three tools, all per worker process:
+#   structures(bot)   what the bot's long-lived structures hold (counts and
+#                     approximate bytes), live threads by kind, the upstream
+#                     connection pool, GC state and RSS  (GET /admin/memory)
+#   TraceDiff         tracemalloc on demand: start tracing, then each
+#                     snapshot shows the allocation sites that grew since the
+#                     previous one  (/admin/memory/trace...)
+#   MemorySampler     a thread appending a cheap sample to MEMORY_SAMPLE_FILE
+#                     every MEMORY_SAMPLE_INTERVAL seconds, so growth can be
+#                     read back as a trend over days
+#
+#   python memory_diagnostics.py trend memory-1234.jsonl   # growth per hour of each metric
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+import config
+
+logger = logging.getLogger("memory_diagnostics")
+
+# Conversations measured for the byte estimate in periodic samples
+SAMPLE_CONVERSATIONS = 1000
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to peak RSS
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _history_bytes(key, history):
+    # The key, the list and every turn with its strings (shared role strings are counted too)
+    size = sys.getsizeof(key) + sys.getsizeof(history)
+    for turn in history:
+        size += sys.getsizeof(turn) + sum(sys.getsizeof(value) for value in turn.values())
+    return size
+
+
+def _flag_bytes(key, flag):
+    return sys.getsizeof(key) + sys.getsizeof(flag) + sum(sys.getsizeof(value) for value in flag.values())
+
+
+def _measure(entries, size_of, sample=None):
+    """(count, approximate bytes) of a {key: value} structure; with sample, bytes scale up from that many"""
+    items = list(entries.items())
+    measured = items if sample is None else itertools.islice(items, sample)
+    size = n = 0
+    for key, value in measured:
+        size += size_of(key, value)
+        n += 1
+    if n and n < len(items):
+        size = size * len(items) // n
+    return {"count": len(items), "bytes": size + sys.getsizeof(entries)}
+
+
+def threads():
+    """Live threads by kind: the name without its numbers ("Thread-7 (_animate)" -> "Thread (_animate)")"""
+    kinds = {}
+    for thread in threading.enumerate():
+        kind = re.sub(r"[-_]?\d+", "", thread.name)
+        kinds[kind] = kinds.get(kind, 0) + 1
+    return {"total": sum(kinds.values()), "by_kind": dict(sorted(kinds.items(), key=lambda item: -item[1]))}
+
+
+def upstream_pool(bot):
+    """Pools and idle connections of the bot's requests session (urllib3), if it has one"""
+    session = bot._session
+    if session is None:
+        return {"pools": 0, "idle_connections": 0}
+    pools = idle = 0
+    for adapter in set(session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                pools += 1
+                idle += pool.pool.qsize() if pool.pool is not None else 0
+    return {"pools": pools, "idle_connections": idle}
+
+
+def structures(bot, sample=None):
+    """
+    What the long-lived structures of this worker hold. Bytes are estimates
+    from sys.getsizeof; with sample, from that many conversations scaled up.
+    """
+    import admission
+    import chat_sessions
+    import idempotency
+
+    report = {
+        "pid": os.getpid(),
+        "rss_bytes": current_rss(),
+        "conversations": _measure(bot.conversations, _history_bytes, sample),
+        "flagged_conversations": _measure(bot.fallback_handler.flagged_conversations, _flag_bytes, sample),
+        "busy_conversation_locks": bot.conversation_locks.busy(),
+        "idempotency_entries": idempotency.chat_idempotency.report()['stored'],
+        "rate_limit_buckets": sum(len(limiter._buckets) for limiter in (
+            admission.chat_admission.per_client, admission.chat_admission.per_conversation,
+            admission.chat_admission.per_tenant)),
+        "chat_sessions": len(chat_sessions.hub.sessions),
+        "threads": threads(),
+        "upstream_pool": upstream_pool(bot),
+        "gc": {"counts": gc.get_count(), "frozen": gc.get_freeze_count(), "uncollectable": len(gc.garbage)},
+    }
+    if bot.remote_conversations is not None:
+        report["remote_conversations"] = bot.remote_conversations.report()['tracked']
+    if tracemalloc.is_tracing():
+        traced, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {"traced_bytes": traced, "peak_bytes": peak}
+    return report
+
+
+class TraceDiff:
+    """
+    tracemalloc on demand. Tracing slows allocations down, so it runs only
+    between start() and stop(); each snapshot() is compared with the last.
+    """
+
+    # Allocations made by tracemalloc itself and the import system are noise
+    IGNORED = tuple(tracemalloc.Filter(False, pattern) for pattern in (
+        tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+        "<unknown>"))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = None
+        self._previous_at = None
+        self.started = None
+
+    def start(self, frames=None):
+        """Start tracing (if this process isn't already); the first snapshot is compared with now"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(config.TRACEMALLOC_FRAMES if frames is None else frames)
+                self.started = time.time()
+            self._previous = self._take()
+            return {"tracing": True, "since": self.started}
+
+    def snapshot(self, top=20, group_by="lineno"):
+        """The top allocation sites by growth since the previous snapshot; None if not tracing"""
+        with self._lock:
+            if not tracemalloc.is_tracing() or self._previous is None:
+                return None
+            previous_at = self._previous_at
+            current = self._take()
+            stats = current.compare_to(self._previous, group_by)
+            self._previous = current
+            sites = [{
+                "site": self._site(stat.traceback),
+                "size_bytes": stat.size,
+                "size_diff_bytes": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            } for stat in stats[:top]]
+            return {"interval_seconds": round(self._previous_at - previous_at, 1),
+                    "traced_bytes": sum(stat.size for stat in stats),
+                    "growth_bytes": sum(stat.size_diff for stat in stats), "top": sites}
+
+    def stop(self):
+        with self._lock:
+            tracing = tracemalloc.is_tracing()
+            tracemalloc.stop()
+            self._previous = self.started = None
+            return {"tracing": False, "was_tracing": tracing}
+
+    def _take(self):
+        self._previous_at = time.monotonic()
+        return tracemalloc.take_snapshot().filter_traces(self.IGNORED)
+
+    @staticmethod
+    def _site(traceback):
+        # Innermost frame last, like a Python traceback
+        return [f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback)]
+
+
+trace_diff = TraceDiff()
+
+
+def sample(bot):
+    """One low-overhead line for the trend file"""
+    report = structures(bot, sample=SAMPLE_CONVERSATIONS)
+    line = {"ts": round(time.time(), 1), "pid": report["pid"], "rss_bytes": report["rss_bytes"],
+            "conversations": report["conversations"]["count"],
+            "conversation_bytes": report["conversations"]["bytes"],
+            "flagged": report["flagged_conversations"]["count"],
+            "threads": report["threads"]["total"],
+            "idempotency_entries": report["idempotency_entries"],
+            "rate_limit_buckets": report["rate_limit_buckets"],
+            "chat_sessions": report["chat_sessions"],
+            "idle_upstream_connections": report["upstream_pool"]["idle_connections"],
+            "gc_objects_gen0": report["gc"]["counts"][0]}
+    if "tracemalloc" in report:
+        line["traced_bytes"] = report["tracemalloc"]["traced_bytes"]
+    return line
+
+
+class MemorySampler:
+    """Appends sample(bot) as a JSON line to path ("{pid}" is replaced) every interval seconds"""
+
+    def __init__(self, get_bot, path=None, interval=None):
+        self.get_bot = get_bot
+        self.path = (path or config.MEMORY_SAMPLE_FILE).replace("{pid}", str(os.getpid()))
+        self.interval = config.MEMORY_SAMPLE_INTERVAL if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.write_sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def write_sample(self):
+        try:
+            line = sample(self.get_bot())
+            with open(self.path, "a") as f:
+                f.write(json.dumps(line) + "\n")
+            self.samples += 1
+        except Exception as e:
+            logger.warning(f"Memory sample not written: {e!r}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def trend(path):
+    """Least-squares growth per hour of every numeric metric in a sample file"""
+    rows = [json.loads(line) for line in open(path) if line.strip()]
+    if len(rows) < 2:
+        return {"samples": len(rows)}
+    times = [(row["ts"] - rows[0]["ts"]) / 3600 for row in rows]
+    mean_t = sum(times) / len(times)
+    spread = sum((t - mean_t) ** 2 for t in times) or 1
+    growth = {}
+    for metric in rows[-1]:
+        if metric in ("ts", "pid") or not all(isinstance(row.get(metric), (int, float)) for row in rows):
+            continue
+        values = [row[metric] for row in rows]
+        mean_v = sum(values) / len(values)
+        slope = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / spread
+        growth[metric] = {"first": values[0], "last": values[-1], "per_hour": round(slope, 2)}
+    return {"samples": len(rows), "hours": round(times[-1], 2), "growth": growth}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read memory samples back as trends")
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend_command = commands.add_parser("trend", help="growth per hour of each metric in a sample file")
+    trend_command.add_argument("path")
+    args = parser.parse_args()
+    result = trend(args.path)
+    print(f"{result['samples']} samples over {result.get('hours', 0)} hours")
+    for metric, values in sorted(result.get("growth", {}).items(), key=lambda item: -abs(item[1]["per_hour"])):
+        print(f"  {metric:28} {values['first']:>14} -> {values['last']:<14} {values['per_hour']:+.2f}/hour")
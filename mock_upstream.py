@@ -0,0 +1,144 @@
+# mock_upstream.py
+# A local stand-in for Cohere's /v1/chat API, used by the tests and the
+# benchmarks, or for running the app without network access:
+#
+#   python mock_upstream.py --port 8081
+#   COHERE_API_URL=http://127.0.0.1:8081/v1/chat python api.py
+#
+# It answers "Echo: <message>" (or a fixed reply), plain or streamed, with
+# billed units counted in words (meta.billed_units), and
+# keeps server-side history for requests that carry a conversation_id.
+# forget() drops that state; a forgotten conversation then gets a 404, the
+# way a provider reports an expired conversation.
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockUpstream:
+    """Speaks enough of Cohere's /v1/chat (plain, streaming, conversation_id) for tests"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.requests = []
+        self.delay = 0.0
+        # Pause between streamed events; events are then sent one chunk at a time
+        self.token_delay = 0.0
+        # Streams the client hung up on before the end
+        self.aborted = 0
+        self.status = 200
+        # Optional body -> (delay, status) per request, overriding delay and status (traffic_trace.py replays)
+        self.behaviour = None
+        self.reply = None
+        self.bytes_received = 0
+        # Server-side history by conversation_id, and ids whose history was dropped
+        self.conversations = {}
+        self.forgotten = set()
+        self._lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers["Content-Length"]))
+                body = json.loads(raw)
+                with mock._lock:
+                    mock.requests.append(body)
+                    mock.bytes_received += len(raw)
+                delay, status = mock.behaviour(body) if mock.behaviour else (mock.delay, mock.status)
+                time.sleep(delay)
+                text = mock.reply or f"Echo: {body['message']}"
+                sent = [body.get("preamble") or "", body["message"]]
+                sent += [turn["message"] for turn in body.get("chat_history", ())]
+                meta = {"billed_units": {"input_tokens": sum(len(part.split()) for part in sent),
+                                         "output_tokens": len(text.split())}}
+
+                conversation_id = body.get("conversation_id")
+                if conversation_id is not None and status == 200:
+                    with mock._lock:
+                        if conversation_id in mock.forgotten:
+                            self.respond(404, {"message": f"conversation {conversation_id} not found"})
+                            return
+                        history = mock.conversations.setdefault(conversation_id, [])
+                        history.append({"role": "USER", "message": body["message"]})
+                        history.append({"role": "CHATBOT", "message": text})
+
+                if status != 200:
+                    self.respond(status, {"message": "error"})
+                elif body.get("stream") and mock.token_delay:
+                    self.stream_slowly(text, meta)
+                elif body.get("stream"):
+                    events = [{"event_type": "stream-start"}]
+                    events += [{"event_type": "text-generation", "text": word + " "} for word in text.split()]
+                    events.append({"event_type": "stream-end", "response": {"text": text, "meta": meta}})
+                    self.send_body(200, "".join(json.dumps(event) + "\n" for event in events).encode())
+                else:
+                    self.respond(200, {"text": text, "meta": meta})
+
+            def respond(self, status, data):
+                self.send_body(status, json.dumps(data).encode())
+
+            def send_body(self, status, out):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def stream_slowly(self, text, meta):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/stream+json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                events = [{"event_type": "text-generation", "text": word + " "} for word in text.split()]
+                events.append({"event_type": "stream-end", "response": {"text": text, "meta": meta}})
+                try:
+                    for event in events:
+                        line = (json.dumps(event) + "\n").encode()
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                        self.wfile.flush()
+                        time.sleep(mock.token_delay)
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    mock.aborted += 1
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}/v1/chat"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def forget(self, conversation_id=None):
+        """Drop server-side history for one conversation (or all of them)"""
+        with self._lock:
+            ids = [conversation_id] if conversation_id is not None else list(self.conversations)
+            for remote_id in ids:
+                self.conversations.pop(remote_id, None)
+                self.forgotten.add(remote_id)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Cohere chat API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each response")
+    args = parser.parse_args()
+    mock = MockUpstream(port=args.port)
+    mock.delay = args.delay
+    print(f"Mock upstream listening on {mock.url}")
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.close()
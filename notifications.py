@@ -0,0 +1,290 @@
+# notifications.py
+# Background delivery of human agent notifications (webhook, email, file)
+
+import atexit
+import json
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import requests
+
+import config
+
+logger = logging.getLogger("notifications")
+
+
+class WebhookSink:
+    """Post notification batches to a webhook (Slack/Teams style JSON)"""
+    channel = "webhook"
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, batch):
+        payload = {
+            "text": f"🚨 {len(batch)} conversation(s) need a human agent",
+            "notifications": batch
+        }
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class SMTPSink:
+    """Send one email per notification batch"""
+    channel = "email"
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None,
+                 use_tls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send(self, batch):
+        top_urgency = max((item['urgency'] for item in batch), key=_urgency_rank)
+
+        message = EmailMessage()
+        message['Subject'] = f"Human Agent Needed - {top_urgency.upper()} Priority ({len(batch)})"
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message.set_content("\n\n".join(_format_notification(item) for item in batch))
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+class FileSink:
+    """Append notifications to a JSON lines file"""
+    channel = "file"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, batch):
+        lines = "".join(json.dumps(item) + "\n" for item in batch)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+def _urgency_rank(urgency):
+    return {'normal': 0, 'high': 1, 'urgent': 2}.get(urgency, 0)
+
+
+def _format_notification(item):
+    return f"""New conversation needs human attention:
+
+Conversation ID: {item.get('conversation_id')}
+Timestamp: {item.get('timestamp')}
+User Message: {item.get('user_message')}
+Reason: {item.get('reason')}
+Urgency: {item.get('urgency')}"""
+
+
+class NotificationDispatcher:
+    """
+    Queue agent notifications and deliver them from background workers.
+
+    notify() never blocks: it dedupes and enqueues. Each sink (channel) has
+    its own queue and workers, which send batches and retry with backoff.
+    """
+
+    def __init__(self, sinks, workers_per_channel=1, batch_size=20, batch_interval=1.0,
+                 max_retries=5, retry_backoff=1.0, dedupe_window=300, max_queue=10000):
+        self.sinks = {sink.channel: sink for sink in sinks}
+        self.workers_per_channel = workers_per_channel
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dedupe_window = dedupe_window
+        self.max_queue = max_queue
+
+        self.stats = {'enqueued': 0, 'deduped': 0, 'dropped': 0, 'delivered': 0,
+                      'retried': 0, 'failed': 0}
+
+        self._lock = threading.Lock()
+        self._recent = {}
+        self._queues = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._pid = None
+
+    def notify(self, conversation_data):
+        """Enqueue a notification for every channel; returns False if deduped"""
+        conversation_id = conversation_data.get('conversation_id')
+        now = time.monotonic()
+
+        with self._lock:
+            self._ensure_started()
+            last_sent = self._recent.get(conversation_id)
+            if last_sent is not None and now - last_sent < self.dedupe_window:
+                self.stats['deduped'] += 1
+                return False
+            self._recent[conversation_id] = now
+            if len(self._recent) > self.max_queue:
+                self._prune_recent(now)
+
+        for channel, channel_queue in self._queues.items():
+            try:
+                channel_queue.put_nowait(conversation_data)
+                self._count('enqueued')
+            except queue.Full:
+                self._count('dropped')
+                logger.warning(f"Notification queue full for {channel}, dropping Conv: {conversation_id}")
+        return True
+
+    def close(self, timeout=5):
+        """Stop workers after flushing whatever is still queued"""
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _ensure_started(self):
+        # Workers are started lazily, and again in a child after a fork
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop = threading.Event()
+        self._queues = {channel: queue.Queue(self.max_queue) for channel in self.sinks}
+        self._threads = []
+        for channel in self.sinks:
+            for i in range(self.workers_per_channel):
+                thread = threading.Thread(target=self._worker, args=(channel,),
+                                          name=f"notify-{channel}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _prune_recent(self, now):
+        expired = [key for key, sent in self._recent.items() if now - sent >= self.dedupe_window]
+        for key in expired:
+            del self._recent[key]
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _worker(self, channel):
+        channel_queue = self._queues[channel]
+        stop = self._stop
+        while True:
+            batch = self._next_batch(channel_queue, stop)
+            if batch:
+                self._deliver(channel, batch, stop)
+            elif stop.is_set():
+                return
+
+    def _next_batch(self, channel_queue, stop):
+        try:
+            first = channel_queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            # While closing, take what is already queued without waiting for more
+            timeout = 0 if stop.is_set() else remaining
+            if timeout < 0:
+                break
+            try:
+                batch.append(channel_queue.get(timeout=timeout) if timeout else channel_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _deliver(self, channel, batch, stop):
+        sink = self.sinks[channel]
+        for attempt in range(self.max_retries):
+            try:
+                sink.send(batch)
+                self._count('delivered', len(batch))
+                return
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    break
+                self._count('retried')
+                logger.warning(f"Notification delivery via {channel} failed (attempt {attempt + 1}): {e}")
+                # Returns early once close() is called, so shutdown isn't held up
+                stop.wait(self.retry_backoff * (2 ** attempt))
+
+        self._count('failed', len(batch))
+        ids = ', '.join(str(item.get('conversation_id')) for item in batch)
+        logger.error(f"Giving up on {channel} notification for Conv: {ids}")
+
+
+def build_sinks_from_config():
+    """Create sinks for every channel configured in the environment"""
+    sinks = []
+    if config.NOTIFY_WEBHOOK_URL:
+        sinks.append(WebhookSink(config.NOTIFY_WEBHOOK_URL))
+    if config.NOTIFY_SMTP_HOST and config.NOTIFY_EMAIL_TO:
+        sinks.append(SMTPSink(
+            config.NOTIFY_SMTP_HOST,
+            config.NOTIFY_SMTP_PORT,
+            config.NOTIFY_EMAIL_FROM,
+            config.NOTIFY_EMAIL_TO,
+            username=config.NOTIFY_SMTP_USER or None,
+            password=config.NOTIFY_SMTP_PASSWORD or None,
+            use_tls=config.NOTIFY_SMTP_TLS
+        ))
+    if config.NOTIFY_FILE:
+        sinks.append(FileSink(config.NOTIFY_FILE))
+    return sinks
+
+
+_default_dispatcher = None
+_default_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher built from config"""
+    global _default_dispatcher
+    if _default_dispatcher is None:
+        with _default_lock:
+            if _default_dispatcher is None:
+                _default_dispatcher = NotificationDispatcher(
+                    build_sinks_from_config(),
+                    batch_size=config.NOTIFY_BATCH_SIZE,
+                    batch_interval=config.NOTIFY_BATCH_INTERVAL,
+                    max_retries=config.NOTIFY_MAX_RETRIES,
+                    dedupe_window=config.NOTIFY_DEDUPE_WINDOW
+                )
+                atexit.register(_default_dispatcher.close)
+    return _default_dispatcher
+
+
+# Usage example:
+if __name__ == "__main__":
+    dispatcher = NotificationDispatcher([FileSink("agent_notifications.log")], batch_interval=0.2)
+
+    for conv in ["conv-1", "conv-2", "conv-1"]:
+        accepted = dispatcher.notify({
+            'conversation_id': conv,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'user_message': "I want to buy your product",
+            'reason': "Strong keyword: buy",
+            'urgency': 'normal'
+        })
+        print(f"{conv}: {'queued' if accepted else 'deduped'}")
+
+    dispatcher.close()
+    print(dispatcher.stats)
@@ -0,0 +1,291 @@
+# providers.py
+# LLM provider layer: backends that turn a chat payload into a reply, and the
+# ModelRouter that picks a model tier per message.
+#
+# Payloads use the Cohere /v1/chat request shape (message, chat_history,
+# preamble, temperature, max_tokens); each provider fills in its own model.
+# Short, simple messages go to the fast tier and complex ones to the strong
+# tier. A tier that turns slow or keeps failing is tried last until it recovers.
+#
+# complete() and stream() fill in a usage dict when given one: the tokens the
+# provider billed (Cohere's meta.billed_units), or an estimate from the text
+# ("estimated": True) when the response carries none.
+
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from cancellation import Cancelled, pause
+import config
+from serialization import encode_chat_payload, loads
+
+logger = logging.getLogger("providers")
+
+WORD_PATTERN = re.compile(r"\b\w+\b")
+
+# Words that suggest a question needs the stronger model
+COMPLEX_KEYWORDS = frozenset([
+    'error', 'bug', 'crash', 'crashes', 'integrate', 'integration', 'api', 'configure', 'configuration',
+    'setup', 'install', 'export', 'import', 'migrate', 'security', 'data', 'compare', 'difference',
+    'why', 'explain', 'troubleshoot', 'sync', 'webhook', 'permissions'
+])
+
+
+def estimate_tokens(text):
+    """Rough token count of text (about four characters a token)"""
+    return (len(text) + 3) // 4
+
+
+def fill_usage(usage, meta, payload, text):
+    """Set usage's input_tokens and output_tokens from a response's meta, else estimate them"""
+    if usage is None:
+        return
+    units = (meta or {}).get("billed_units") or {}
+    if "input_tokens" in units or "output_tokens" in units:
+        usage["input_tokens"] = int(units.get("input_tokens", 0))
+        usage["output_tokens"] = int(units.get("output_tokens", 0))
+        return
+    sent = [payload.get("preamble") or "", payload["message"]]
+    sent += [turn["message"] for turn in payload.get("chat_history", ())]
+    usage["input_tokens"] = sum(estimate_tokens(part) for part in sent)
+    usage["output_tokens"] = estimate_tokens(text or "")
+    usage["estimated"] = True
+
+
+class ProviderError(Exception):
+    """A provider call failed; retryable errors may be retried or failed over"""
+    retryable = True
+
+
+class AuthError(ProviderError):
+    retryable = False
+
+
+class RateLimited(ProviderError):
+    pass
+
+
+class UpstreamError(ProviderError):
+    pass
+
+
+class ProviderTimeout(ProviderError):
+    pass
+
+
+class ProviderConnectionError(ProviderError):
+    pass
+
+
+class ConversationNotFound(ProviderError):
+    """The provider no longer has the server-side conversation named in the payload"""
+
+
+class CohereProvider:
+    """One model behind Cohere's /v1/chat API"""
+
+    def __init__(self, name, model, api_url, api_key, get_session, timeout=30):
+        self.name = name
+        self.model = model
+        self.api_url = api_url
+        self.api_key = api_key
+        # The bot's per-process requests.Session, shared by every provider
+        self.get_session = get_session
+        self.timeout = timeout
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _post(self, payload, stream=False):
+        try:
+            # Pre-encoded body: the preamble's JSON is computed once, not per call
+            body = encode_chat_payload(payload, model=self.model, stream=stream)
+            response = self.get_session().post(self.api_url, headers=self._headers(), data=body,
+                                               timeout=self.timeout, stream=stream)
+        except requests.exceptions.Timeout as e:
+            raise ProviderTimeout(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise ProviderConnectionError(str(e)) from e
+
+        if response.status_code != 200:
+            response.close()
+            if response.status_code == 401:
+                raise AuthError("Authentication failed")
+            if response.status_code == 429:
+                raise RateLimited("Rate limited")
+            if response.status_code == 404 and "conversation_id" in payload:
+                raise ConversationNotFound(payload["conversation_id"])
+            raise UpstreamError(f"HTTP {response.status_code}")
+        return response
+
+    def complete(self, payload, cancel=None, usage=None):
+        """Full reply text (None if the response had no text)"""
+        if cancel is None:
+            result = loads(self._post(payload).content)
+            fill_usage(usage, result.get("meta"), payload, result.get("text"))
+            return result.get("text")
+        # Cancellable: stream it, so closing the response stops the generation
+        return "".join(self.stream(payload, cancel, usage))
+
+    def stream(self, payload, cancel=None, usage=None):
+        """Yield text pieces as they arrive (newline-delimited JSON events)"""
+        with self._post(payload, stream=True) as response:
+            unregister = cancel.on_cancel(response.close) if cancel is not None else None
+            pieces = []
+            meta = None
+            try:
+                for line in response.iter_lines():
+                    if cancel is not None:
+                        cancel.check()
+                    if not line:
+                        continue
+                    event = loads(line)
+                    if event.get("event_type") == "text-generation":
+                        pieces.append(event.get("text", ""))
+                        yield pieces[-1]
+                    elif event.get("event_type") == "stream-end":
+                        meta = (event.get("response") or {}).get("meta")
+                        break
+                fill_usage(usage, meta, payload, "".join(pieces))
+            except Cancelled:
+                raise
+            except Exception as e:
+                # Closing the response from another thread breaks the read in various ways
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled() from e
+                if isinstance(e, requests.exceptions.RequestException):
+                    raise ProviderConnectionError(str(e)) from e
+                raise
+            finally:
+                if unregister is not None:
+                    unregister()
+
+
+class MockProvider:
+    """Local stand-in that answers without any network call (development and tests)"""
+
+    def __init__(self, name="mock", model="mock", latency=0.0, reply=None, conversations=None):
+        self.name = name
+        self.model = model
+        self.latency = latency
+        self.reply = reply
+        # Server-side history by conversation_id; tiers of one account share it
+        self.conversations = {} if conversations is None else conversations
+
+    def complete(self, payload, cancel=None, usage=None):
+        pause(self.latency, cancel)
+        reply = self.reply or f"[{self.model}] You said: {payload['message']}"
+        if "conversation_id" in payload:
+            history = self.conversations.setdefault(payload["conversation_id"], [])
+            history.append({"role": "USER", "message": payload["message"]})
+            history.append({"role": "CHATBOT", "message": reply})
+        fill_usage(usage, None, payload, reply)
+        return reply
+
+    def stream(self, payload, cancel=None, usage=None):
+        for word in self.complete(payload, cancel, usage).split():
+            yield word + " "
+
+
+class ModelRouter:
+    """
+    Orders the providers to try for a message: the tier that suits the message
+    first, then the rest as failover. Keeps per-provider latency (EWMA) and
+    failure counts to demote tiers that are slow or down.
+    """
+
+    def __init__(self, fast, strong, slow_ms=config.MODEL_SLOW_MS, max_failures=config.MODEL_MAX_FAILURES,
+                 cooldown=config.MODEL_COOLDOWN, complex_words=config.MODEL_COMPLEX_WORDS):
+        self.fast = fast
+        self.strong = strong
+        self.slow_ms = slow_ms
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.complex_words = complex_words
+        self._lock = threading.Lock()
+        self.stats = {provider.name: {'calls': 0, 'failures': 0, 'consecutive_failures': 0,
+                                      'latency_ms': None, 'down_until': 0.0}
+                      for provider in (fast, strong)}
+
+    def is_complex(self, message, history=()):
+        """Message features that call for the strong tier"""
+        words = WORD_PATTERN.findall(message.lower())
+        if len(words) > self.complex_words:
+            return True
+        if message.count('?') > 1:
+            return True
+        if any(word in COMPLEX_KEYWORDS for word in words):
+            return True
+        # A long-running conversation is usually a problem being worked through
+        return len(history) >= 6 and len(words) > self.complex_words // 2
+
+    def route(self, message, history=()):
+        """Providers to try, best first"""
+        preferred, other = (self.strong, self.fast) if self.is_complex(message, history) else (self.fast, self.strong)
+        if self._demoted(preferred, other):
+            return [other, preferred]
+        return [preferred, other]
+
+    def _demoted(self, provider, alternative):
+        now = time.monotonic()
+        with self._lock:
+            mine = self.stats[provider.name]
+            theirs = self.stats[alternative.name]
+            if mine['down_until'] > now:
+                return theirs['down_until'] <= now
+            if mine['latency_ms'] is not None and mine['latency_ms'] > self.slow_ms:
+                return theirs['down_until'] <= now and (theirs['latency_ms'] or 0) < mine['latency_ms']
+        return False
+
+    def record(self, provider, seconds=None, failed=False):
+        """Feed back the outcome of one call to provider"""
+        with self._lock:
+            stats = self.stats[provider.name]
+            stats['calls'] += 1
+            if failed:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+                if stats['consecutive_failures'] >= self.max_failures:
+                    stats['down_until'] = time.monotonic() + self.cooldown
+                    logger.warning(f"Model tier {provider.name} ({provider.model}) marked down for {self.cooldown}s")
+            else:
+                stats['consecutive_failures'] = 0
+                stats['down_until'] = 0.0
+            if seconds is not None:
+                ms = seconds * 1000
+                previous = stats['latency_ms']
+                stats['latency_ms'] = ms if previous is None else 0.8 * previous + 0.2 * ms
+
+    def report(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    'model': provider.model,
+                    'calls': stats['calls'],
+                    'failures': stats['failures'],
+                    'latency_ms': None if stats['latency_ms'] is None else round(stats['latency_ms'], 1),
+                    'down': stats['down_until'] > now
+                }
+                for name, stats, provider in ((p.name, self.stats[p.name], p) for p in (self.fast, self.strong))
+            }
+
+
+def build_model_router(api_key, get_session):
+    """Fast and strong tiers for config.LLM_PROVIDER ("cohere" or "mock")"""
+    if config.LLM_PROVIDER == "mock":
+        conversations = {}
+        fast = MockProvider("fast", config.MODEL_FAST, conversations=conversations)
+        strong = MockProvider("strong", config.MODEL_STRONG, conversations=conversations)
+    elif config.LLM_PROVIDER == "cohere":
+        fast = CohereProvider("fast", config.MODEL_FAST, config.COHERE_API_URL, api_key, get_session)
+        strong = CohereProvider("strong", config.MODEL_STRONG, config.COHERE_API_URL, api_key, get_session)
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER: {config.LLM_PROVIDER}")
+    return ModelRouter(fast, strong)
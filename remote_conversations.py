@@ -0,0 +1,151 @@
+# remote_conversations.py
+# Server-side conversation state: with UPSTREAM_HISTORY_MODE=server the
+# provider keeps each conversation's history (Cohere's conversation_id), so an
+# upstream call carries only the new message instead of the last 6 turns.
+#
+# The provider only knows the turns it answered, so a conversation stays in
+# server mode only while the local history matches what the provider has
+# seen. Anything else - a worker restart, an evicted id, a human agent's
+# reply, a failed call, or the provider reporting the conversation as gone -
+# falls back to sending the history from this side, as in client mode.
+# Cohere ignores conversation_id when chat_history is sent, so a remote
+# conversation can't be re-seeded; it stays client-side until cleared.
+#
+#   python remote_conversations.py    # bytes and latency, client vs server mode
+
+import threading
+import uuid
+from collections import OrderedDict
+
+import config
+
+
+class RemoteConversations:
+    """
+    Remote conversation id per local conversation, plus the last history entry
+    the remote side has accounted for. Bounded; least recently used ids go first.
+    """
+
+    def __init__(self, max_conversations=config.REMOTE_CONVERSATIONS_MAX):
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {'server': 0, 'client': 0, 'fallbacks': 0, 'lost': 0}
+
+    def begin(self, conversation_id, history):
+        """Remote id to send for the next upstream turn, or None to send history instead"""
+        with self._lock:
+            entry = self._current(conversation_id, history)
+            self.stats['client' if entry is None else 'server'] += 1
+            return None if entry is None else entry['id']
+
+    def covered(self, conversation_id, history=None):
+        """
+        The next recorded turn is known to the remote side, or not needed there
+        (pass the history for a turn answered locally, before recording it)
+        """
+        with self._lock:
+            if history is not None:
+                entry = self._current(conversation_id, history)
+            else:
+                entry = self._entries.get(conversation_id)
+            if entry is not None:
+                entry['covered'] = True
+
+    def _current(self, conversation_id, history):
+        # Entry that matches history (created for an empty one), else None; lock held
+        last = history[-1] if history else None
+        entry = self._entries.get(conversation_id)
+        if entry is not None and (entry['last'] is not last or entry['covered']):
+            # The history moved on without the remote side (agent reply, failed call),
+            # or the remote side answered a turn that was never recorded here
+            del self._entries[conversation_id]
+            entry = None
+            self.stats['fallbacks'] += 1
+        if entry is None:
+            if last is not None:
+                return None
+            entry = {'id': f"{conversation_id}-{uuid.uuid4().hex[:12]}", 'last': None, 'covered': False}
+            self._entries[conversation_id] = entry
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def recorded(self, conversation_id, previous, last):
+        """A turn was added to the history after entry previous; last is its final entry"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            if entry['covered'] and entry['last'] is previous:
+                entry['last'] = last
+                entry['covered'] = False
+            else:
+                del self._entries[conversation_id]
+                self.stats['fallbacks'] += 1
+
+    def failed(self, conversation_id):
+        """An upstream turn failed, so the remote side may or may not have its message"""
+        with self._lock:
+            if self._entries.pop(conversation_id, None) is not None:
+                self.stats['fallbacks'] += 1
+
+    def lost(self, conversation_id):
+        """The provider no longer has this conversation"""
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+            self.stats['lost'] += 1
+
+    def report(self):
+        with self._lock:
+            return dict(self.stats, tracked=len(self._entries))
+
+
+def _benchmark(turns=20, conversations=5):
+    """Upload bytes and upstream latency per turn for the same conversations in both modes"""
+    import time
+
+    import requests
+
+    import bot as bot_module
+    from mock_upstream import MockUpstream
+    from providers import CohereProvider
+
+    messages = ["How do I export last month's analytics report to CSV from the dashboard?",
+                "The export button is greyed out for my account, what permissions do I need?",
+                "Where do I change the date range before exporting?"]
+    config.COHERE_API_KEY = config.COHERE_API_KEY or "benchmark-key"
+    upstream = MockUpstream()
+    # About the length of a real answer (max_tokens=200)
+    upstream.reply = ("To export it, open Analytics, choose the report and the month, then pick Export and "
+                      "CSV. Exports need the Analyst role; an admin can grant it under Settings > Team. ") * 2
+    session = requests.Session()
+    provider = CohereProvider("bench", config.MODEL_STRONG, upstream.url, "benchmark-key", lambda: session)
+    bot = bot_module.CustomerSupportBot()
+    try:
+        for mode in ("client", "server"):
+            upstream.bytes_received = 0
+            latencies = []
+            for c in range(conversations):
+                history = []
+                remote_id = f"bench-{c}-{uuid.uuid4().hex[:12]}" if mode == "server" else None
+                for turn in range(turns):
+                    message = messages[turn % len(messages)]
+                    payload = bot._build_payload(message, history, remote_id)
+                    start = time.perf_counter()
+                    reply = provider.complete(payload)
+                    latencies.append(time.perf_counter() - start)
+                    history = (history + [{"role": "USER", "message": message},
+                                          {"role": "CHATBOT", "message": reply}])[-10:]
+            calls = turns * conversations
+            latencies.sort()
+            print(f"{mode:6s} mode: {upstream.bytes_received / calls:7.0f} bytes up per turn, "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:5.2f} ms, "
+                  f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:5.2f} ms ({calls} turns)")
+    finally:
+        upstream.close()
+
+
+if __name__ == "__main__":
+    _benchmark()
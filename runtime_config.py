@@ -0,0 +1,214 @@
+# runtime_config.py
+# Settings that can change without a restart: the default company's name and
+# product info, the human-transfer keywords, phrases and messages, the tenants
+# file, the answer pack (answer_pack.py) and a few tuning knobs. RUNTIME_CONFIG_FILE is a JSON object:
+#
+#   {"company_name": "Mshauri Tech",
+#    "product_info_file": "product_info.md",     (or "product_info": "...")
+#    "trigger_keywords": [...], "trigger_phrases": [...], "strong_keywords": [...],
+#    "transfer_messages": {"sales": "...", "general": "..."},
+#    "tuning": {"intent_confidence": 0.85, "model_complex_words": 30}}
+#
+# Fields left out keep their built-in values. A reload happens when one of
+# the files changes (checked every RUNTIME_CONFIG_POLL seconds), on SIGHUP to
+# a worker, or through POST /admin/reload. The new preambles, transfer rules
+# and intent templates are built on a background thread and swapped in with a
+# single assignment of one RuntimeConfig (tenants, answer pack, tuning), so a
+# request sees either the old set or the new one, never a mix, and no request
+# waits for a rebuild. The knobs are then set on the objects that use them;
+# a knob removed from the file goes back to its config.py value. A file that
+# fails to load leaves the running configuration in place.
+
+import collections
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+import answer_pack
+import config
+from tenants import RULE_FIELDS, TenantRegistry
+
+logger = logging.getLogger("runtime_config")
+
+DEFAULT_FIELDS = ("company_name", "product_info") + RULE_FIELDS
+
+# knob -> (object that holds it, attribute, type, value when the file doesn't set it)
+TUNING = {
+    "max_retries": (lambda bot: bot, "max_retries", int, lambda: config.MAX_RETRIES),
+    "intent_confidence": (lambda bot: bot._intent_router, "threshold", float, lambda: config.INTENT_CONFIDENCE),
+    "intent_max_words": (lambda bot: bot._intent_router, "max_words", int, lambda: config.INTENT_MAX_WORDS),
+    "model_complex_words": (lambda bot: bot.model_router, "complex_words", int,
+                            lambda: config.MODEL_COMPLEX_WORDS),
+    "model_slow_ms": (lambda bot: bot.model_router, "slow_ms", float, lambda: config.MODEL_SLOW_MS),
+    "model_max_failures": (lambda bot: bot.model_router, "max_failures", int, lambda: config.MODEL_MAX_FAILURES),
+    "model_cooldown": (lambda bot: bot.model_router, "cooldown", float, lambda: config.MODEL_COOLDOWN),
+    "usage_conversation_budget": (lambda bot: bot.usage_ledger, "conversation_budget", int,
+                                  lambda: config.USAGE_CONVERSATION_BUDGET),
+    "usage_conversation_limit": (lambda bot: bot.usage_ledger, "conversation_limit", int,
+                                 lambda: config.USAGE_CONVERSATION_LIMIT),
+    "usage_tenant_budget": (lambda bot: bot.usage_ledger, "tenant_budget", int, lambda: config.USAGE_TENANT_BUDGET),
+    "usage_tenant_limit": (lambda bot: bot.usage_ledger, "tenant_limit", int, lambda: config.USAGE_TENANT_LIMIT),
+}
+
+# Everything a reload replaces, swapped in as one object: a turn that reads
+# bot.runtime once sees tenants, pack and knobs from the same reload
+RuntimeConfig = collections.namedtuple("RuntimeConfig", ("tenants", "answer_pack", "tuning"))
+
+
+class ConfigError(ValueError):
+    """The runtime configuration file is not valid"""
+
+
+def read_settings(path):
+    """Settings from the runtime config file, checked and with product_info_file read in"""
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"{path}: {e}")
+    if not isinstance(settings, dict):
+        raise ConfigError(f"{path}: expected a JSON object")
+
+    unknown = set(settings) - set(DEFAULT_FIELDS) - {"product_info_file", "tuning"}
+    if unknown:
+        raise ConfigError(f"{path}: unknown settings {sorted(unknown)}")
+    if "product_info_file" in settings:
+        info_path = os.path.join(os.path.dirname(os.path.abspath(path)), settings.pop("product_info_file"))
+        try:
+            with open(info_path) as f:
+                settings["product_info"] = f.read()
+        except OSError as e:
+            raise ConfigError(f"{info_path}: {e}")
+        settings["_product_info_path"] = info_path
+
+    tuning = settings.get("tuning", {})
+    if not isinstance(tuning, dict) or set(tuning) - set(TUNING):
+        raise ConfigError(f"{path}: tuning knobs are {sorted(TUNING)}")
+    try:
+        settings["tuning"] = {knob: TUNING[knob][2](value) for knob, value in tuning.items()}
+    except (TypeError, ValueError) as e:
+        raise ConfigError(f"{path}: {e}")
+    return settings
+
+
+def build(path=None, tenants_path=None):
+    """(tenant registry, tuning knobs) compiled from the configuration files"""
+    path = config.RUNTIME_CONFIG_FILE if path is None else path
+    settings = read_settings(path) if path else {}
+    defaults = {field: settings[field] for field in DEFAULT_FIELDS if field in settings}
+    registry = TenantRegistry.load(tenants_path, defaults)
+    return registry, settings.get("tuning", {})
+
+
+def apply_tuning(bot, tuning, knobs=TUNING):
+    """
+    Set each knob on the object that uses it (skipped if not created yet).
+    Knobs missing from tuning go back to their config.py value, so removing
+    one from the file undoes it.
+    """
+    for knob in knobs:
+        get_target, attribute, _, default = TUNING[knob]
+        target = get_target(bot)
+        if target is not None:
+            setattr(target, attribute, tuning[knob] if knob in tuning else default())
+
+
+class ConfigReloader:
+    """Rebuilds the bot's runtime configuration when asked or when its files change"""
+
+    def __init__(self, bot, path=None, tenants_path=None, poll_interval=None, pack_path=None):
+        self.bot = bot
+        self.path = config.RUNTIME_CONFIG_FILE if path is None else path
+        self.tenants_path = config.TENANTS_FILE if tenants_path is None else tenants_path
+        self.pack_path = config.ANSWER_PACK_FILE if pack_path is None else pack_path
+        self.poll_interval = config.RUNTIME_CONFIG_POLL if poll_interval is None else poll_interval
+        self.version = 0
+        self.stats = {'reloads': 0, 'errors': 0, 'last_error': None, 'last_reload_ms': None}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._mtimes = self._current_mtimes()
+
+    def watched(self):
+        paths = [path for path in (self.path, self.tenants_path, self.pack_path) if path]
+        if self.path:
+            try:
+                settings = read_settings(self.path)
+                if "_product_info_path" in settings:
+                    paths.append(settings["_product_info_path"])
+            except ConfigError:
+                pass
+        return paths
+
+    def _current_mtimes(self):
+        mtimes = {}
+        for path in self.watched():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def reload(self):
+        """Rebuild and swap in the configuration; False (old one kept) if it doesn't load"""
+        with self._lock:
+            start = time.perf_counter()
+            # Taken first, so a change made during the rebuild triggers another one
+            self._mtimes = self._current_mtimes()
+            try:
+                registry, tuning = build(self.path, self.tenants_path)
+                # Do the lazy work now, so the first requests after the swap don't
+                registry.warm()
+                # Checked against the new preamble: a pack for the old company info is dropped
+                pack = answer_pack.load(self.pack_path, registry.default.preamble)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                logger.error(f"Runtime config reload failed, keeping the current one: {e}")
+                return False
+            self.bot.runtime = RuntimeConfig(registry, pack, tuning)
+            apply_tuning(self.bot, tuning)
+            self.version += 1
+            self.stats['reloads'] += 1
+            self.stats['last_error'] = None
+            self.stats['last_reload_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            logger.info(f"Runtime config reloaded (version {self.version}, {len(registry)} tenants)")
+            return True
+
+    def request_reload(self):
+        """Ask the watcher thread to reload (safe to call from a signal handler)"""
+        self._wake.set()
+
+    def install_sighup(self):
+        """Reload on SIGHUP; only possible from the main thread"""
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+            return True
+        except (ValueError, AttributeError):
+            return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-reloader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            woken = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop:
+                return
+            if woken or self._current_mtimes() != self._mtimes:
+                self.reload()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def report(self):
+        return dict(self.stats, version=self.version, watched=self.watched())
@@ -0,0 +1,107 @@
+# startup_report.py
+# Cold-start report: import and initialization cost per module
+#
+#   python startup_report.py                 # breakdown for api.py
+#   python startup_report.py --app web_server
+#   python startup_report.py --check         # exit 1 if time-to-ready is over budget
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import config
+
+# Runs in a fresh interpreter so nothing is already imported or cached
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import {app}
+imported = time.perf_counter()
+from bot import get_bot
+bot = get_bot()
+bot_ready = time.perf_counter()
+bot.fallback_handler
+fallback_ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "bot_init_ms": (bot_ready - imported) * 1000,
+    "fallback_init_ms": (fallback_ready - bot_ready) * 1000,
+    "ready_ms": (fallback_ready - start) * 1000,
+}}))
+'''
+
+OWN_MODULES = {"config", "notifications", "human_fallback", "bot", "api", "web_server"}
+
+
+def measure_startup(app="api"):
+    """Import `app` and initialize the bot in a subprocess; return timings and import costs"""
+    env = dict(os.environ)
+    # The bot refuses to start without a key; any value works since nothing is sent upstream
+    env.setdefault("COHERE_API_KEY", "startup-report")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(app=app)],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    timings["imports"] = _parse_importtime(proc.stderr)
+    return timings
+
+
+def _parse_importtime(stderr):
+    # Lines look like: "import time:  self [us] | cumulative | name", nested imports
+    # are indented two spaces per level
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return imports
+
+
+def print_report(timings, top=10):
+    imports = timings["imports"]
+
+    print("Initialization")
+    for key in ("import_ms", "bot_init_ms", "fallback_init_ms", "ready_ms"):
+        print(f"  {key:<18}{timings[key]:>9.2f}")
+
+    # Depth 1 = what the app and the interpreter import directly
+    print("\nSlowest direct imports (cumulative)")
+    direct = sorted((i for i in imports if i["depth"] <= 1), key=lambda i: -i["cumulative_ms"])
+    for item in direct[:top]:
+        print(f"  {item['module']:<40}{item['cumulative_ms']:>9.1f} ms")
+
+    print("\nProject modules (self time)")
+    for item in imports:
+        if item["module"] in OWN_MODULES:
+            print(f"  {item['module']:<40}{item['self_ms']:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Break down cold-start time")
+    parser.add_argument("--app", default="api", help="module to import (api or web_server)")
+    parser.add_argument("--runs", type=int, default=3, help="report the fastest of N runs")
+    parser.add_argument("--budget-ms", type=float, default=config.STARTUP_BUDGET_MS)
+    parser.add_argument("--check", action="store_true", help="exit 1 if ready_ms exceeds the budget")
+    args = parser.parse_args()
+
+    best = min((measure_startup(args.app) for _ in range(args.runs)), key=lambda t: t["ready_ms"])
+    print_report(best)
+
+    within_budget = best["ready_ms"] <= args.budget_ms
+    print(f"\nTime to ready: {best['ready_ms']:.1f} ms (budget {args.budget_ms:.0f} ms) - "
+          f"{'OK' if within_budget else 'OVER BUDGET'}")
+    if args.check and not within_budget:
+        sys.exit(1)
@@ -0,0 +1,165 @@
+# tenants.py
+# Several companies served by one process. The default tenant is the company
+# in config.py (COMPANY_NAME, PRODUCT_INFO, the built-in transfer rules);
+# others come from TENANTS_FILE, a JSON object keyed by tenant id:
+#
+#   {"acme": {"company_name": "Acme", "product_info": "- Acme Cloud: ...",
+#             "hosts": ["support.acme.com"],
+#             "trigger_keywords": [...], "trigger_phrases": [...],
+#             "strong_keywords": [...], "transfer_messages": {"sales": "..."}}}
+#
+# Rule fields left out use the defaults in human_fallback.py. Each tenant's
+# preamble and transfer rules are compiled when the file is loaded, and its
+# conversations live under "<tenant>:<conversation_id>" (see conversation_key),
+# so two tenants never share history, flags or journal records.
+#
+# A request picks its tenant with the X-Tenant-ID header (or ?tenant= on the
+# WebSocket, where browsers can't set headers), else by its Host.
+
+import json
+import logging
+import re
+
+import config
+from human_fallback import TransferRules
+from serialization import preamble_fragment
+
+logger = logging.getLogger("tenants")
+
+DEFAULT_TENANT = "default"
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+RULE_FIELDS = ("trigger_keywords", "trigger_phrases", "strong_keywords", "transfer_messages")
+
+
+class UnknownTenant(Exception):
+    """A request named a tenant this process doesn't serve"""
+
+
+def build_preamble(company_name, product_info):
+    """System message sent upstream with every chat call"""
+    return f"""You are a helpful customer support assistant for {company_name}.
+
+INSTRUCTIONS:
+- Be friendly, professional, and concise
+- Provide clear, actionable answers
+- If you don't know something, say so and offer to connect with a human agent
+- Keep responses under 3 sentences when possible
+- Be specific and helpful
+
+COMPANY INFO:
+{product_info}
+
+Always prioritize being helpful and accurate over being verbose."""
+
+
+def conversation_key(tenant_id, conversation_id):
+    """
+    "<tenant>:<conversation_id>", or the bare id in the default tenant. A
+    default-tenant id with a ":" in it is prefixed too ("default:acme:c1"),
+    so a client can't name another tenant's conversation.
+    """
+    if tenant_id == DEFAULT_TENANT and ":" not in conversation_id:
+        return conversation_id
+    return f"{tenant_id}:{conversation_id}"
+
+
+class Tenant:
+    """One company's compiled settings"""
+
+    def __init__(self, tenant_id, company_name, product_info, rules=None, hosts=()):
+        self.tenant_id = tenant_id
+        self.company_name = company_name
+        self.product_info = product_info
+        # None means the fallback handler's own (default) rules
+        self.rules = rules
+        self.hosts = tuple(host.lower() for host in hosts)
+        self.preamble = build_preamble(company_name, product_info)
+        self._templates = None
+
+    @property
+    def is_default(self):
+        return self.tenant_id == DEFAULT_TENANT
+
+    @property
+    def templates(self):
+        """Intent router answers for this company (None: the router's own, built from config.py)"""
+        if self._templates is None and not self._uses_config_info():
+            from intent_router import build_templates
+            self._templates = build_templates(self.company_name, self.product_info)
+        return self._templates
+
+    def _uses_config_info(self):
+        return (self.is_default and self.company_name == config.COMPANY_NAME
+                and self.product_info == config.PRODUCT_INFO)
+
+    def key(self, conversation_id):
+        """The bot's key for one of this tenant's conversations"""
+        return conversation_key(self.tenant_id, conversation_id)
+
+    @classmethod
+    def from_spec(cls, tenant_id, spec):
+        if not TENANT_ID_PATTERN.match(tenant_id) or tenant_id == DEFAULT_TENANT:
+            raise ValueError(f"Invalid tenant id: {tenant_id!r}")
+        for field in ("company_name", "product_info"):
+            if not isinstance(spec.get(field), str):
+                raise ValueError(f"Tenant {tenant_id}: '{field}' must be a string")
+        rules = TransferRules(**{field: spec[field] for field in RULE_FIELDS if field in spec})
+        return cls(tenant_id, spec["company_name"], spec["product_info"], rules, spec.get("hosts", ()))
+
+
+class TenantRegistry:
+    """Every tenant served here, by id and by host"""
+
+    def __init__(self, tenants=(), default=None):
+        self.default = default or Tenant(DEFAULT_TENANT, config.COMPANY_NAME, config.PRODUCT_INFO)
+        self.tenants = {DEFAULT_TENANT: self.default}
+        self.by_host = {}
+        for tenant in tenants:
+            self.tenants[tenant.tenant_id] = tenant
+            for host in tenant.hosts:
+                self.by_host[host] = tenant
+
+    @classmethod
+    def load(cls, path=None, defaults=None):
+        """
+        Registry for TENANTS_FILE (just the default tenant if unset). defaults
+        overrides the default tenant's company_name, product_info and rule fields.
+        """
+        path = config.TENANTS_FILE if path is None else path
+        defaults = defaults or {}
+        rules = None
+        if any(field in defaults for field in RULE_FIELDS):
+            rules = TransferRules(**{field: defaults[field] for field in RULE_FIELDS if field in defaults})
+        default = Tenant(DEFAULT_TENANT, defaults.get("company_name", config.COMPANY_NAME),
+                         defaults.get("product_info", config.PRODUCT_INFO), rules)
+        if not path:
+            return cls(default=default)
+        with open(path) as f:
+            specs = json.load(f)
+        registry = cls((Tenant.from_spec(tenant_id, spec) for tenant_id, spec in specs.items()), default)
+        logger.info(f"Loaded {len(specs)} tenants from {path}")
+        return registry
+
+    def warm(self):
+        """Build what tenants otherwise create on first use (templates, encoded preambles)"""
+        for tenant in self.tenants.values():
+            tenant.templates
+            preamble_fragment(tenant.preamble)
+
+    def get(self, tenant_id):
+        tenant = self.tenants.get(tenant_id or DEFAULT_TENANT)
+        if tenant is None:
+            raise UnknownTenant(tenant_id)
+        return tenant
+
+    def resolve(self, connection):
+        """Tenant for an HTTP request or WebSocket; raises UnknownTenant"""
+        tenant_id = connection.headers.get(TENANT_HEADER) or connection.query_params.get("tenant")
+        if tenant_id:
+            return self.get(tenant_id)
+        host = connection.headers.get("host", "").split(":")[0].lower()
+        return self.by_host.get(host, self.default)
+
+    def __len__(self):
+        return len(self.tenants)
@@ -0,0 +1,128 @@
+# test_admission.py
+# Admission control: in-flight limit, bounded wait queue and rate limits
+
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import api
+from admission import AdmissionController, Rejected, RateLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_waiters_get_slots_in_order_as_they_free_up():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=2, queue_timeout=1)
+        order = []
+
+        async def turn(name, hold):
+            async with controller.admit():
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        await asyncio.gather(turn("a", 0.05), turn("b", 0), turn("c", 0))
+        return controller, order
+
+    controller, order = run(scenario())
+    assert order == ["a", "b", "c"]
+    assert controller.inflight == 0
+    assert controller.stats['queued'] == 2 and controller.stats['admitted'] == 3
+
+
+def test_full_queue_is_rejected_immediately():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=1)
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.admit():
+                await release.wait()
+
+        tasks = [asyncio.create_task(holder()), asyncio.create_task(holder())]
+        await asyncio.sleep(0.01)
+        with pytest.raises(Rejected) as rejected:
+            await controller._acquire()
+        release.set()
+        await asyncio.gather(*tasks)
+        return controller, rejected.value
+
+    controller, rejected = run(scenario())
+    assert rejected.status == 503 and rejected.headers() == {"Retry-After": "1"}
+    assert controller.inflight == 0 and controller.stats['rejected'] == 1
+
+
+def test_queue_wait_is_bounded():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=5, queue_timeout=0.05)
+        async with controller.admit():
+            with pytest.raises(Rejected):
+                await controller._acquire()
+        return controller
+
+    controller = run(scenario())
+    assert controller.stats['timed_out'] == 1
+    assert controller.inflight == 0 and not controller._waiters
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=5, queue_timeout=1)
+        async with controller.admit():
+            waiter = asyncio.create_task(controller._acquire())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.sleep(0.01)
+        return controller
+
+    controller = run(scenario())
+    assert controller.inflight == 0 and not controller._waiters
+
+
+def test_rate_limiter_refills_over_time():
+    limiter = RateLimiter(rate=1, burst=2)
+    assert limiter.hit("x", now=0) == 0
+    assert limiter.hit("x", now=0) == 0
+    assert limiter.hit("x", now=0) == pytest.approx(1)
+    assert limiter.hit("y", now=0) == 0
+    assert limiter.hit("x", now=1.5) == 0
+
+
+def test_chat_returns_429_with_retry_after_for_one_noisy_conversation(bot, monkeypatch):
+    monkeypatch.setattr(admission.chat_admission, "per_conversation", RateLimiter(rate=1 / 60, burst=2))
+    with TestClient(api.app) as client:
+        answers = [client.post("/chat", json={"message": f"where is report {i}", "conversation_id": "noisy"})
+                   for i in range(3)]
+        other = client.post("/chat", json={"message": "where is my report", "conversation_id": "quiet"})
+
+    assert [r.status_code for r in answers] == [200, 200, 429]
+    assert int(answers[2].headers["Retry-After"]) >= 1
+    assert answers[2].json()["success"] is False
+    assert other.status_code == 200
+
+
+def test_chat_sheds_load_with_503_when_saturated(bot, upstream, monkeypatch):
+    upstream.delay = 0.3
+    monkeypatch.setattr(admission.chat_admission, "controller",
+                        AdmissionController(max_inflight=1, max_queue=0, queue_timeout=0.1))
+    statuses = []
+
+    with TestClient(api.app) as client:
+        def call(i):
+            statuses.append(client.post("/chat", json={"message": "where is my report", "conversation_id": f"c{i}"}))
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    codes = sorted(r.status_code for r in statuses)
+    assert codes == [200, 503, 503]
+    assert all("Retry-After" in r.headers for r in statuses if r.status_code == 503)
+    assert len(upstream.requests) == 1
@@ -0,0 +1,305 @@
+# test_affinity_router.py
+# Affinity router: ring placement, proxying to the owning node, batch splitting,
+# and handing conversations over when nodes join or leave
+
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import affinity_router
+import api
+import bot as bot_module
+import config
+from affinity_router import AffinityRouter, HashRing
+from serialization import dumps, loads
+from tenants import conversation_key
+
+ADMIN = {"Authorization": "Bearer secret"}
+
+
+class Node:
+    """A bot node with its own bot, serving the endpoints the router uses"""
+
+    def __init__(self, name):
+        self.name = name
+        self.url = f"http://{name}"
+        self.bot = bot_module.CustomerSupportBot()
+        self.requests = []
+        self.app = FastAPI()
+
+        @self.app.post("/chat")
+        async def chat(request: Request):
+            body = loads(await request.body())
+            self.requests.append(("chat", body["conversation_id"]))
+            tenant_id = request.headers.get("x-tenant-id")
+            key = conversation_key(tenant_id or "default", body["conversation_id"])
+            reply = await run_in_threadpool(self.bot.chat, body["message"], key, show_typing=False)
+            return {"success": True, "response": reply, "node": self.name,
+                    "forwarded_for": request.headers.get("x-forwarded-for")}
+
+        @self.app.post("/chat/batch")
+        async def chat_batch(request: Request):
+            items = loads(await request.body())["items"]
+            self.requests.append(("batch", len(items)))
+
+            async def stream():
+                for index, item in reversed(list(enumerate(items))):
+                    reply = await run_in_threadpool(self.bot.chat, item["message"], item["conversation_id"],
+                                                    show_typing=False)
+                    yield dumps({"index": index, "id": item.get("id"), "success": True, "response": reply,
+                                 "node": self.name}) + b"\n"
+                yield dumps({"done": True, "items": len(items), "failed": 0}) + b"\n"
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        @self.app.get("/internal/conversations")
+        async def held():
+            return {"conversations": self.bot.conversation_keys()}
+
+        @self.app.post("/internal/handoff/export")
+        async def export(request: Request):
+            keys = loads(await request.body())["conversations"]
+            return {"conversations": self.bot.export_conversations(keys)}
+
+        @self.app.post("/internal/handoff/import")
+        async def import_(request: Request):
+            return {"imported": self.bot.import_conversations(loads(await request.body())["conversations"])}
+
+        @self.app.post("/internal/handoff/release")
+        async def release(request: Request):
+            return {"released": self.bot.drop_conversations(loads(await request.body())["conversations"])}
+
+
+class Nodes(httpx.AsyncBaseTransport):
+    """Transport delivering the router's requests to in-process nodes by host"""
+
+    def __init__(self, names):
+        self.nodes = {name: Node(name) for name in names}
+        self.down = set()
+
+    def add(self, name):
+        self.nodes[name] = Node(name)
+        return self.nodes[name]
+
+    async def handle_async_request(self, request):
+        if request.url.host in self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        return await httpx.ASGITransport(app=self.nodes[request.url.host].app).handle_async_request(request)
+
+
+@pytest.fixture
+def nodes(upstream, monkeypatch):
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", False)
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    transport = Nodes(["node-a", "node-b"])
+    router = AffinityRouter([node.url for node in transport.nodes.values()], vnodes=64, transport=transport)
+    monkeypatch.setattr(affinity_router, "router", router)
+    return transport
+
+
+def chat(client, conversation_id, message="where is my report", **kwargs):
+    return client.post("/chat", json={"message": message, "conversation_id": conversation_id}, **kwargs).json()
+
+
+def test_ring_spreads_keys_and_moves_few_on_membership_change():
+    keys = [f"conversation-{i}" for i in range(20000)]
+    ring = HashRing([f"http://node-{i}" for i in range(4)], vnodes=160)
+    owners = {key: ring.node_for(key) for key in keys}
+    shares = Counter(owners.values())
+    assert max(shares.values()) < 1.25 * len(keys) / 4
+
+    grown = ring.with_nodes(add=["http://node-4"])
+    moved = [key for key in keys if grown.node_for(key) != owners[key]]
+    assert all(grown.node_for(key) == "http://node-4" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.25
+
+    shrunk = ring.with_nodes(remove=["http://node-0"])
+    moved = [key for key in keys if shrunk.node_for(key) != owners[key]]
+    assert set(moved) == {key for key in keys if owners[key] == "http://node-0"}
+
+    with pytest.raises(LookupError):
+        HashRing([]).node_for("c1")
+
+
+def test_conversation_sticks_to_its_node(nodes):
+    with TestClient(affinity_router.app) as client:
+        replies = [chat(client, "c1", f"where is report {i}") for i in range(3)]
+        tenant = chat(client, "c1", headers={"X-Tenant-ID": "acme"})
+
+    owner = affinity_router.router.ring.node_for("c1").removeprefix("http://")
+    assert {reply["node"] for reply in replies} == {owner}
+    assert replies[0]["forwarded_for"] == "testclient"
+    assert len(nodes.nodes[owner].bot.conversations["c1"]) == 6
+    # Another tenant's conversation with the same id has its own key
+    assert tenant["node"] == affinity_router.router.ring.node_for("acme:c1").removeprefix("http://")
+
+
+def test_routing_key_matches_the_bot_key():
+    class Request:
+        def __init__(self, headers):
+            self.headers = headers
+            self.query_params = {}
+
+    assert AffinityRouter.routing_key(Request({}), "c1") == "c1"
+    assert AffinityRouter.routing_key(Request({"X-Tenant-ID": "acme"}), "c1") == "acme:c1"
+    # A default-tenant id that looks like another tenant's key is not that key
+    assert AffinityRouter.routing_key(Request({}), "acme:c1") == "default:acme:c1"
+
+
+def test_batch_is_split_by_owner_and_merged(nodes):
+    ring = affinity_router.router.ring
+    ids = [f"c{i}" for i in range(12)]
+    assert len({ring.node_for(cid) for cid in ids}) == 2
+    items = [{"conversation_id": cid, "message": f"where is report {i}", "id": f"m{i}"} for i, cid in enumerate(ids)]
+    with TestClient(affinity_router.app) as client:
+        response = client.post("/chat/batch", json={"items": items})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert lines[-1] == {"done": True, "items": 12, "failed": 0}
+    results = {line["index"]: line for line in lines[:-1]}
+    assert sorted(results) == list(range(12))
+    for index, cid in enumerate(ids):
+        assert results[index]["id"] == f"m{index}"
+        assert results[index]["node"] == ring.node_for(cid).removeprefix("http://")
+    # One sub-batch per node
+    assert sorted(node.requests[0][1] for node in nodes.nodes.values() if node.requests == node.requests[:1]) == \
+        sorted(Counter(ring.node_for(cid) for cid in ids).values())
+
+
+def test_batch_items_of_an_unreachable_node_fail(nodes):
+    nodes.down.add("node-b")
+    items = [{"conversation_id": f"c{i}", "message": "where is my report"} for i in range(12)]
+    with TestClient(affinity_router.app) as client:
+        lines = [json.loads(line) for line in client.post("/chat/batch", json={"items": items}).text.splitlines()]
+        single = client.post("/chat", json={"message": "hi", "conversation_id": next(
+            f"c{i}" for i in range(12) if affinity_router.router.ring.node_for(f"c{i}") == "http://node-b")})
+
+    down = [line for line in lines[:-1] if not line["success"]]
+    assert lines[-1]["failed"] == len(down) > 0
+    assert {line["status"] for line in down} == {502}
+    assert single.status_code == 502
+
+
+def test_joining_node_takes_over_its_conversations_with_history(nodes):
+    with TestClient(affinity_router.app) as client:
+        for i in range(30):
+            chat(client, f"c{i}")
+        before = {f"c{i}": affinity_router.router.ring.node_for(f"c{i}") for i in range(30)}
+        moving = next(cid for cid in before
+                      if affinity_router.router.ring.with_nodes(add=["http://node-c"]).node_for(cid) != before[cid])
+        flagged = nodes.nodes[before[moving].removeprefix("http://")].bot.fallback_handler.flagged_conversations
+        flagged[moving] = {"urgency": "high"}
+
+        nodes.add("node-c")
+        result = client.post("/router/nodes", json={"add": ["http://node-c"]}, headers=ADMIN).json()
+        ring = affinity_router.router.ring
+        moved = [cid for cid in before if ring.node_for(cid) != before[cid]]
+        assert result == {"success": True, "nodes": ["http://node-a", "http://node-b", "http://node-c"],
+                          "conversations": 30, "moved": len(moved)}
+        assert moved and all(ring.node_for(cid) == "http://node-c" for cid in moved)
+
+        cid = moved[0]
+        reply = chat(client, cid, "where is my invoice")
+
+    new_owner = nodes.nodes["node-c"].bot
+    assert reply["node"] == "node-c"
+    # The new owner continued the conversation: earlier turn, then this one
+    assert [turn["message"] for turn in new_owner.conversations[cid]][0] == "where is my report"
+    assert len(new_owner.conversations[cid]) == 4
+    assert sorted(new_owner.conversation_keys()) == sorted(moved)
+    old_owner = nodes.nodes[before[cid].removeprefix("http://")].bot
+    assert cid not in old_owner.conversations
+    assert new_owner.fallback_handler.flagged_conversations[moving] == {"urgency": "high"}
+    assert moving not in flagged
+
+
+def test_leaving_node_hands_everything_over(nodes):
+    with TestClient(affinity_router.app) as client:
+        for i in range(20):
+            chat(client, f"c{i}")
+        result = client.post("/router/nodes", json={"remove": ["http://node-a"]}, headers=ADMIN).json()
+
+    assert result["nodes"] == ["http://node-b"] and result["conversations"] == 20
+    assert nodes.nodes["node-a"].bot.conversation_keys() == []
+    assert len(nodes.nodes["node-b"].bot.conversation_keys()) == 20
+
+
+def test_failed_handoff_keeps_the_ring(nodes):
+    with TestClient(affinity_router.app) as client:
+        chat(client, "c1")
+        nodes.nodes["node-c"] = Node("node-c")
+        nodes.down.add("node-b")
+        response = client.post("/router/nodes", json={"add": ["http://node-c"]}, headers=ADMIN)
+        assert response.status_code == 502
+        assert affinity_router.router.ring.nodes == ("http://node-a", "http://node-b")
+
+        forced = client.post("/router/nodes", json={"remove": ["http://node-b"], "force": True}, headers=ADMIN)
+        assert forced.json()["nodes"] == ["http://node-a"]
+        assert client.post("/router/nodes", json={"remove": ["http://node-a"]}, headers=ADMIN).status_code == 502
+        assert client.post("/router/nodes", json={"add": ["http://node-c"]}).status_code == 401
+
+
+def test_requests_for_moving_conversations_wait_for_the_handoff(nodes):
+    router = affinity_router.router
+    new = router.ring.with_nodes(add=["http://node-c"])
+    moving = next(f"c{i}" for i in range(100) if new.node_for(f"c{i}") == "http://node-c")
+    staying = next(f"c{i}" for i in range(100) if new.node_for(f"c{i}") == router.ring.node_for(f"c{i}"))
+
+    async def scenario():
+        done = asyncio.Event()
+        router._transition = (router.ring, new, done)
+        waiting = asyncio.ensure_future(router.route([moving]))
+        assert await router.route([staying]) == {staying: new.node_for(staying)}
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        router.ring, router._transition = new, None
+        done.set()
+        return await waiting
+
+    assert asyncio.run(scenario()) == {moving: "http://node-c"}
+    assert router.report()['in_flight'] == 2
+
+
+def test_node_handoff_endpoints(bot, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    with TestClient(api.app) as client:
+        client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"})
+        assert client.get("/internal/conversations", headers=ADMIN).json() == {"conversations": ["c1"]}
+        assert client.get("/internal/conversations").status_code == 401
+
+        exported = client.post("/internal/handoff/export", json={"conversations": ["c1", "nope"]},
+                               headers=ADMIN).json()
+        assert list(exported["conversations"]) == ["c1"]
+        assert exported["conversations"]["c1"]["flag"] is None
+
+        released = client.post("/internal/handoff/release", json={"conversations": ["c1"]}, headers=ADMIN)
+        assert released.json() == {"released": 1} and "c1" not in bot.conversations
+
+        exported["conversations"]["acme:c2"] = {"history": [], "flag": {"urgency": "low"}}
+        assert client.post("/internal/handoff/import", json=exported, headers=ADMIN).json() == {"imported": 2}
+        assert len(bot.conversations["c1"]) == 2
+        assert bot.fallback_handler.flagged_conversations["acme:c2"] == {"urgency": "low"}
+        assert client.post("/internal/handoff/import", json={"conversations": []},
+                           headers=ADMIN).status_code == 400
+
+
+def test_dropped_conversations_stay_dropped_after_a_restart(bot, tmp_path):
+    bot.open_journal(str(tmp_path))
+    bot.import_conversations({"c1": {"history": [{"role": "USER", "message": "hi"}], "flag": {"urgency": "low"}}})
+    bot.drop_conversations(["c1"])
+    bot.close_journal()
+
+    restarted = bot_module.CustomerSupportBot()
+    restarted.open_journal(str(tmp_path))
+    restarted.close_journal()
+    assert restarted.conversation_keys() == []
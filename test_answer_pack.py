@@ -0,0 +1,147 @@
+# test_answer_pack.py
+# Answer pack: mining frequent questions, the mapped hash index, and the bot consulting it
+
+import json
+
+import pytest
+
+import answer_pack
+import bot as bot_module
+import config
+from answer_pack import AnswerPack, PackError
+from journal import encode
+from runtime_config import ConfigReloader
+
+
+@pytest.fixture
+def pack_bot(upstream, monkeypatch):
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", False)
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    return bot_module.CustomerSupportBot()
+
+
+def pack_meta(bot, version=1):
+    return {"version": version, "preamble": answer_pack.preamble_digest(bot.system_message)}
+
+
+def test_roundtrip_and_normalized_lookup(tmp_path):
+    answers = {f"question number {i}": f"answer {i} ✓" for i in range(500)}
+    path = tmp_path / "answers.pack"
+    answer_pack.write_pack(str(path), answers, {"version": 7})
+    pack = AnswerPack(str(path))
+
+    assert pack.version == 7 and pack.entries == 500
+    assert pack.lookup("Question   number 42?!") == "answer 42 ✓"
+    assert pack.lookup("question number 500") is None
+    assert pack.lookup("???") is None
+    assert dict(pack.items()) == answers
+    assert pack.report()['hits'] == 1 and pack.report()['lookups'] == 3
+
+
+def test_rejects_files_that_are_not_packs(tmp_path):
+    path = tmp_path / "answers.pack"
+    path.write_bytes(b"")
+    with pytest.raises(PackError):
+        AnswerPack(str(path))
+    path.write_bytes(b"not a pack at all, just some bytes")
+    with pytest.raises(PackError):
+        AnswerPack(str(path))
+
+
+def test_mines_chat_logs_and_journals(tmp_path):
+    log = tmp_path / "chats.jsonl"
+    log.write_text("\n".join(json.dumps({"message": m}) for m in
+                             ["How do I reset my password?", "how do i reset my password",
+                              "How do I reset my password?", "What is the price?", "what is the price",
+                              "something asked once"]))
+    journal_dir = tmp_path / "journal"
+    journal_dir.mkdir()
+    history = [{"role": "USER", "message": "What is the price"}, {"role": "CHATBOT", "message": "$10"}]
+    (journal_dir / "journal-1.log").write_bytes(encode({"t": "conv", "c": "c1", "h": history}))
+
+    questions = answer_pack.mine_questions([str(log), str(journal_dir)], top=10, min_count=2)
+
+    assert questions == [("how do i reset my password", 3, "How do I reset my password?"),
+                         ("what is the price", 3, "What is the price?")]
+
+
+def test_mines_only_opening_messages(tmp_path):
+    log = tmp_path / "chats.jsonl"
+    lines = []
+    for c in range(3):
+        lines += [{"conversation_id": f"c{c}", "message": "How do I export data?"},
+                  {"conversation_id": f"c{c}", "message": "yes"},
+                  {"conversation_id": f"c{c}", "message": "it still doesn't work"}]
+    log.write_text("\n".join(json.dumps(line) for line in lines))
+    journal_dir = tmp_path / "journal"
+    journal_dir.mkdir()
+    opening = [{"role": "USER", "message": "yes"}, {"role": "CHATBOT", "message": "Hi"}]
+    follow_up = [{"role": "USER", "message": "How do I export data?"}, {"role": "CHATBOT", "message": "..."},
+                 {"role": "USER", "message": "ok"}, {"role": "CHATBOT", "message": "..."}]
+    records = [{"t": "conv", "c": f"j{i}", "h": follow_up[:4]} for i in range(3)]
+    (journal_dir / "journal-1.log").write_bytes(b"".join(encode(record) for record in records)
+                                                + encode({"t": "conv", "c": "j9", "h": opening}))
+
+    questions = answer_pack.mine_questions([str(log), str(journal_dir)], top=10, min_count=2)
+
+    assert questions == [("how do i export data", 3, "How do I export data?")]
+
+
+def test_build_generates_answers_and_skips_transfers(pack_bot, upstream, tmp_path):
+    path = tmp_path / "answers.pack"
+    questions = [("how do i export data", 5, "How do I export data?"),
+                 ("i need a human agent", 3, "I need a human agent")]
+
+    meta = answer_pack.build(pack_bot, questions, str(path), version=3)
+
+    assert meta['entries'] == 1 and meta['skipped'] == {'human': 1, 'failed': 0}
+    assert len(upstream.requests) == 1 and upstream.requests[0]["chat_history"] == []
+    pack = AnswerPack(str(path))
+    assert pack.version == 3
+    assert "How do I export data?" in pack.lookup("how do I export data")
+
+
+def test_bot_answers_from_the_pack_without_upstream(pack_bot, upstream, tmp_path, monkeypatch):
+    path = tmp_path / "answers.pack"
+    answer_pack.write_pack(str(path), {"how do i export data": "Use Settings > Export."}, pack_meta(pack_bot))
+    monkeypatch.setattr(config, "ANSWER_PACK_FILE", str(path))
+    instance = bot_module.CustomerSupportBot()
+
+    assert instance.chat("How do I export data?", "c1", show_typing=False) == "Use Settings > Export."
+    events = list(instance.chat_stream("how do i export data", "c2"))
+    assert events == [("done", "Use Settings > Export.")]
+    assert upstream.requests == []
+    assert instance.conversations["c1"][-1]["message"] == "Use Settings > Export."
+    # A follow-up depends on the conversation so far; the pack's answer was made without it
+    assert instance.chat("how do i export data", "c1", show_typing=False).startswith("Echo:")
+    assert len(upstream.requests) == 1 and upstream.requests[0]["chat_history"]
+    # Human transfers still come first
+    answer_pack.write_pack(str(path), {"i need a human agent": "No."}, pack_meta(pack_bot))
+    instance.runtime = instance.runtime._replace(answer_pack=answer_pack.load(str(path), instance.system_message))
+    assert instance.chat("I need a human agent", "c3", show_typing=False) != "No."
+    assert "c3" in instance.fallback_handler.flagged_conversations
+
+
+def test_pack_for_other_company_info_is_ignored(pack_bot, tmp_path, monkeypatch):
+    path = tmp_path / "answers.pack"
+    answer_pack.write_pack(str(path), {"hi": "hello"}, {"version": 1, "preamble": "something else"})
+    monkeypatch.setattr(config, "ANSWER_PACK_FILE", str(path))
+
+    assert bot_module.CustomerSupportBot().answer_pack is None
+
+
+def test_new_pack_version_is_swapped_in(pack_bot, tmp_path):
+    path = tmp_path / "answers.pack"
+    answer_pack.write_pack(str(path), {"price": "$10"}, pack_meta(pack_bot, 1))
+    reloader = ConfigReloader(pack_bot, path="", tenants_path="", pack_path=str(path))
+    assert reloader.reload()
+    old = pack_bot.answer_pack
+
+    answer_pack.write_pack(str(path), {"price": "$12"}, pack_meta(pack_bot, 2))
+    assert reloader.reload()
+
+    assert pack_bot.answer_pack.version == 2
+    assert pack_bot.answer_pack.lookup("Price?") == "$12"
+    # A request still holding the old pack reads the file it mapped
+    assert old.lookup("price") == "$10"
@@ -0,0 +1,41 @@
+# test_api.py
+# Routes shared by the JSON API and the website
+
+import logging
+from logging.handlers import QueueHandler
+
+from fastapi.testclient import TestClient
+
+import api
+
+
+def test_chat_error_does_not_leak_exception_text(bot, monkeypatch):
+    def broken_chat(*args, **kwargs):
+        raise RuntimeError("database password is hunter2")
+
+    monkeypatch.setattr(bot, "chat", broken_chat)
+    with TestClient(api.app) as client:
+        response = client.post("/chat", json={"message": "hello"})
+
+    assert response.status_code == 500
+    assert response.json() == {"success": False, "error": "Internal server error. Please try again."}
+
+
+def test_app_logs_go_through_one_queue_handler(bot):
+    with TestClient(api.app):
+        root_handlers = [handler for handler in logging.getLogger().handlers
+                         if isinstance(handler, QueueHandler)]
+        for name in ("api", "web_server"):
+            request_logger = logging.getLogger(name)
+            assert not request_logger.handlers and request_logger.propagate
+
+    # One handler, so each record is written once; removed again at shutdown
+    assert len(root_handlers) == 1
+    assert not any(isinstance(handler, QueueHandler) for handler in logging.getLogger().handlers)
+
+
+def test_chat_response_serves_both_clients(bot):
+    with TestClient(api.app) as client:
+        response = client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"})
+
+    assert response.json() == {"success": True, "response": "Echo: where is my report.", "conversation_id": "c1"}
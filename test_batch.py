@@ -0,0 +1,127 @@
+# test_batch.py
+# POST /chat/batch: concurrent conversations, in-order turns, results streamed as they finish
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import batch
+import bot as bot_module
+from serialization import InvalidBody
+
+
+@pytest.fixture
+def fast_bot(bot, monkeypatch):
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    return bot
+
+
+def post_batch(client, items, **kwargs):
+    response = client.post("/chat/batch", json={"items": items}, **kwargs)
+    return response, [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.parametrize("body, error", [
+    (b"[]", "'items' must be a non-empty list"),
+    (b'{"items": []}', "'items' must be a non-empty list"),
+    (b'{"items": [{"conversation_id": "c1"}]}', "Item 0: 'message' is required"),
+    (b'{"items": [{"message": "hi"}, {"message": 5}]}', "Item 1: 'message' must be a string"),
+])
+def test_invalid_batches_are_rejected(body, error):
+    with pytest.raises(InvalidBody, match=error):
+        batch.parse_batch(body)
+
+
+def test_batch_size_is_capped():
+    with pytest.raises(InvalidBody, match="At most 2 items"):
+        batch.parse_batch(b'{"items": [{"message": "a"}, {"message": "b"}, {"message": "c"}]}', max_items=2)
+
+
+def test_results_stream_as_they_finish_in_conversation_order():
+    items = [{"conversation_id": "slow", "message": "1"}, {"conversation_id": "fast", "message": "2"},
+             {"conversation_id": "slow", "message": "3"}, {"conversation_id": "fast", "message": "4"}]
+    running = {"now": 0, "peak": 0}
+
+    async def run_item(index, item):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.05 if item["conversation_id"] == "slow" else 0.01)
+        running["now"] -= 1
+        return index
+
+    async def collect():
+        return [index async for index in batch.stream_results(items, run_item, lambda item: item["conversation_id"],
+                                                              concurrency=4)]
+
+    assert asyncio.run(collect()) == [1, 3, 0, 2]
+    assert running["peak"] == 2
+
+
+def test_closing_the_stream_cancels_running_items():
+    cancelled = []
+
+    async def run_item(index, item):
+        try:
+            await asyncio.sleep(0 if index == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        return index
+
+    async def first_only():
+        results = batch.stream_results([{"k": i} for i in range(3)], run_item, lambda item: item["k"])
+        first = await results.__anext__()
+        await results.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(first_only()) == 0
+    assert sorted(cancelled) == [1, 2]
+
+
+def test_batch_endpoint_answers_every_item(fast_bot):
+    items = [{"conversation_id": "c1", "message": "where is report 1", "id": "m1"},
+             {"conversation_id": "c2", "message": "where is report 2"},
+             {"conversation_id": "c1", "message": "where is report 3"},
+             {"conversation_id": "c3", "message": "   "}]
+    with TestClient(api.app) as client:
+        response, lines = post_batch(client, items)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert lines[-1] == {"done": True, "items": 4, "failed": 1}
+    results = {line["index"]: line for line in lines[:-1]}
+    assert results[0]["id"] == "m1" and results[0]["response"] == "Echo: where is report 1."
+    assert results[3] == {"index": 3, "id": None, "conversation_id": "c3", "success": False,
+                          "error": "Message cannot be empty", "status": 400}
+    # Turns of one conversation ran in the order given
+    assert [turn["message"] for turn in fast_bot.conversations["c1"] if turn["role"] == "USER"] == \
+        ["where is report 1", "where is report 3"]
+
+
+def test_batch_is_one_request_for_the_client_rate_limit(fast_bot):
+    items = [{"conversation_id": f"c{i}", "message": f"where is report {i}"} for i in range(20)]
+    with TestClient(api.app) as client:
+        _, lines = post_batch(client, items)
+
+    assert lines[-1] == {"done": True, "items": 20, "failed": 0}
+
+
+def test_per_conversation_limit_applies_to_each_item(fast_bot):
+    items = [{"conversation_id": "noisy", "message": f"where is report {i}"} for i in range(7)]
+    with TestClient(api.app) as client:
+        _, lines = post_batch(client, items)
+
+    statuses = [line["status"] for line in sorted(lines[:-1], key=lambda line: line["index"])]
+    assert statuses == [200] * 5 + [429] * 2
+    assert lines[-2]["retry_after"] >= 1
+
+
+def test_unknown_tenant_and_bad_body(fast_bot):
+    with TestClient(api.app) as client:
+        assert client.post("/chat/batch", content=b"{").status_code == 400
+        response = client.post("/chat/batch", json={"items": [{"message": "hi"}]}, headers={"X-Tenant-ID": "nope"})
+        assert response.status_code == 404
@@ -0,0 +1,119 @@
+# test_cancellation.py
+# Work for a client that went away is stopped, not finished and thrown away
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import config
+from cancellation import Cancelled, CancelToken, run_until_disconnect
+
+
+def cancel_after(token, seconds):
+    timer = threading.Timer(seconds, token.cancel)
+    timer.start()
+    return timer
+
+
+def test_cancel_cuts_backoff_and_skips_retries(bot, upstream):
+    upstream.status = 500
+    token = CancelToken()
+    cancel_after(token, 1.0)
+
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        bot.chat("where is my report", "c1", show_typing=False, cancel=token)
+
+    # Without cancellation: 3 attempts plus backoff, well over 3 s
+    assert time.monotonic() - start < 2.0
+    assert len(upstream.requests) <= 2
+    assert bot.cancellations['before_upstream'] == 1
+    assert "c1" not in bot.conversations or not bot.conversations["c1"]
+
+
+def test_cancel_aborts_the_upstream_generation(bot, upstream):
+    upstream.token_delay = 0.2
+    upstream.reply = "one two three four five six seven eight nine ten"
+    token = CancelToken()
+    cancel_after(token, 1.2)
+
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        bot.chat("where is my report", "c1", show_typing=False, cancel=token)
+
+    assert time.monotonic() - start < 1.6
+    assert bot.cancellations['during_upstream'] == 1
+    deadline = time.monotonic() + 3
+    while not upstream.aborted and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert upstream.aborted == 1
+
+
+def test_reply_that_finishes_after_disconnect_is_discarded_by_default(bot):
+    token = CancelToken()
+
+    def generate(user_message, history, cancel=None, **kwargs):
+        cancel.cancel()
+        return "Too late."
+    bot._generate_response = generate
+
+    with pytest.raises(Cancelled):
+        bot.chat("where is my report", "c1", show_typing=False, cancel=token)
+    assert not bot.conversations["c1"]
+    assert bot.cancellations['reply_discarded'] == 1
+
+
+def test_reply_after_disconnect_can_be_kept(bot, monkeypatch):
+    monkeypatch.setattr(config, "RECORD_ABANDONED_TURNS", True)
+
+    def generate(user_message, history, cancel=None, **kwargs):
+        cancel.cancel()
+        return "Too late."
+    bot._generate_response = generate
+
+    assert bot.chat("where is my report", "c1", show_typing=False, cancel=CancelToken()) == "Too late."
+    assert bot.conversations["c1"][-1]["message"] == "Too late."
+    assert bot.cancellations['reply_recorded'] == 1
+
+
+def test_stream_ends_without_done_when_cancelled(bot, upstream):
+    upstream.token_delay = 0.1
+    upstream.reply = "one two three four five six"
+    token = CancelToken()
+    events = []
+    for kind, piece in bot.chat_stream("where is my report", "c1", cancel=token):
+        events.append(kind)
+        token.cancel()
+
+    assert events == ["token"]
+    assert not bot.conversations["c1"]
+
+
+def test_run_until_disconnect_fires_the_token(monkeypatch):
+    monkeypatch.setattr(config, "DISCONNECT_POLL_INTERVAL", 0.02)
+
+    class Request:
+        def __init__(self):
+            self.polls = 0
+
+        async def is_disconnected(self):
+            self.polls += 1
+            return self.polls > 3
+
+    def work(cancel):
+        cancel.sleep(5)
+
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        asyncio.run(run_until_disconnect(Request(), work))
+    assert time.monotonic() - start < 1
+
+
+def test_run_until_disconnect_returns_the_result():
+    class Connected:
+        async def is_disconnected(self):
+            return False
+
+    assert asyncio.run(run_until_disconnect(Connected(), lambda cancel: 42)) == 42
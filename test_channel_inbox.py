@@ -0,0 +1,210 @@
+# test_channel_inbox.py
+# Channel webhooks: fast acks, durable ordered queue, retried sends and dead letters,
+# against a local stand-in for the messaging gateway
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import bot as bot_module
+import channel_inbox
+import config
+from channel_inbox import ChannelInbox, InboxStore, WebhookSender
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class Gateway:
+    """Stand-in for the gateway's send endpoint; fails the first `failures` calls"""
+
+    def __init__(self):
+        self.sent = []
+        self.failures = 0
+        self.calls = 0
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                gateway.calls += 1
+                failing = gateway.calls <= gateway.failures
+                if not failing:
+                    gateway.sent.append(dict(body, idempotency_key=self.headers.get("Idempotency-Key")))
+                self.send_response(503 if failing else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/send"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def gateway():
+    stand_in = Gateway()
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def inbox(bot, gateway, tmp_path, monkeypatch):
+    """The app's inbox, writing to a temporary database and replying to the stand-in gateway"""
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    instance = ChannelInbox(InboxStore(str(tmp_path / "inbox.db")), WebhookSender(gateway.url), lambda: bot,
+                            workers=3, max_attempts=3, retry_backoff=0.01, poll_interval=0.02)
+    monkeypatch.setattr(channel_inbox, "_default_inbox", instance)
+    yield instance
+    instance.close()
+
+
+def deliver(client, text, message_id, sender="+254700000001", **kwargs):
+    return client.post("/webhooks/whatsapp", json={"id": message_id, "from": sender, "text": text}, **kwargs)
+
+
+def test_webhook_acks_before_the_turn_finishes(inbox, gateway, upstream):
+    upstream.delay = 0.5
+    with TestClient(api.app) as client:
+        start = time.perf_counter()
+        response = deliver(client, "where is my report", "wamid.1")
+        acked = time.perf_counter() - start
+        wait_for(lambda: gateway.sent)
+
+    assert response.status_code == 200 and response.json()["queued"] is True
+    assert acked < 0.4
+    assert gateway.sent == [{"channel": "whatsapp", "to": "+254700000001", "conversation_id": "whatsapp-+254700000001",
+                             "in_reply_to": "wamid.1", "text": "Echo: where is my report.",
+                             "idempotency_key": "whatsapp:wamid.1"}]
+
+
+def test_redelivered_message_is_answered_once(inbox, gateway, upstream):
+    with TestClient(api.app) as client:
+        first = deliver(client, "where is my report", "wamid.1").json()
+        second = deliver(client, "where is my report", "wamid.1").json()
+        wait_for(lambda: inbox.stats['sent'] == 1)
+
+    assert second == {"success": True, "queued": True, "id": first["id"], "duplicate": True}
+    assert len(upstream.requests) == 1 and len(gateway.sent) == 1
+    assert inbox.stats['duplicates'] == 1
+
+
+def test_conversation_order_is_kept_while_others_run_in_parallel(inbox, gateway, upstream, bot):
+    upstream.delay = 0.05
+    with TestClient(api.app) as client:
+        for i in range(4):
+            deliver(client, f"where is report {i}", f"a{i}", sender="+1")
+            deliver(client, f"where is report {i}", f"b{i}", sender="+2")
+        wait_for(lambda: len(gateway.sent) == 8)
+
+    for sender in ("+1", "+2"):
+        assert [m["in_reply_to"][1:] for m in gateway.sent if m["to"] == sender] == ["0", "1", "2", "3"]
+        history = bot.conversations[f"whatsapp-{sender}"]
+        assert [turn["message"] for turn in history if turn["role"] == "USER"][-4:] == \
+            [f"where is report {i}" for i in range(4)]
+
+
+def test_failed_send_is_retried_without_running_the_turn_again(inbox, gateway, upstream):
+    gateway.failures = 2
+    with TestClient(api.app) as client:
+        deliver(client, "where is my report", "wamid.1")
+        wait_for(lambda: gateway.sent)
+
+    assert gateway.calls == 3
+    assert len(upstream.requests) == 1
+    assert inbox.stats['retried'] == 2 and inbox.stats['sent'] == 1
+
+
+def test_failed_turn_is_retried_instead_of_sent(inbox, gateway, upstream):
+    inbox.max_attempts = 20
+    upstream.status = 503
+    with TestClient(api.app) as client:
+        deliver(client, "where is my report", "wamid.1")
+        wait_for(lambda: inbox.stats['retried'] >= 1)
+        assert gateway.sent == []
+        upstream.status = 200
+        wait_for(lambda: gateway.sent)
+
+    assert [m["text"] for m in gateway.sent] == ["Echo: where is my report."]
+    assert inbox.stats['processed'] == 1 and inbox.stats['sent'] == 1
+
+
+def test_turn_failing_every_attempt_is_dead_lettered(inbox, gateway, upstream):
+    upstream.status = 503
+    with TestClient(api.app) as client:
+        deliver(client, "where is my report", "wamid.1")
+        wait_for(lambda: inbox.stats['dead'] == 1)
+
+    assert gateway.calls == 0
+    assert "trouble connecting" in inbox.store.dead()[0]["error"]
+
+
+def test_message_is_dead_lettered_then_requeued(inbox, gateway, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    admin = {"Authorization": "Bearer secret"}
+    gateway.failures = 3
+    with TestClient(api.app) as client:
+        deliver(client, "where is my report", "wamid.1")
+        wait_for(lambda: inbox.stats['dead'] == 1)
+        dead = client.get("/admin/inbox/dead", headers=admin).json()["messages"]
+        assert [m["external_id"] for m in dead] == ["wamid.1"] and dead[0]["attempts"] == 3
+        assert "503" in dead[0]["error"]
+
+        assert client.post(f"/admin/inbox/dead/{dead[0]['id']}/retry", headers=admin).status_code == 200
+        wait_for(lambda: gateway.sent)
+        assert client.post(f"/admin/inbox/dead/{dead[0]['id']}/retry", headers=admin).status_code == 404
+
+    assert inbox.report()['dead_lettered'] == 0 and inbox.report()['delivered_last_minute'] == 1
+
+
+def test_queued_messages_survive_a_restart(bot, gateway, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    path = str(tmp_path / "inbox.db")
+    store = InboxStore(path)
+    store.enqueue("sms", "m1", "default", "c1", "c1", "+1", "where is report 1")
+    store.enqueue("sms", "m2", "default", "c1", "c1", "+1", "where is report 2")
+    # A worker that died holding m1: its lease has already run out
+    assert store.claim(lease=0)["external_id"] == "m1"
+
+    restarted = ChannelInbox(InboxStore(path), WebhookSender(gateway.url), lambda: bot, workers=2,
+                             poll_interval=0.02)
+    restarted.start()
+    try:
+        wait_for(lambda: len(gateway.sent) == 2)
+    finally:
+        restarted.close()
+    assert [m["in_reply_to"] for m in gateway.sent] == ["m1", "m2"]
+
+
+def test_webhook_checks_token_and_body(inbox, monkeypatch):
+    monkeypatch.setattr(config, "CHANNEL_WEBHOOK_TOKEN", "hook-secret")
+    with TestClient(api.app) as client:
+        assert deliver(client, "hi", "m1").status_code == 401
+        headers = {"X-Webhook-Token": "hook-secret"}
+        assert client.post("/webhooks/whatsapp", json={"id": "m1"}, headers=headers).status_code == 400
+        assert client.post("/webhooks/bad.channel", json={}, headers=headers).status_code == 400
+        assert deliver(client, "  ", "m2", headers=headers).json() == {"success": True, "queued": False}
+        assert deliver(client, "hi", "m3", headers=headers).status_code == 200
+
+
+def test_webhooks_are_off_without_a_send_url(monkeypatch):
+    monkeypatch.setattr(config, "CHANNEL_SEND_URL", "")
+    monkeypatch.setattr(channel_inbox, "_default_inbox", None)
+    with TestClient(api.app) as client:
+        assert deliver(client, "hi", "m1").status_code == 404
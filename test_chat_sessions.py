@@ -0,0 +1,157 @@
+# test_chat_sessions.py
+# WebSocket chat channel and the bot's streaming path
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import admission
+import api
+import chat_sessions
+import config
+
+
+@pytest.fixture
+def client(bot, monkeypatch):
+    monkeypatch.setattr(chat_sessions, "hub", chat_sessions.ChatSessionHub(replay_size=50))
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    with TestClient(api.app) as test_client:
+        yield test_client
+
+
+def receive_until(ws, event_type, **fields):
+    events = []
+    while True:
+        event = ws.receive_json()
+        events.append(event)
+        if event["type"] == event_type and all(event.get(k) == v for k, v in fields.items()):
+            return events
+
+
+def test_chat_stream_yields_tokens_then_cleaned_text(bot):
+    events = list(bot.chat_stream("reset password", "conv-1"))
+
+    assert [kind for kind, _ in events[:-1]] == ["token"] * 3
+    assert events[-1] == ("done", "Echo: reset password.")
+    assert bot.conversations["conv-1"][-1] == {"role": "CHATBOT", "message": "Echo: reset password."}
+
+
+def test_stream_response_reports_upstream_errors(bot, upstream):
+    upstream.status = 500
+    bot.max_retries = 1
+
+    assert list(bot._stream_response("hi", [])) == ["I'm having trouble connecting right now. Please try again."]
+
+
+def test_message_streams_reply_over_socket(client):
+    with client.websocket_connect("/ws") as ws:
+        hello = ws.receive_json()
+        assert hello["type"] == "hello" and hello["last_seq"] == 0
+        assert hello["conversation_id"].startswith("web_") and hello["token"]
+
+        ws.send_json({"type": "message", "text": "reset password"})
+        events = receive_until(ws, "typing", state=False)
+
+    kinds = [event["type"] for event in events]
+    assert kinds[0] == "typing" and "token" in kinds
+    done = next(event for event in events if event["type"] == "done")
+    assert done["text"] == "Echo: reset password."
+    assert [event["seq"] for event in events] == list(range(1, len(events) + 1))
+
+
+def test_resume_replays_missed_events_only_to_token_holder(client):
+    with client.websocket_connect("/ws") as ws:
+        hello = ws.receive_json()
+        ws.send_json({"type": "message", "text": "first"})
+        receive_until(ws, "typing", state=False)
+
+    conversation_id, token = hello["conversation_id"], hello["token"]
+
+    with pytest.raises(WebSocketDisconnect) as refused:
+        with client.websocket_connect(f"/ws?conversation_id={conversation_id}&token=wrong") as ws:
+            ws.receive_json()
+    assert refused.value.code == chat_sessions.CLOSE_FORBIDDEN
+
+    with client.websocket_connect(f"/ws?conversation_id={conversation_id}&token={token}") as ws:
+        hello = ws.receive_json()
+        assert hello["last_seq"] > 2
+        ws.send_json({"type": "resume", "last_seq": 2})
+        replayed = [ws.receive_json() for _ in range(hello["last_seq"] - 2)]
+
+    assert [event["seq"] for event in replayed] == list(range(3, hello["last_seq"] + 1))
+
+
+def test_resume_flags_gap_when_buffer_overflowed(client):
+    with client.websocket_connect("/ws") as ws:
+        hello = ws.receive_json()
+        session = chat_sessions.hub.sessions[hello["conversation_id"]]
+        for i in range(60):
+            session.publish({"type": "agent", "text": str(i)})
+        for _ in range(60):
+            ws.receive_json()
+
+        ws.send_json({"type": "resume", "last_seq": 0})
+        first = ws.receive_json()
+
+    assert first == {"type": "status", "state": "gap", "seq": 10}
+
+
+def test_invalid_events_get_error_status(client):
+    with client.websocket_connect("/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "resume", "last_seq": "abc"})
+        assert ws.receive_json()["state"] == "error"
+        ws.send_bytes(b"\x00\x01")
+        assert ws.receive_json()["state"] == "error"
+        ws.send_text("not json")
+        assert ws.receive_json()["state"] == "error"
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+
+def test_server_sends_heartbeat_when_idle(client, monkeypatch):
+    monkeypatch.setattr(config, "WS_HEARTBEAT_INTERVAL", 0.1)
+    with client.websocket_connect("/ws") as ws:
+        ws.receive_json()
+        assert ws.receive_json() == {"type": "ping"}
+
+
+def test_foreign_origin_is_refused(client):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws", headers={"origin": "https://evil.example"}) as ws:
+            ws.receive_json()
+
+
+def test_agent_reply_is_pushed_to_customer(client, bot):
+    with client.websocket_connect("/ws") as ws:
+        conversation_id = ws.receive_json()["conversation_id"]
+        response = client.post(f"/agent/reply/{conversation_id}", json={"message": "Hi, Jane here"},
+                               headers={"Authorization": "Bearer secret"})
+        event = ws.receive_json()
+
+    assert response.json() == {"success": True, "delivered": True}
+    assert event["type"] == "agent" and event["text"] == "Hi, Jane here"
+    assert bot.conversations[conversation_id][-1]["message"] == "Hi, Jane here"
+
+
+def test_agent_reply_requires_token_and_known_session(client, bot, monkeypatch):
+    assert client.post("/agent/reply/zz", json={"message": "x"}).status_code == 401
+    response = client.post("/agent/reply/zz", json={"message": "x"}, headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 404
+    assert "zz" not in bot.conversations
+
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "")
+    assert client.post("/agent/reply/zz", json={"message": "x"}).status_code == 503
+
+
+def test_rate_limited_message_gets_busy_status(client, monkeypatch):
+    monkeypatch.setattr(admission.chat_admission, "per_conversation", admission.RateLimiter(rate=1 / 60, burst=1))
+    with client.websocket_connect("/ws") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "message", "text": "first"})
+        receive_until(ws, "typing", state=False)
+        ws.send_json({"type": "message", "text": "second"})
+        busy = ws.receive_json()
+
+    assert busy["type"] == "status" and busy["state"] == "busy"
+    assert busy["retry_after"] >= 1 and "seq" not in busy
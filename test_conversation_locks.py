@@ -0,0 +1,83 @@
+# test_conversation_locks.py
+# Per-conversation ordering: no lost turns, FIFO order, no global serialization
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conversation_locks import ConversationLocks
+
+
+def slow_upstream(bot, delay=0.0):
+    """Replace the upstream call; returns the (user message, last reply it saw) of every call"""
+    seen = []
+
+    def generate(user_message, history, cancel=None, **kwargs):
+        seen.append((user_message, history[-1]["message"] if history else None))
+        time.sleep(delay)
+        return f"reply to {user_message}"
+    bot._generate_response = generate
+    return seen
+
+
+def test_no_lost_turns_under_concurrency(bot):
+    seen = slow_upstream(bot, delay=0.001)
+    conversations = [f"conv-{i}" for i in range(20)]
+    messages = [(cid, f"{cid}-m{n}") for n in range(25) for cid in conversations]
+
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        list(pool.map(lambda item: bot.chat(item[1], item[0], show_typing=False), messages))
+
+    for cid in conversations:
+        previous = [last for message, last in seen if message.startswith(cid + "-")]
+        # Turns form one chain: every reply but the newest was seen by exactly one later turn
+        assert len(previous) == 25
+        assert previous.count(None) == 1
+        replies_seen = [last for last in previous if last is not None]
+        assert len(set(replies_seen)) == 24
+        assert len(bot.conversations[cid]) == 10
+    assert bot.conversation_locks.busy() == 0
+
+
+def test_turns_of_one_conversation_run_in_arrival_order():
+    locks = ConversationLocks()
+    order = []
+    started = []
+
+    def turn(n):
+        with locks.hold("conv"):
+            order.append(n)
+            time.sleep(0.01)
+
+    threads = []
+    for n in range(10):
+        thread = threading.Thread(target=turn, args=(n,))
+        thread.start()
+        threads.append(thread)
+        started.append(n)
+        time.sleep(0.002)
+    for thread in threads:
+        thread.join()
+
+    assert order == started
+
+
+def test_unrelated_conversations_run_in_parallel(bot):
+    slow_upstream(bot, delay=0.2)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(lambda i: bot.chat("where is my report", f"conv-{i}", show_typing=False), range(10)))
+    assert time.monotonic() - start < 1.0
+
+
+def test_streamed_and_plain_turns_share_the_ordering(bot, upstream):
+    upstream.delay = 0.1
+    events = []
+    streamer = threading.Thread(target=lambda: events.extend(bot.chat_stream("first", "conv")))
+    streamer.start()
+    time.sleep(0.05)
+    bot.chat("second", "conv", show_typing=False)
+    streamer.join()
+
+    messages = [turn["message"] for turn in bot.conversations["conv"] if turn["role"] == "USER"]
+    assert messages == ["first", "second"]
@@ -0,0 +1,60 @@
+# test_headless.py
+# The server path never starts a thread or writes to the terminal per request;
+# the typing animation and typewriter output belong to the CLI
+
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import cli
+
+
+@pytest.fixture
+def thread_starts(monkeypatch):
+    """Names of the threads the app starts while the test runs"""
+    started = []
+    original = threading.Thread.start
+
+    def start(thread):
+        # The upstream stand-in serves each new connection on a thread of its own
+        if "process_request_thread" not in thread.name:
+            started.append(thread.name)
+        original(thread)
+    monkeypatch.setattr(threading.Thread, "start", start)
+    return started
+
+
+def test_api_requests_start_no_threads_and_print_nothing(bot, thread_starts, capfd):
+    with TestClient(api.app) as client:
+        # Warm up: the threadpool worker, the upstream connection, the fallback matchers
+        assert client.post("/chat", json={"message": "where is my report", "conversation_id": "warm"}).status_code == 200
+        capfd.readouterr()
+        before = len(thread_starts)
+
+        for i in range(8):
+            response = client.post("/chat", json={"message": f"where is report {i}", "conversation_id": f"c{i % 4}"})
+            assert response.status_code == 200
+
+        assert thread_starts[before:] == []
+    assert capfd.readouterr().out == ""
+
+
+def test_bot_chat_is_headless_by_default(bot, thread_starts, capfd):
+    assert bot.typing_indicator is None
+    assert bot.chat("where is my report", "c1") == "Echo: where is my report."
+    assert thread_starts == []
+    assert capfd.readouterr().out == ""
+
+
+def test_cli_shows_typing_and_streams_the_reply(bot, capsys):
+    bot.typing_indicator = cli.TypingIndicator(min_visible=0)
+
+    response = cli.chat_with_effects(bot, "where is my report", "c1")
+    out = capsys.readouterr().out
+
+    assert response == "Echo: where is my report."
+    assert "Bot is typing" in out
+    assert out.endswith("Bot: Echo: where is my report.\n")
+    assert not bot.typing_indicator.thread.is_alive()
@@ -0,0 +1,150 @@
+# test_idempotency.py
+# Duplicate POST /chat requests share one bot turn
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import config
+from idempotency import Conflict, IdempotencyStore
+from serialization import loads
+
+
+def post(client, message, key=None, conversation_id="c1"):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post("/chat", json={"message": message, "conversation_id": conversation_id}, headers=headers)
+
+
+def test_retry_with_the_same_key_replays_the_reply(bot, upstream):
+    with TestClient(api.app) as client:
+        first = post(client, "where is my report", key="k1")
+        second = post(client, "where is my report", key="k1")
+
+    assert first.json() == second.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(upstream.requests) == 1
+    assert len(bot.conversations["c1"]) == 2
+
+
+def test_duplicates_in_flight_attach_to_the_original(bot, upstream):
+    upstream.delay = 0.3
+    answers = []
+    with TestClient(api.app) as client:
+        threads = [threading.Thread(target=lambda: answers.append(post(client, "where is my report", key="k1")))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert [a.status_code for a in answers] == [200, 200, 200]
+    assert len({a.json()["response"] for a in answers}) == 1
+    assert len(upstream.requests) == 1
+    assert sum(a.headers.get("Idempotent-Replayed") == "true" for a in answers) == 2
+
+
+def test_key_reused_for_another_message_is_rejected(bot, upstream):
+    with TestClient(api.app) as client:
+        post(client, "where is my report", key="k1")
+        conflict = post(client, "reset password", key="k1")
+        other_conversation = post(client, "reset password", key="k1", conversation_id="c2")
+
+    assert conflict.status_code == 422
+    assert conflict.json()["success"] is False
+    assert other_conversation.status_code == 200
+
+
+def test_same_message_without_a_key_is_deduplicated_only_within_the_window(bot, upstream, monkeypatch):
+    monkeypatch.setattr(config, "IDEMPOTENCY_WINDOW", 0.5)
+    with TestClient(api.app) as client:
+        post(client, "where is my report")
+        post(client, "where is my report")
+        assert len(upstream.requests) == 1
+        time.sleep(0.6)
+        post(client, "where is my report")
+
+    assert len(upstream.requests) == 2
+
+
+def test_window_of_zero_turns_derived_keys_off(bot, upstream, monkeypatch):
+    monkeypatch.setattr(config, "IDEMPOTENCY_WINDOW", 0)
+    with TestClient(api.app) as client:
+        post(client, "where is my report")
+        post(client, "where is my report")
+
+    assert len(upstream.requests) == 2
+
+
+def test_failed_turn_is_not_replayed(bot, upstream, monkeypatch):
+    monkeypatch.setattr("bot.pause", lambda seconds, cancel=None: None)
+    upstream.status = 503
+    with TestClient(api.app) as client:
+        failed = post(client, "where is my report")
+        upstream.status = 200
+        retried = post(client, "where is my report")
+
+    assert failed.json()["response"] == "I'm having trouble connecting right now. Please try again."
+    assert "Idempotent-Replayed" not in retried.headers
+    assert retried.json()["response"] == "Echo: where is my report."
+    # The failed turn left no trace in the history the retry was answered from
+    assert upstream.requests[-1]["chat_history"] == []
+    assert len(bot.conversations["c1"]) == 2
+
+
+def test_failed_batch_item_is_not_replayed(bot, upstream, monkeypatch):
+    monkeypatch.setattr("bot.pause", lambda seconds, cancel=None: None)
+    item = {"conversation_id": "c1", "message": "where is my report", "idempotency_key": "k1"}
+    upstream.status = 503
+    with TestClient(api.app) as client:
+        failed = client.post("/chat/batch", json={"items": [item]}).text.splitlines()[0]
+        upstream.status = 200
+        retried = loads(client.post("/chat/batch", json={"items": [item]}).text.splitlines()[0])
+
+    assert "trouble connecting" in failed
+    assert retried["replayed"] is False and retried["response"] == "Echo: where is my report."
+
+
+def test_failed_original_is_run_again_by_the_duplicate():
+    async def scenario():
+        store = IdempotencyStore()
+        started = asyncio.Event()
+
+        async def failing():
+            started.set()
+            await asyncio.sleep(0.05)
+            raise RuntimeError("upstream went away")
+
+        async def working():
+            return "reply"
+
+        original = asyncio.ensure_future(store.run("k", "m", 60, failing))
+        await started.wait()
+        duplicate = await store.run("k", "m", 60, working)
+        with pytest.raises(RuntimeError):
+            await original
+        return duplicate, store.stats
+
+    (result, replayed), stats = asyncio.run(scenario())
+    assert (result, replayed) == ("reply", False)
+    assert stats['executed'] == 2 and stats['attached'] == 1
+
+
+def test_store_is_bounded_and_conflicts_raise():
+    async def scenario():
+        store = IdempotencyStore(max_entries=2)
+
+        async def reply():
+            return "ok"
+        for key in ("a", "b", "c"):
+            await store.run(key, "m", 60, reply)
+        with pytest.raises(Conflict):
+            await store.run("c", "other", 60, reply)
+        return store
+
+    store = asyncio.run(scenario())
+    assert store.report()['stored'] == 2
@@ -0,0 +1,85 @@
+# test_intent_router.py
+# Local intent router: template answers without an upstream call, LLM for the rest
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import config
+from intent_router import IntentModel, IntentRouter, SEED_EXAMPLES, build_templates
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter(IntentModel.train(SEED_EXAMPLES))
+
+
+@pytest.mark.parametrize("message,intent", [
+    ("Hello!", "greeting"),
+    ("thanks so much", "thanks"),
+    ("What are your support hours?", "support_hours"),
+    ("can I have your email", "support_email"),
+    ("what do you offer", "products"),
+])
+def test_common_messages_are_answered_from_templates(router, message, intent):
+    assert router.answer(message) == router.templates[intent]
+
+
+@pytest.mark.parametrize("message", [
+    "how do I reset my password",
+    "hello, my dashboard has been empty since yesterday and the export button does nothing",
+    "does the assistant support swahili",
+])
+def test_other_messages_fall_through(router, message):
+    assert router.answer(message) is None
+
+
+def test_templates_come_from_product_info():
+    templates = build_templates()
+    assert "support@mshauri.tech" in templates["support_email"]
+    assert "Monday-Friday, 9 AM - 6 PM EAT" in templates["support_hours"]
+    assert "Mshauri Analytics" in templates["products"]
+
+
+def test_model_round_trips_through_a_file(router, tmp_path):
+    path = tmp_path / "model.npz"
+    router.model.save(path)
+    loaded = IntentModel.load(path)
+    assert loaded.predict(["hi", "what is your email"]) == router.model.predict(["hi", "what is your email"])
+
+
+def test_retraining_adds_intents_from_labelled_logs():
+    examples = SEED_EXAMPLES + [(text, "shipping") for text in (
+        "where is my parcel", "track my delivery", "has my parcel shipped", "delivery status please")]
+    model = IntentModel.train(examples)
+    assert model.predict(["where is my delivery"])[0][0] == "shipping"
+
+
+def test_routed_messages_skip_upstream_and_are_reported(bot, upstream):
+    with TestClient(api.app) as client:
+        greeting = client.post("/chat", json={"message": "hi", "conversation_id": "c1"}).json()
+        question = client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"}).json()
+        report = client.get("/api/status").json()["intent_router"]
+
+    assert greeting["response"].startswith("Hello! Welcome to")
+    assert question["response"] == "Echo: where is my report."
+    assert [body["message"] for body in upstream.requests] == ["where is my report"]
+    # The locally answered turn is still context for the LLM
+    assert upstream.requests[0]["chat_history"][0] == {"role": "USER", "message": "hi"}
+    assert report["messages"] == 2 and report["answered_locally"] == 1 and report["offload_share"] == 0.5
+    assert report["avg_upstream_ms"] > report["avg_local_ms"]
+
+
+def test_router_can_be_disabled(bot, upstream, monkeypatch):
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", False)
+    assert bot.chat("hi", "c1", show_typing=False) == "Echo: hi."
+
+
+def test_status_does_not_train_the_router(bot, monkeypatch):
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", True)
+    bot._intent_router = None
+    with TestClient(api.app) as client:
+        status = client.get("/api/status").json()
+
+    assert "intent_router" not in status
+    assert bot._intent_router is None
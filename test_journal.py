@@ -0,0 +1,121 @@
+# test_journal.py
+# Conversation journal: group commit, torn tails, compaction and warm restarts
+
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import bot as bot_module
+import config
+from journal import Journal, JournalLocked, encode, read_records
+
+
+def test_conversations_and_flags_survive_a_restart(bot, tmp_path):
+    bot.open_journal(str(tmp_path))
+    bot.chat("where is my report", "c1", show_typing=False)
+    bot.chat("and the one from May", "c1", show_typing=False)
+    bot.chat("I want to buy the analytics plan", "c2", show_typing=False)
+    bot.chat("where is my invoice", "c3", show_typing=False)
+    bot.clear_conversation("c3")
+    bot.add_agent_message("c2", "Hi, Jane from sales here")
+    bot.close_journal()
+
+    restarted = bot_module.CustomerSupportBot()
+    assert restarted.open_journal(str(tmp_path)) > 0
+    assert restarted.conversations == bot.conversations
+    assert "c3" not in restarted.conversations
+    assert restarted.fallback_handler.flagged_conversations["c2"]["reason"] == "Strong keyword: buy"
+    restarted.close_journal()
+
+
+def test_appends_share_fsyncs(tmp_path):
+    journal = Journal(str(tmp_path), sync_interval=0.05)
+    journal.start()
+    for i in range(500):
+        seq = journal.append({"t": "conv", "c": f"c{i}", "h": []})
+    assert journal.wait_durable(seq, timeout=5)
+    journal.close()
+
+    assert journal.stats['records'] == 500
+    assert journal.stats['commits'] < 10
+
+
+def test_torn_tail_is_dropped_and_truncated(tmp_path):
+    path = tmp_path / "journal-0.log"
+    good = encode({"t": "conv", "c": "c1", "h": []}) + encode({"t": "clear", "c": "c2"})
+    path.write_bytes(good + encode({"t": "conv", "c": "c3", "h": []})[:9])
+
+    journal = Journal(str(tmp_path))
+    records = journal.replay()
+    journal.close()
+
+    assert [record["c"] for record in records] == ["c1", "c2"]
+    assert path.stat().st_size == len(good)
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    path = tmp_path / "journal-0.log"
+    damaged = bytearray(encode({"t": "clear", "c": "c2"}))
+    damaged[-2] ^= 0xFF
+    path.write_bytes(encode({"t": "clear", "c": "c1"}) + bytes(damaged))
+
+    records, good_length = read_records(str(path))
+    assert [record["c"] for record in records] == ["c1"]
+
+
+def test_compaction_snapshots_state_and_removes_old_files(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOURNAL_COMPACT_BYTES", 2000)
+    monkeypatch.setattr(config, "JOURNAL_SYNC_INTERVAL", 0.01)
+    monkeypatch.setattr(bot, "_generate_response", lambda message, history, cancel=None, **kwargs: f"Reply to {message}.")
+    bot.open_journal(str(tmp_path))
+    for i in range(30):
+        bot.chat(f"where is report {i}", f"c{i % 5}", show_typing=False)
+        time.sleep(0.005)
+    compactions = bot.journal.stats['compactions']
+    bot.close_journal()
+
+    files = sorted(os.listdir(tmp_path))
+    assert compactions > 0
+    assert len([name for name in files if name.startswith("snapshot-")]) == 1
+    assert len([name for name in files if name.startswith("journal-")]) == 1
+
+    restarted = bot_module.CustomerSupportBot()
+    restarted.open_journal(str(tmp_path))
+    assert restarted.conversations == bot.conversations
+    restarted.close_journal()
+
+
+def test_second_writer_is_refused(tmp_path):
+    journal = Journal(str(tmp_path))
+    with pytest.raises(JournalLocked):
+        Journal(str(tmp_path))
+    journal.close()
+
+
+def test_many_conversations_replay_quickly(tmp_path):
+    history = [{"role": "USER", "message": "How do I export my analytics report?"}] * 10
+    journal = Journal(str(tmp_path), sync_interval=0.01)
+    journal.start()
+    for i in range(10000):
+        journal.append({"t": "conv", "c": f"c{i}", "h": history})
+    journal.close()
+
+    start = time.perf_counter()
+    journal = Journal(str(tmp_path))
+    assert len(journal.replay()) == 10000
+    journal.close()
+    assert time.perf_counter() - start < 2.0
+
+
+def test_app_restores_conversations_on_startup(bot, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOURNAL_DIR", str(tmp_path))
+    with TestClient(api.app) as client:
+        client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"})
+
+    # New process: a fresh bot that only knows what the journal kept
+    monkeypatch.setattr(bot_module, "_shared_bot", bot_module.CustomerSupportBot())
+    with TestClient(api.app):
+        assert bot_module._shared_bot.conversations["c1"][0]["message"] == "where is my report"
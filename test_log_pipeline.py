@@ -0,0 +1,115 @@
+# test_log_pipeline.py
+# Queue-based JSON logging: structured fields, sampling, escalations, rotation
+
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+import config
+import log_pipeline
+from human_fallback import HumanFallbackHandler
+
+
+class SlowListHandler(logging.Handler):
+    """Stands in for a slow disk: every write takes a while"""
+
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.lines = []
+        self.threads = set()
+        self.setFormatter(log_pipeline.JsonFormatter())
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.threads.add(threading.current_thread().name)
+        self.lines.append(json.loads(self.format(record)))
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    def start(delay=0.0, rates=""):
+        monkeypatch.setattr(config, "LOG_SAMPLE_RATES", rates)
+        handler = SlowListHandler(delay)
+        log_pipeline.setup_logging([handler])
+        return handler
+
+    log_pipeline.shutdown_logging()
+    yield start
+    log_pipeline.shutdown_logging()
+
+
+def test_records_are_json_with_extra_fields(pipeline):
+    handler = pipeline()
+    logging.getLogger("api").info("chat request", extra={"event": "chat_request", "conversation_id": "c1",
+                                                          "timings_ms": {"total": 12.5}})
+    log_pipeline.shutdown_logging()
+
+    [line] = handler.lines
+    assert line["msg"] == "chat request" and line["logger"] == "api" and line["level"] == "INFO"
+    assert line["conversation_id"] == "c1" and line["timings_ms"] == {"total": 12.5}
+
+
+def test_slow_writes_stay_off_the_calling_thread(pipeline):
+    handler = pipeline(delay=0.01)
+    start = time.perf_counter()
+    for i in range(50):
+        logging.getLogger("api").info("request %d", i)
+    elapsed = time.perf_counter() - start
+    log_pipeline.shutdown_logging()
+
+    assert elapsed < 0.25
+    assert [line["msg"] for line in handler.lines] == [f"request {i}" for i in range(50)]
+    assert threading.current_thread().name not in handler.threads
+
+
+def test_sampling_keeps_errors_and_escalations(pipeline):
+    handler = pipeline(rates="chat_request=0")
+    request_logger = logging.getLogger("api")
+    for _ in range(20):
+        request_logger.info("chat request", extra={"event": "chat_request"})
+    request_logger.error("chat failed", extra={"event": "chat_request"})
+    HumanFallbackHandler(notifier=type("Quiet", (), {"notify": lambda self, item: None})()).flag_conversation(
+        "c9", "I want to buy", "Strong keyword: buy")
+    log_pipeline.shutdown_logging()
+
+    assert [line["msg"] for line in handler.lines][0] == "chat failed"
+    escalation = handler.lines[1]
+    assert escalation["event"] == "escalation" and escalation["conversation_id"] == "c9"
+    assert "always" not in escalation
+
+
+def test_sampled_records_carry_their_rate(monkeypatch):
+    record = logging.makeLogRecord({"msg": "x", "levelno": logging.INFO, "event": "llm_call"})
+    monkeypatch.setattr(log_pipeline.random, "random", lambda: 0.05)
+    assert log_pipeline.SamplingFilter({"llm_call": 0.1}).filter(record)
+    assert record.sample_rate == 0.1
+
+
+def test_chat_turn_reports_route_and_stage_timings(pipeline, bot):
+    handler = pipeline()
+    bot.chat("where is my report", "c1", show_typing=False)
+    bot.chat("hello", "c1", show_typing=False)
+    log_pipeline.shutdown_logging()
+
+    turns = [line for line in handler.lines if line.get("event") == "chat_turn"]
+    assert [turn["route"] for turn in turns] == ["llm", "local"]
+    assert set(turns[0]["timings_ms"]) == {"fallback", "intent", "upstream", "total"}
+
+
+def test_file_handler_rotates(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LOG_MAX_BYTES", 500)
+    monkeypatch.setattr(config, "LOG_BACKUP_COUNT", 2)
+    handler = log_pipeline.build_file_handler(str(tmp_path / "app-{pid}.log"))
+    file_logger = logging.getLogger("log_pipeline.rotation_test")
+    file_logger.propagate = False
+    file_logger.addHandler(handler)
+    for i in range(50):
+        file_logger.warning("line %d", i)
+    handler.close()
+
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert len(files) == 3 and all(name.startswith("app-") for name in files)
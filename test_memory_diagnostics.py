@@ -0,0 +1,123 @@
+# test_memory_diagnostics.py
+# Memory accounting per structure, tracemalloc diffs and the trend sampler
+
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import config
+import memory_diagnostics
+from memory_diagnostics import MemorySampler, TraceDiff
+
+ADMIN = {"Authorization": "Bearer secret"}
+
+_leak = []
+
+
+def leak(n):
+    for i in range(n):
+        _leak.append("x" * 1000 + str(i))
+
+
+@pytest.fixture
+def traced():
+    tracer = TraceDiff()
+    yield tracer
+    tracer.stop()
+    _leak.clear()
+
+
+def fill(bot, conversations, turns=2):
+    for i in range(conversations):
+        bot.conversations[f"c{i}"] = [{"role": "USER", "message": f"question {i} " * 10},
+                                      {"role": "CHATBOT", "message": f"answer {i} " * 20}] * (turns // 2)
+
+
+def test_structures_count_and_size_what_the_bot_holds(bot):
+    fill(bot, 50)
+    small = memory_diagnostics.structures(bot)["conversations"]
+    fill(bot, 50, turns=10)
+    bot.fallback_handler.flagged_conversations["c1"] = {"urgency": "high", "message": "refund please"}
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait, name="typing-7")
+    worker.start()
+    try:
+        report = memory_diagnostics.structures(bot)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert report["conversations"]["count"] == 50
+    assert report["conversations"]["bytes"] > 4 * small["bytes"] > 0
+    assert report["flagged_conversations"]["count"] == 1
+    assert report["threads"]["by_kind"]["typing"] == 1
+    assert report["threads"]["total"] >= 2
+    assert report["rss_bytes"] > 0 and report["upstream_pool"]["pools"] >= 0
+    assert "tracemalloc" not in report
+
+
+def test_sampled_estimate_is_close_to_the_exact_size(bot):
+    fill(bot, 2000)
+    exact = memory_diagnostics.structures(bot)["conversations"]["bytes"]
+    estimate = memory_diagnostics.structures(bot, sample=100)["conversations"]["bytes"]
+    assert abs(estimate - exact) < 0.05 * exact
+
+
+def test_trace_diff_points_at_the_growing_site(traced):
+    assert traced.snapshot() is None
+    traced.start()
+    leak(2000)
+    diff = traced.snapshot(top=5)
+
+    assert diff["growth_bytes"] > 2000 * 1000
+    top = diff["top"][0]
+    assert top["site"][-1].startswith(__file__) and top["size_diff_bytes"] > 2000 * 1000
+    assert top["count_diff"] >= 2000
+    # The next diff only shows what grew since this one
+    assert traced.snapshot(top=5)["growth_bytes"] < 1000 * 1000
+
+
+def test_sampler_writes_trend_lines(bot, tmp_path):
+    fill(bot, 10)
+    sampler = MemorySampler(lambda: bot, str(tmp_path / "memory-{pid}.jsonl"), interval=0.01).start()
+    deadline = time.monotonic() + 5
+    while sampler.samples < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sampler.stop()
+
+    lines = [json.loads(line) for line in open(sampler.path)]
+    assert len(lines) >= 3 and "{pid}" not in sampler.path
+    assert lines[0]["conversations"] == 10 and lines[0]["rss_bytes"] > 0 and lines[0]["threads"] >= 2
+
+
+def test_trend_reports_growth_per_hour(tmp_path):
+    path = tmp_path / "memory.jsonl"
+    path.write_text("".join(json.dumps({"ts": 3600 * hour, "pid": 1, "rss_bytes": 100 + 50 * hour,
+                                        "threads": 5}) + "\n" for hour in range(6)))
+
+    result = memory_diagnostics.trend(str(path))
+
+    assert result["samples"] == 6 and result["hours"] == 5
+    assert result["growth"]["rss_bytes"] == {"first": 100, "last": 350, "per_hour": 50}
+    assert result["growth"]["threads"]["per_hour"] == 0
+
+
+def test_admin_endpoints(bot, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    fill(bot, 3)
+    with TestClient(api.app) as client:
+        assert client.get("/admin/memory").status_code == 401
+        assert client.get("/admin/memory", headers=ADMIN).json()["conversations"]["count"] == 3
+
+        assert client.get("/admin/memory/trace", headers=ADMIN).status_code == 409
+        try:
+            assert client.post("/admin/memory/trace/start", headers=ADMIN).json()["tracing"] is True
+            diff = client.get("/admin/memory/trace?top=3", headers=ADMIN).json()
+            assert len(diff["top"]) <= 3 and "growth_bytes" in diff
+            assert client.get("/admin/memory/trace?group_by=nope", headers=ADMIN).status_code == 400
+        finally:
+            assert client.post("/admin/memory/trace/stop", headers=ADMIN).json()["was_tracing"] is True
@@ -0,0 +1,246 @@
+# test_notifications.py
+# Background agent notifications against local stand-ins for each sink
+
+import importlib
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+from notifications import (FileSink, NotificationDispatcher, SMTPSink, WebhookSink,
+                           build_sinks_from_config)
+
+
+def notification(conversation_id, urgency="normal"):
+    return {
+        'conversation_id': conversation_id,
+        'timestamp': '2026-01-01T09:00:00',
+        'user_message': "I want to buy your product",
+        'reason': "Strong keyword: buy",
+        'urgency': urgency
+    }
+
+
+class RecordingSink:
+    channel = "memory"
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.attempts = []
+        self.failures = failures
+
+    def send(self, batch):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.failures:
+            raise ConnectionError("sink down")
+        self.batches.append(batch)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def webhook_server():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/hook", received
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def smtp_server():
+    """Minimal SMTP stand-in: accepts every message and keeps the DATA section"""
+    messages = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b"\r\n")
+
+        def handle(self):
+            self.reply("220 stand-in ready")
+            while True:
+                line = self.rfile.readline().decode().strip()
+                command = line.upper()
+                if not line or command == "QUIT":
+                    self.reply("221 bye")
+                    return
+                if command.startswith("EHLO") or command.startswith("HELO"):
+                    self.reply("250 stand-in")
+                elif command == "DATA":
+                    self.reply("354 go ahead")
+                    data = []
+                    while True:
+                        data_line = self.rfile.readline().decode()
+                        if data_line.rstrip("\r\n") == ".":
+                            break
+                        data.append(data_line)
+                    messages.append("".join(data))
+                    self.reply("250 queued")
+                else:
+                    self.reply("250 ok")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1], messages
+    server.shutdown()
+    server.server_close()
+
+
+def test_notifications_are_batched_per_channel():
+    sink = RecordingSink()
+    dispatcher = NotificationDispatcher([sink], batch_size=10, batch_interval=0.3)
+
+    for i in range(5):
+        dispatcher.notify(notification(f"conv-{i}"))
+    dispatcher.close()
+
+    assert len(sink.batches) == 1
+    assert [item['conversation_id'] for item in sink.batches[0]] == [f"conv-{i}" for i in range(5)]
+
+
+def test_batch_size_caps_each_delivery():
+    sink = RecordingSink()
+    dispatcher = NotificationDispatcher([sink], batch_size=2, batch_interval=0.3)
+
+    for i in range(5):
+        dispatcher.notify(notification(f"conv-{i}"))
+    dispatcher.close()
+
+    assert [len(batch) for batch in sink.batches] == [2, 2, 1]
+
+
+def test_failed_delivery_is_retried_with_backoff():
+    sink = RecordingSink(failures=2)
+    dispatcher = NotificationDispatcher([sink], batch_interval=0.01, retry_backoff=0.1)
+
+    dispatcher.notify(notification("conv-1"))
+    wait_for(lambda: sink.batches)
+    dispatcher.close()
+
+    gaps = [later - earlier for earlier, later in zip(sink.attempts, sink.attempts[1:])]
+    assert len(sink.attempts) == 3
+    assert gaps[0] >= 0.1 and gaps[1] >= 0.2
+    assert dispatcher.stats['retried'] == 2 and dispatcher.stats['delivered'] == 1
+
+
+def test_gives_up_after_max_retries():
+    sink = RecordingSink(failures=100)
+    dispatcher = NotificationDispatcher([sink], batch_interval=0.01, max_retries=3, retry_backoff=0.01)
+
+    dispatcher.notify(notification("conv-1"))
+    wait_for(lambda: dispatcher.stats['failed'])
+    dispatcher.close()
+
+    assert len(sink.attempts) == 3
+    assert not sink.batches
+
+
+def test_repeat_flags_are_deduped_within_window():
+    sink = RecordingSink()
+    dispatcher = NotificationDispatcher([sink], batch_interval=0.01, dedupe_window=0.2)
+
+    assert dispatcher.notify(notification("conv-1"))
+    assert not dispatcher.notify(notification("conv-1"))
+    time.sleep(0.25)
+    assert dispatcher.notify(notification("conv-1"))
+    dispatcher.close()
+
+    assert dispatcher.stats['deduped'] == 1
+    assert sum(len(batch) for batch in sink.batches) == 2
+
+
+def test_full_queue_drops_instead_of_blocking():
+    release = threading.Event()
+
+    class BlockedSink(RecordingSink):
+        def send(self, batch):
+            release.wait()
+            super().send(batch)
+
+    sink = BlockedSink()
+    dispatcher = NotificationDispatcher([sink], batch_size=1, batch_interval=0.01, max_queue=2)
+
+    dispatcher.notify(notification("conv-0"))
+    wait_for(lambda: dispatcher._queues["memory"].empty())
+
+    start = time.monotonic()
+    for i in range(1, 5):
+        dispatcher.notify(notification(f"conv-{i}"))
+    assert time.monotonic() - start < 0.1
+
+    release.set()
+    dispatcher.close()
+    assert dispatcher.stats['dropped'] == 2
+    assert sum(len(batch) for batch in sink.batches) == 3
+
+
+def test_close_flushes_queued_notifications(tmp_path):
+    path = tmp_path / "notifications.jsonl"
+    dispatcher = NotificationDispatcher([FileSink(str(path))], batch_interval=5)
+
+    for i in range(3):
+        dispatcher.notify(notification(f"conv-{i}"))
+    dispatcher.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [item['conversation_id'] for item in lines] == ["conv-0", "conv-1", "conv-2"]
+
+
+def test_webhook_sink_posts_batch(webhook_server):
+    url, received = webhook_server
+    dispatcher = NotificationDispatcher([WebhookSink(url)], batch_interval=0.05)
+
+    dispatcher.notify(notification("conv-1"))
+    dispatcher.notify(notification("conv-2"))
+    dispatcher.close()
+
+    assert len(received) == 1
+    assert [item['conversation_id'] for item in received[0]['notifications']] == ["conv-1", "conv-2"]
+
+
+def test_smtp_sink_sends_one_email_per_batch(smtp_server):
+    port, messages = smtp_server
+    sink = SMTPSink("127.0.0.1", port, "bot@example.com", ["agents@example.com"])
+    dispatcher = NotificationDispatcher([sink], batch_interval=0.05)
+
+    dispatcher.notify(notification("conv-1"))
+    dispatcher.notify(notification("conv-2", urgency="urgent"))
+    dispatcher.close()
+
+    assert len(messages) == 1
+    assert "Subject: Human Agent Needed - URGENT Priority (2)" in messages[0]
+    assert "Conversation ID: conv-1" in messages[0] and "Conversation ID: conv-2" in messages[0]
+
+
+def test_no_sinks_are_enabled_by_default(monkeypatch):
+    for name in ("NOTIFY_WEBHOOK_URL", "NOTIFY_SMTP_HOST", "NOTIFY_EMAIL_TO", "NOTIFY_FILE"):
+        monkeypatch.delenv(name, raising=False)
+    try:
+        importlib.reload(config)
+        assert build_sinks_from_config() == []
+    finally:
+        monkeypatch.undo()
+        importlib.reload(config)
@@ -0,0 +1,90 @@
+# test_providers.py
+# Model tiers: routing by message features, latency-aware ordering and failover
+
+import pytest
+
+import config
+from providers import MockProvider, ModelRouter, UpstreamError
+
+
+class FlakyProvider(MockProvider):
+    def __init__(self, name, failures):
+        super().__init__(name, model=name)
+        self.failures = failures
+        self.calls = 0
+
+    def complete(self, payload, cancel=None, usage=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise UpstreamError("HTTP 503")
+        return super().complete(payload, usage=usage)
+
+
+@pytest.fixture
+def tiers():
+    return MockProvider("fast", "fast-model"), MockProvider("strong", "strong-model")
+
+
+def test_simple_messages_go_to_fast_tier_complex_to_strong(tiers):
+    router = ModelRouter(*tiers, complex_words=25)
+    fast, strong = tiers
+
+    assert router.route("where is my report")[0] is fast
+    assert router.route("why does the export crash when I pick last month")[0] is strong
+    assert router.route("is it safe? where is it stored? who can read it?")[0] is strong
+    assert router.route(" ".join(["word"] * 30))[0] is strong
+
+
+def test_slow_tier_is_tried_second(tiers):
+    fast, strong = tiers
+    router = ModelRouter(fast, strong, slow_ms=1000)
+    router.record(fast, seconds=3.0)
+    router.record(strong, seconds=0.5)
+
+    assert router.route("where is my report") == [strong, fast]
+
+
+def test_failing_tier_is_marked_down_then_recovers(tiers, monkeypatch):
+    fast, strong = tiers
+    router = ModelRouter(fast, strong, max_failures=2, cooldown=60)
+    for _ in range(2):
+        router.record(fast, seconds=0.1, failed=True)
+
+    assert router.route("where is my report") == [strong, fast]
+    assert router.report()["fast"]["down"] is True
+
+    router.record(fast, seconds=0.1)
+    assert router.route("where is my report") == [fast, strong]
+
+
+def test_requests_carry_the_tier_model(bot, upstream, monkeypatch):
+    bot.chat("where is my report", "c1", show_typing=False)
+    bot.chat("why does my webhook integration keep returning an error", "c2", show_typing=False)
+
+    assert [body["model"] for body in upstream.requests] == [config.MODEL_FAST, config.MODEL_STRONG]
+
+
+def test_failed_tier_fails_over_to_the_other(bot, monkeypatch):
+    fast = FlakyProvider("fast", failures=5)
+    strong = MockProvider("strong", "strong-model")
+    bot.model_router = ModelRouter(fast, strong)
+    monkeypatch.setattr("bot.time.sleep", lambda seconds: None)
+
+    assert bot.chat("where is my report", "c1", show_typing=False) == "[strong-model] You said: where is my report."
+    assert fast.calls == 1
+    assert bot.model_router.report()["fast"]["failures"] == 1
+
+
+def test_mock_provider_needs_no_api_key(monkeypatch):
+    import bot as bot_module
+    monkeypatch.setattr(config, "LLM_PROVIDER", "mock")
+    monkeypatch.setattr(config, "COHERE_API_KEY", "")
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", False)
+    monkeypatch.setattr("bot.time.sleep", lambda seconds: None)
+
+    local_bot = bot_module.CustomerSupportBot()
+    reply = local_bot.chat("hello", "c1", show_typing=False)
+    streamed = list(local_bot.chat_stream("hello", "c2"))
+
+    assert reply == f"[{config.MODEL_FAST}] You said: hello."
+    assert streamed[-1] == ("done", reply)
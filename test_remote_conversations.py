@@ -0,0 +1,109 @@
+# test_remote_conversations.py
+# Server-side conversation mode: only new messages go upstream, with a fallback to client-side history
+
+import pytest
+
+import bot as bot_module
+import config
+from providers import MockProvider, build_model_router
+
+
+@pytest.fixture
+def server_bot(upstream, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HISTORY_MODE", "server")
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    return bot_module.CustomerSupportBot()
+
+
+def test_client_mode_resends_history(bot, upstream, monkeypatch):
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    bot.chat("where is my report", "c1", show_typing=False)
+    bot.chat("and the invoice", "c1", show_typing=False)
+
+    assert "conversation_id" not in upstream.requests[1]
+    assert [m["message"] for m in upstream.requests[1]["chat_history"]] == ["where is my report",
+                                                                             "Echo: where is my report."]
+
+
+def test_server_mode_sends_only_the_new_message(server_bot, upstream):
+    for message in ("where is my report", "and the invoice", "reset password"):
+        server_bot.chat(message, "c1", show_typing=False)
+
+    remote_ids = {request["conversation_id"] for request in upstream.requests}
+    assert len(remote_ids) == 1
+    assert all("chat_history" not in request for request in upstream.requests)
+    # The upstream side holds the whole conversation
+    assert [m["message"] for m in upstream.conversations[remote_ids.pop()]][::2] == [
+        "where is my report", "and the invoice", "reset password"]
+
+
+def test_server_mode_streams_too(server_bot, upstream):
+    list(server_bot.chat_stream("where is my report", "c1"))
+    list(server_bot.chat_stream("and the invoice", "c1"))
+
+    assert upstream.requests[0]["conversation_id"] == upstream.requests[1]["conversation_id"]
+    assert "chat_history" not in upstream.requests[1]
+
+
+def test_lost_remote_state_falls_back_to_client_history(server_bot, upstream):
+    server_bot.chat("where is my report", "c1", show_typing=False)
+    upstream.forget()
+
+    reply = server_bot.chat("and the invoice", "c1", show_typing=False)
+
+    assert reply == "Echo: and the invoice."
+    retry = upstream.requests[-1]
+    assert "conversation_id" not in retry
+    assert retry["chat_history"][0]["message"] == "where is my report"
+    assert server_bot.remote_conversations.stats['lost'] == 1
+    # The conversation stays client-side from here on
+    server_bot.chat("reset password", "c1", show_typing=False)
+    assert len(upstream.requests[-1]["chat_history"]) == 4
+
+
+def test_agent_reply_the_provider_never_saw_switches_to_client_history(server_bot, upstream):
+    server_bot.chat("where is my report", "c1", show_typing=False)
+    server_bot.add_agent_message("c1", "I've re-sent it to you.")
+
+    server_bot.chat("thanks, and the invoice", "c1", show_typing=False)
+
+    assert "conversation_id" not in upstream.requests[-1]
+    assert upstream.requests[-1]["chat_history"][-1]["message"] == "I've re-sent it to you."
+
+
+def test_local_answers_keep_the_conversation_server_side(server_bot, upstream):
+    assert server_bot.chat("hello", "c1", show_typing=False) != "Echo: hello."
+    server_bot.chat("where is my report", "c1", show_typing=False)
+    server_bot.chat("and the invoice", "c1", show_typing=False)
+
+    assert all("conversation_id" in request for request in upstream.requests)
+
+
+def test_failed_turn_is_not_assumed_to_be_remote(server_bot, upstream):
+    server_bot.chat("where is my report", "c1", show_typing=False)
+    upstream.status = 500
+    server_bot.chat("and the invoice", "c1", show_typing=False)
+    upstream.status = 200
+    server_bot.chat("reset password", "c1", show_typing=False)
+
+    assert "chat_history" in upstream.requests[-1]
+
+
+def test_cleared_conversation_starts_a_new_remote_one(server_bot, upstream):
+    server_bot.chat("where is my report", "c1", show_typing=False)
+    server_bot.clear_conversation("c1")
+    server_bot.chat("reset password", "c1", show_typing=False)
+
+    first, second = upstream.requests
+    assert first["conversation_id"] != second["conversation_id"]
+
+
+def test_mock_provider_tiers_share_conversations(monkeypatch):
+    monkeypatch.setattr(config, "LLM_PROVIDER", "mock")
+    router = build_model_router(None, None)
+    router.fast.complete({"message": "one", "conversation_id": "r1"})
+    router.strong.complete({"message": "two", "conversation_id": "r1"})
+
+    assert [m["message"] for m in router.fast.conversations["r1"]][::2] == ["one", "two"]
+    assert "r1" not in MockProvider().conversations
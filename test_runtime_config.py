@@ -0,0 +1,194 @@
+# test_runtime_config.py
+# Runtime config: reloads on change, SIGHUP or the admin endpoint, swapped in whole
+
+import json
+import os
+import signal
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import bot as bot_module
+import config
+import runtime_config
+from runtime_config import ConfigReloader
+
+SETTINGS = {
+    "company_name": "Beta Co",
+    "product_info_file": "product_info.md",
+    "strong_keywords": ["cancel"],
+    "tuning": {"model_complex_words": 7, "max_retries": 2}
+}
+
+
+def write(path, data):
+    path.write_text(json.dumps(data))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def settings_file(tmp_path, monkeypatch):
+    (tmp_path / "product_info.md").write_text("- Beta Desk: help desk software")
+    path = tmp_path / "runtime.json"
+    write(path, SETTINGS)
+    monkeypatch.setattr(config, "RUNTIME_CONFIG_FILE", str(path))
+    return path
+
+
+@pytest.fixture
+def config_bot(settings_file, upstream, monkeypatch):
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    instance = bot_module.CustomerSupportBot()
+    monkeypatch.setattr(bot_module, "_shared_bot", instance)
+    yield instance
+    if instance.config_reloader is not None:
+        instance.config_reloader.stop()
+
+
+def test_settings_and_tuning_are_applied_at_startup(config_bot):
+    assert "Beta Co" in config_bot.system_message
+    assert "Beta Desk" in config_bot.system_message
+    assert config_bot.model_router.complex_words == 7
+    assert config_bot.max_retries == 2
+    assert config_bot.tenants.default.templates is not None
+
+
+def test_reload_swaps_rules_and_preamble(config_bot, settings_file):
+    handler = config_bot.fallback_handler
+    assert handler.should_transfer_to_human("please cancel it", config_bot.tenants.default.rules)[0]
+
+    write(settings_file, dict(SETTINGS, company_name="Gamma Ltd",
+                                trigger_keywords=["lawyer"], strong_keywords=["lawyer"]))
+    assert ConfigReloader(config_bot).reload()
+
+    rules = config_bot.tenants.default.rules
+    assert handler.should_transfer_to_human("I want my lawyer", rules)[0]
+    assert not handler.should_transfer_to_human("please cancel it", rules)[0]
+    assert "Gamma Ltd" in config_bot.system_message
+
+
+@pytest.mark.parametrize("content", ["{not json", json.dumps({"colour": "blue"}),
+                                     json.dumps({"tuning": {"model_slow_ms": "fast"}})])
+def test_invalid_file_keeps_running_config(config_bot, settings_file, content):
+    tenants = config_bot.tenants
+    reloader = ConfigReloader(config_bot)
+    settings_file.write_text(content)
+
+    assert not reloader.reload()
+    assert config_bot.tenants is tenants
+    assert reloader.stats['errors'] == 1 and reloader.stats['last_error']
+    assert reloader.version == 0
+
+
+def test_watcher_reloads_when_a_file_changes(config_bot, settings_file):
+    reloader = ConfigReloader(config_bot, poll_interval=0.02)
+    reloader.start()
+    try:
+        info = settings_file.parent / "product_info.md"
+        info.write_text("- Beta Desk 2: help desk software")
+        later = time.time() + 5
+        os.utime(info, (later, later))
+        wait_for(lambda: reloader.version == 1)
+        assert "Beta Desk 2" in config_bot.system_message
+    finally:
+        reloader.stop()
+
+
+def test_request_in_flight_keeps_the_config_it_started_with(config_bot, settings_file, upstream):
+    upstream.delay = 0.3
+    first = threading.Thread(target=config_bot.chat, args=("where is my report", "c1"),
+                             kwargs={"show_typing": False})
+    first.start()
+    wait_for(lambda: upstream.requests)
+
+    write(settings_file, dict(SETTINGS, company_name="Gamma Ltd"))
+    assert ConfigReloader(config_bot).reload()
+    first.join()
+    upstream.delay = 0
+    config_bot.chat("where is my report", "c2", show_typing=False)
+
+    assert "Beta Co" in upstream.requests[0]["preamble"]
+    assert "Gamma Ltd" in upstream.requests[1]["preamble"]
+
+
+def test_tuning_reaches_the_intent_router_created_later(config_bot, settings_file, monkeypatch):
+    monkeypatch.setattr(config, "INTENT_ROUTER_ENABLED", True)
+    write(settings_file, dict(SETTINGS, tuning={"intent_confidence": 0.95}))
+    assert ConfigReloader(config_bot).reload()
+
+    assert config_bot.intent_router.threshold == 0.95
+
+
+def test_admin_endpoint_reloads(config_bot, settings_file, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    client = TestClient(api.app)
+    headers = {"Authorization": "Bearer secret"}
+    assert client.post("/admin/reload").status_code == 401
+
+    write(settings_file, dict(SETTINGS, company_name="Gamma Ltd"))
+    response = client.post("/admin/reload", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["success"] and response.json()["version"] == 1
+    assert "Gamma Ltd" in config_bot.system_message
+
+    settings_file.write_text("{broken")
+    response = client.post("/admin/reload", headers=headers)
+    assert response.status_code == 422
+    assert not response.json()["success"]
+    assert "Gamma Ltd" in config_bot.system_message
+
+
+def test_sighup_requests_a_reload(config_bot, settings_file, monkeypatch):
+    # Long poll, so the reload comes from the signal and not the file watcher
+    monkeypatch.setattr(config, "RUNTIME_CONFIG_POLL", 60)
+    previous = signal.getsignal(signal.SIGHUP)
+    reloader = config_bot.watch_config()
+    try:
+        write(settings_file, dict(SETTINGS, company_name="Gamma Ltd"))
+        os.kill(os.getpid(), signal.SIGHUP)
+        wait_for(lambda: reloader.version >= 1)
+        assert "Gamma Ltd" in config_bot.system_message
+    finally:
+        signal.signal(signal.SIGHUP, previous)
+
+
+def test_build_without_files_uses_config_defaults(monkeypatch):
+    monkeypatch.setattr(config, "RUNTIME_CONFIG_FILE", "")
+    registry, tuning = runtime_config.build()
+
+    assert tuning == {}
+    assert registry.default.company_name == config.COMPANY_NAME
+    assert registry.default.rules is None and registry.default.templates is None
+
+
+def test_reload_swaps_one_snapshot(config_bot, settings_file):
+    before = config_bot.runtime
+    write(settings_file, dict(SETTINGS, company_name="Gamma Ltd"))
+    assert ConfigReloader(config_bot).reload()
+
+    after = config_bot.runtime
+    assert after is not before and "Beta Co" in before.tenants.default.preamble
+    assert config_bot.tenants is after.tenants and config_bot.tuning is after.tuning
+    with pytest.raises(AttributeError):
+        after.tenants = before.tenants
+
+
+def test_knob_removed_from_the_file_goes_back_to_its_default(config_bot, settings_file):
+    write(settings_file, dict(SETTINGS, tuning={"model_complex_words": 7}))
+    assert ConfigReloader(config_bot).reload()
+    assert config_bot.model_router.complex_words == 7
+    assert config_bot.max_retries == config.MAX_RETRIES
+
+    write(settings_file, dict(SETTINGS, tuning={}))
+    assert ConfigReloader(config_bot).reload()
+    assert config_bot.model_router.complex_words == config.MODEL_COMPLEX_WORDS
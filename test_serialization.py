@@ -0,0 +1,49 @@
+# test_serialization.py
+# Fast JSON paths: request parsing, responses and pre-encoded upstream payloads
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from serialization import InvalidBody, encode_chat_payload, parse_object, preamble_fragment
+
+
+def test_spliced_payload_decodes_to_the_same_document():
+    payload = {"message": "Habari? é€", "chat_history": [{"role": "USER", "message": "hi"}],
+               "preamble": "You are helpful.\nBe \"concise\".", "temperature": 0.3}
+
+    body = encode_chat_payload(payload, model="command-r", stream=False)
+
+    assert json.loads(body) == dict(payload, model="command-r", stream=False)
+    assert encode_chat_payload({"preamble": "p"}) == b'{"preamble":"p"}'
+
+
+def test_preamble_is_encoded_once():
+    assert preamble_fragment("Same preamble") is preamble_fragment("Same preamble")
+
+
+@pytest.mark.parametrize("body,error", [
+    (b"not json", "Request body must be JSON"),
+    (b"[1, 2]", "Request body must be a JSON object"),
+    (b"{}", "'message' is required"),
+    (b'{"message": 5}', "'message' must be a string"),
+])
+def test_invalid_bodies_are_rejected(body, error):
+    with pytest.raises(InvalidBody, match=error):
+        parse_object(body, {"message": None, "conversation_id": "default"})
+
+
+def test_chat_endpoint_round_trip_and_bad_body(bot, upstream):
+    with TestClient(api.app) as client:
+        ok = client.post("/chat", json={"message": "where is my report"})
+        bad = client.post("/chat", content=b'{"message": 5}', headers={"Content-Type": "application/json"})
+        schema = client.get("/openapi.json").json()
+
+    assert ok.json() == {"success": True, "response": "Echo: where is my report.", "conversation_id": "default"}
+    assert ok.headers["content-type"] == "application/json"
+    assert bad.status_code == 400 and bad.json() == {"success": False, "error": "'message' must be a string"}
+    assert "message" in json.dumps(schema["paths"]["/chat"]["post"]["requestBody"])
+    # The upstream saw the whole payload, preamble included
+    assert upstream.requests[0]["preamble"] == bot.system_message
@@ -0,0 +1,28 @@
+# test_startup.py
+# Cold-start regression check: importing the app and building the bot stays under budget
+
+import os
+import subprocess
+import sys
+
+import config
+from startup_report import measure_startup
+
+
+def test_time_to_ready_is_within_budget():
+    # Best of two runs, so one noisy run on a busy machine doesn't fail the build
+    timings = min((measure_startup("api") for _ in range(2)), key=lambda t: t["ready_ms"])
+
+    assert timings["ready_ms"] <= config.STARTUP_BUDGET_MS, (
+        f"time to ready {timings['ready_ms']:.0f} ms exceeds budget {config.STARTUP_BUDGET_MS} ms"
+    )
+
+
+def test_bot_is_not_built_at_import():
+    # Fresh interpreter: other tests have already imported api and built a bot
+    probe = "import api, bot; print(bot._shared_bot is None)"
+    env = dict(os.environ, COHERE_API_KEY="test-key")
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    assert result.stdout.strip() == "True", result.stderr
@@ -0,0 +1,189 @@
+# test_tenants.py
+# Several companies in one process: own preamble, rules, answers and conversations
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import bot as bot_module
+import config
+from admission import AdmissionController, Rejected
+from tenants import TenantRegistry, UnknownTenant
+
+TENANTS = {
+    "acme": {
+        "company_name": "Acme Cloud",
+        "product_info": "- Acme Storage: object storage\n- Support hours: 24/7\n- Support email: help@acme.test",
+        "hosts": ["support.acme.test"],
+        "trigger_keywords": ["escalate", "lawyer"],
+        "strong_keywords": ["escalate"],
+        "transfer_messages": {"general": "An Acme agent will take it from here."}
+    },
+    "globex": {"company_name": "Globex", "product_info": "- Globex CRM: contacts and deals"}
+}
+
+
+@pytest.fixture
+def tenants_file(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps(TENANTS))
+    monkeypatch.setattr(config, "TENANTS_FILE", str(path))
+    return path
+
+
+@pytest.fixture
+def tenant_bot(tenants_file, upstream, monkeypatch):
+    monkeypatch.setattr(config, "COHERE_API_URL", upstream.url)
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    instance = bot_module.CustomerSupportBot()
+    monkeypatch.setattr(bot_module, "_shared_bot", instance)
+    return instance
+
+
+class Connection:
+    def __init__(self, headers=None, query=None):
+        self.headers = headers or {}
+        self.query_params = query or {}
+
+
+def test_registry_resolves_by_header_query_and_host(tenants_file):
+    registry = TenantRegistry.load()
+
+    assert len(registry) == 3
+    assert registry.resolve(Connection({"X-Tenant-ID": "globex"})).company_name == "Globex"
+    assert registry.resolve(Connection(query={"tenant": "acme"})).tenant_id == "acme"
+    assert registry.resolve(Connection({"host": "support.acme.test:443"})).tenant_id == "acme"
+    assert registry.resolve(Connection({"host": "localhost"})).is_default
+    with pytest.raises(UnknownTenant):
+        registry.resolve(Connection({"X-Tenant-ID": "initech"}))
+
+
+def test_tenant_ids_are_validated(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({"default": TENANTS["globex"]}))
+    with pytest.raises(ValueError):
+        TenantRegistry.load(str(path))
+
+
+def test_preamble_is_compiled_once_per_tenant(tenant_bot, upstream):
+    acme = tenant_bot.tenants.get("acme")
+    tenant_bot.chat("where is my report", "c1", show_typing=False, tenant=acme)
+    tenant_bot.chat("where is my report", "c1", show_typing=False)
+
+    assert upstream.requests[0]["preamble"] is not upstream.requests[1]["preamble"]
+    assert "Acme Cloud" in upstream.requests[0]["preamble"]
+    assert upstream.requests[1]["preamble"] == tenant_bot.system_message
+    assert acme.preamble is tenant_bot.tenants.get("acme").preamble
+
+
+def test_conversations_are_isolated_per_tenant(tenant_bot):
+    acme, globex = tenant_bot.tenants.get("acme"), tenant_bot.tenants.get("globex")
+    tenant_bot.chat("where is my report", "c1", show_typing=False, tenant=acme)
+    tenant_bot.chat("reset password", "c1", show_typing=False, tenant=globex)
+    tenant_bot.clear_conversation("c1", tenant=globex)
+
+    assert tenant_bot.conversations["acme:c1"][0]["message"] == "where is my report"
+    assert "globex:c1" not in tenant_bot.conversations
+    assert "c1" not in tenant_bot.conversations
+
+
+def test_clear_endpoint_clears_the_requests_tenant(tenant_bot):
+    acme = tenant_bot.tenants.get("acme")
+    tenant_bot.chat("where is my report", "c1", show_typing=False, tenant=acme)
+    tenant_bot.chat("where is my report", "c1", show_typing=False)
+    with TestClient(api.app) as client:
+        assert client.post("/clear/c1", headers={"X-Tenant-ID": "acme"}).json()["success"] is True
+        assert client.post("/clear/c1", headers={"X-Tenant-ID": "nope"}).status_code == 404
+
+    assert "acme:c1" not in tenant_bot.conversations
+    assert len(tenant_bot.conversations["c1"]) == 2
+
+
+def test_default_tenant_cannot_name_another_tenants_conversation(tenant_bot, upstream):
+    acme = tenant_bot.tenants.get("acme")
+    tenant_bot.chat("my acme order number is 4417", "c1", show_typing=False, tenant=acme)
+    with TestClient(api.app) as client:
+        response = client.post("/chat", json={"message": "what did I just say", "conversation_id": "acme:c1"})
+    assert response.status_code == 200
+
+    sent = upstream.requests[-1]
+    assert sent["chat_history"] == [] and "Acme" not in sent["preamble"]
+    assert len(tenant_bot.conversations["acme:c1"]) == 2
+    assert len(tenant_bot.conversations["default:acme:c1"]) == 2
+
+
+def test_transfer_rules_and_messages_are_per_tenant(tenant_bot):
+    acme = tenant_bot.tenants.get("acme")
+
+    assert tenant_bot.chat("please escalate this", "c1", show_typing=False,
+                           tenant=acme) == "An Acme agent will take it from here."
+    assert "acme:c1" in tenant_bot.fallback_handler.flagged_conversations
+    # "buy" is a default keyword, not one of Acme's
+    assert tenant_bot.chat("I buy storage monthly, where is my report", "c2", show_typing=False,
+                           tenant=acme).startswith("Echo:")
+    assert "Acme" not in tenant_bot.chat("I want to buy", "c3", show_typing=False)
+
+
+def test_local_answers_use_the_tenant_company(tenant_bot, upstream):
+    acme = tenant_bot.tenants.get("acme")
+
+    assert "Acme Cloud" in tenant_bot.chat("hello", "c1", show_typing=False, tenant=acme)
+    assert "Acme Cloud" not in tenant_bot.chat("hello", "c1", show_typing=False)
+    assert not upstream.requests
+
+
+def test_chat_endpoint_resolves_the_tenant(tenant_bot, upstream):
+    with TestClient(api.app) as client:
+        ok = client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"},
+                         headers={"X-Tenant-ID": "globex"})
+        unknown = client.post("/chat", json={"message": "where is my report", "conversation_id": "c1"},
+                              headers={"X-Tenant-ID": "initech"})
+
+    assert ok.status_code == 200 and ok.json()["conversation_id"] == "c1"
+    assert "Globex" in upstream.requests[0]["preamble"]
+    assert "globex:c1" in tenant_bot.conversations
+    assert unknown.status_code == 404
+
+
+def test_free_slots_go_round_robin_across_tenants():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=10, queue_timeout=1)
+        order = []
+
+        async def turn(name, tenant):
+            async with controller.admit(tenant):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        noisy = [turn(f"a{i}", "a") for i in range(4)]
+        tasks = [asyncio.ensure_future(t) for t in noisy]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(turn("b1", "b")))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a0", "a1", "b1", "a2", "a3"]
+
+
+def test_one_tenant_cannot_fill_the_whole_queue():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_queue=10, queue_timeout=1, tenant_queue=2)
+        results = []
+
+        async def turn(tenant):
+            try:
+                async with controller.admit(tenant):
+                    await asyncio.sleep(0.02)
+                results.append((tenant, "ok"))
+            except Rejected:
+                results.append((tenant, "rejected"))
+
+        await asyncio.gather(*[turn("a") for _ in range(4)], turn("b"))
+        return results
+
+    results = asyncio.run(scenario())
+    assert results.count(("a", "rejected")) == 1
+    assert ("b", "ok") in results
@@ -0,0 +1,106 @@
+# test_traffic_trace.py
+# Anonymized traffic traces: what a turn records, and replaying a trace with the recorded latencies
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import api
+import bot as bot_module
+import config
+import traffic_trace
+from traffic_trace import ReplayUpstream, TraceRecorder
+
+
+@pytest.fixture
+def recorder(bot, tmp_path):
+    bot.traffic_trace = TraceRecorder(str(tmp_path / "trace-{pid}.jsonl"), salt="test", flush_interval=60)
+    return bot.traffic_trace
+
+
+def trace_path(recorder):
+    return recorder.path.replace("{pid}", str(os.getpid()))
+
+
+def recorded(recorder):
+    recorder.flush()
+    return traffic_trace.load(trace_path(recorder))
+
+
+def test_turns_are_recorded_without_text_or_ids(bot, recorder):
+    with TestClient(api.app) as client:
+        for message in ("where is my report from last month", "hello", "I need a human agent"):
+            client.post("/chat", json={"message": message, "conversation_id": "customer-0712"})
+
+    records = recorded(recorder)
+    raw = open(trace_path(recorder)).read()
+    assert "report" not in raw and "customer-0712" not in raw
+    assert [record["route"] for record in records] == ["llm", "local", "human"]
+    assert len({record["conversation"] for record in records}) == 1
+    assert records[0]["conversation"] == recorder.anonymize("customer-0712")
+    llm = records[0]
+    assert llm["words"] == 7 and llm["chars"] == 34 and llm["stream"] is False and llm["outcome"] == "ok"
+    assert [call["ok"] for call in llm["calls"]] == [True] and llm["calls"][0]["tier"] in ("fast", "strong")
+    assert llm["total_ms"] >= llm["calls"][0]["ms"] > 0
+    assert records[1]["calls"] == [] and records[2]["calls"] == []
+
+
+def test_failed_calls_and_streams_are_recorded(bot, recorder, upstream, monkeypatch):
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    upstream.status = 500
+    bot.chat("where is my report", "c1")
+    upstream.status = 200
+    events = list(bot.chat_stream("where is my invoice", "c2"))
+
+    first, second = recorded(recorder)
+    assert [call["ok"] for call in first["calls"]] == [False, False, False]
+    assert first["route"] == "llm" and first["outcome"] == "ok"
+    assert second["stream"] is True and second["outcome"] == "ok" and events[-1][0] == "done"
+
+
+def test_summary_and_synthesized_messages():
+    records = [{"ts": 100 + i, "conversation": f"c{i % 2}", "words": 10, "route": route, "outcome": "ok",
+                "calls": [{"tier": "fast", "ms": 200.0, "ok": True}] if route == "llm" else []}
+               for i, route in enumerate(["llm", "local", "llm", "human", "llm"])]
+
+    summary = traffic_trace.summarize(records)
+
+    assert summary["routes"] == {"llm": 3, "local": 1, "human": 1}
+    assert summary["rate_per_s"] == 1.25 and summary["upstream_p50_ms"] == 200.0
+    message = traffic_trace.synthesize(7, records[0])
+    assert len(message.split()) == 10 and message.endswith("ref-7")
+    assert traffic_trace.synthesize(1, records[1]) == traffic_trace.LOCAL_MESSAGE
+    assert traffic_trace.synthesize(3, records[3]) == traffic_trace.HUMAN_MESSAGE
+
+
+def test_replay_reproduces_recorded_latencies(monkeypatch):
+    records = []
+    for i in range(12):
+        route = ("llm", "llm", "local", "human")[i % 4]
+        calls = [{"tier": "fast", "ms": 150.0, "ok": True}] if route == "llm" else []
+        if i == 4:
+            calls = [{"tier": "fast", "ms": 10.0, "ok": False}, {"tier": "strong", "ms": 150.0, "ok": True}]
+        records.append({"ts": 1000 + i * 0.5, "conversation": f"c{i % 3}", "tenant": "default", "words": 8,
+                        "route": route, "calls": calls, "total_ms": 160.0, "outcome": "ok"})
+    stand_in = ReplayUpstream(records)
+    monkeypatch.setattr(config, "COHERE_API_URL", stand_in.url)
+    monkeypatch.setattr(bot_module, "pause", lambda seconds, cancel=None: None)
+    # Every replayed turn comes from the one test client
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_PER_MIN", 0)
+    monkeypatch.setattr(admission, "chat_admission", admission.ChatAdmission())
+    monkeypatch.setattr(bot_module, "_shared_bot", bot_module.CustomerSupportBot())
+    try:
+        with TestClient(api.app) as client:
+            report = traffic_trace.replay(records, "http://testserver", speed=10,
+                                          post=lambda url, timeout, **kwargs: client.post(url, **kwargs))
+    finally:
+        stand_in.close()
+
+    assert report["turns"] == 12 and report["errors"] == 0 and report["statuses"] == {"200": 12}
+    assert stand_in.unplanned == 0
+    assert report["routes"]["llm"]["turns"] == 6
+    assert report["routes"]["llm"]["replayed_p50_ms"] >= 150
+    assert report["routes"]["human"]["turns"] == report["routes"]["local"]["turns"] == 3
+    assert 0.5 <= report["duration_s"] < 3
@@ -0,0 +1,141 @@
+# test_usage_ledger.py
+# Tokens and cost per conversation, tenant and tier, flushes to the shared
+# store, and the budgets that downgrade or stop a conversation's LLM calls
+
+import sqlite3
+import threading
+
+from fastapi.testclient import TestClient
+
+import api
+import config
+import usage_ledger
+from providers import fill_usage
+from usage_ledger import UsageLedger
+
+ADMIN = {"Authorization": "Bearer secret"}
+
+
+def test_billed_tokens_are_recorded_per_conversation_tenant_and_tier(bot):
+    assert bot.chat("where is my report", "c1") == "Echo: where is my report."
+    assert list(bot.chat_stream("where is my invoice", "c1"))[-1] == ("done", "Echo: where is my invoice.")
+
+    conversation = bot.usage_ledger.usage("conversation", "c1")
+    # The stand-in bills a token per word: "Echo: where is my report" twice over
+    assert conversation["calls"] == 2 and conversation["output_tokens"] == 10
+    assert conversation["input_tokens"] > 2 * len(bot.system_message.split())
+    assert bot.usage_ledger.usage("tenant", "default") == conversation
+    fast = bot.usage_ledger.usage("tier", "fast")
+    assert fast["calls"] == 2 and fast["ms"] > 0
+    assert abs(fast["cost"] - bot.usage_ledger.cost("fast", conversation["input_tokens"], 10)) < 1e-12
+    assert fast["cost"] > 0
+
+
+def test_usage_is_estimated_when_the_response_reports_none():
+    usage = {}
+    fill_usage(usage, None, {"message": "x" * 40, "preamble": "p" * 400,
+                             "chat_history": [{"role": "USER", "message": "y" * 80}]}, "z" * 21)
+    assert usage == {"input_tokens": 130, "output_tokens": 6, "estimated": True}
+
+    billed = {}
+    fill_usage(billed, {"billed_units": {"input_tokens": 7, "output_tokens": 3}}, {"message": "hi"}, "hello")
+    assert billed == {"input_tokens": 7, "output_tokens": 3}
+
+
+def test_conversation_over_budget_uses_the_fast_tier_then_gets_the_canned_answer(bot, upstream):
+    complex_message = "why does the export crash"
+    bot.chat(complex_message, "c1")
+    spent = bot.usage_ledger.tokens("conversation", "c1")
+    bot.usage_ledger.conversation_budget = spent
+    bot.usage_ledger.conversation_limit = 3 * spent
+
+    bot.chat(complex_message, "c1")
+    # Another conversation is still within its budget
+    bot.chat(complex_message, "c2")
+    assert [body["model"] for body in upstream.requests] == [config.MODEL_STRONG, config.MODEL_FAST,
+                                                            config.MODEL_STRONG]
+
+    bot.chat(complex_message, "c1")
+    assert bot.usage_ledger.tokens("conversation", "c1") >= 3 * spent
+    requests = len(upstream.requests)
+    assert bot.chat(complex_message, "c1") == config.USAGE_LIMIT_MESSAGE
+    assert list(bot.chat_stream(complex_message, "c1"))[-1] == ("done", config.USAGE_LIMIT_MESSAGE)
+    assert len(upstream.requests) == requests
+    assert bot.conversations["c1"][-1]["message"] == config.USAGE_LIMIT_MESSAGE
+    assert bot.usage_ledger.stats['limited'] == 2 and bot.usage_ledger.stats['downgraded'] == 2
+
+
+def test_tenant_limit_counts_every_worker_through_the_store(tmp_path):
+    path = str(tmp_path / "usage.db")
+    first, second = UsageLedger(path), UsageLedger(path)
+    second.tenant_limit = 1000
+
+    first.record("acme:c1", "acme", "strong", 700, 200)
+    assert second.check("acme:c2", "acme") == "ok"
+    first.flush()
+    second.record("acme:c2", "acme", "fast", 80, 20)
+    second.flush()
+    assert second.check("acme:c2", "acme") == "limit"
+    assert second.check("other:c1", "other") == "ok"
+
+    # A restarted worker starts from the store's totals
+    restarted = UsageLedger(path)
+    restarted.tenant_limit = 1000
+    restarted.start()
+    try:
+        assert restarted.tokens("tenant", "acme") == 1000
+        assert restarted.check("acme:c3", "acme") == "limit"
+    finally:
+        restarted.stop()
+
+
+def test_concurrent_records_add_up_and_flushes_write_only_changes(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "usage.db"), stripes=4, prices={"fast": (1.0, 2.0)})
+
+    def work(worker):
+        for i in range(500):
+            ledger.record(f"c{(worker + i) % 20}", "default", "fast", 10, 5, 1.0)
+            if i % 100 == 0:
+                ledger.flush()
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ledger.flush()
+    ledger.flush()
+
+    assert ledger.usage("tenant", "default")["calls"] == 4000
+    assert sum(ledger.usage("conversation", f"c{i}")["calls"] for i in range(20)) == 4000
+    with sqlite3.connect(ledger.path) as db:
+        assert db.execute("SELECT calls, input_tokens, output_tokens FROM usage WHERE scope = 'tenant'").fetchone() \
+            == (4000, 40000, 20000)
+    report = ledger.report(top=3)
+    assert report["tiers"]["fast"]["calls"] == 4000 and report["cost"] == round(4000 * 20 / 1_000_000, 6)
+    assert report["conversations"] == 20 and len(report["top_conversations"]) == 3
+
+
+def test_a_new_day_starts_from_zero(monkeypatch):
+    ledger = UsageLedger("")
+    ledger.conversation_limit = 100
+    monkeypatch.setattr(usage_ledger, "today", lambda: "2024-06-10")
+    ledger.record("c1", "default", "fast", 90, 10)
+    assert ledger.check("c1", "default") == "limit"
+
+    monkeypatch.setattr(usage_ledger, "today", lambda: "2024-06-11")
+    assert ledger.check("c1", "default") == "ok"
+    ledger.record("c1", "default", "fast", 1, 1)
+    assert ledger.usage("conversation", "c1", day="2024-06-10")["calls"] == 0
+
+
+def test_admin_usage_endpoint(bot, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "secret")
+    bot.chat("where is my report", "c1")
+    with TestClient(api.app) as client:
+        assert client.get("/admin/usage").status_code == 401
+        assert client.get("/admin/usage?day=yesterday", headers=ADMIN).status_code == 400
+        report = client.get("/admin/usage", headers=ADMIN).json()
+    assert report["tenants"]["default"]["calls"] == 1
+    assert report["top_conversations"][0]["conversation"] == "c1"
+    assert report["budgets"]["tenant_limit"] == 0
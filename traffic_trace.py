@@ -0,0 +1,306 @@
+# traffic_trace.py
+# Record production traffic as an anonymized trace and replay it against a
+# build, for capacity planning and regression checks with a realistic mix of
+# FAQ hits, long LLM conversations and human transfers.
+#
+# With TRACE_FILE set, every chat turn (POST /chat, /chat/batch, the widget's
+# WebSocket, channel webhooks) appends one JSON line:
+#
+#   {"ts": 1718000000.123, "conversation": "9f2c1a7be04d", "tenant": "default",
+#    "chars": 42, "words": 8, "stream": false, "route": "llm",
+#    "calls": [{"tier": "fast", "ms": 812.4, "ok": true}], "total_ms": 815.0, "outcome": "ok"}
+#
+# No message text is kept, and conversation ids are replaced by a keyed hash
+# (TRACE_SALT, or a random key per process). route is how the bot answered:
+# "human" (transfer), "local" (answer pack or intent router) or "llm".
+#
+#   python traffic_trace.py summary trace.jsonl
+#   python traffic_trace.py replay trace.jsonl --url http://localhost:8000 --speed 10 --upstream-port 8081
+#
+# The replay sends each recorded turn as POST /chat at its recorded time
+# divided by --speed, with a message of the same length built to take the
+# same route, and a conversation's turns in order. The build under test must
+# point COHERE_API_URL at the stand-in (http://127.0.0.1:8081/v1/chat), which
+# answers each LLM turn with the recorded latency (and failures) of its calls.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+
+import config
+
+# Messages that take the human and local routes in a default build
+HUMAN_MESSAGE = "I need a human agent"
+LOCAL_MESSAGE = "hello"
+# Words that make up LLM-routed messages; none of them is a transfer trigger
+FILLER = ("where", "is", "my", "report", "from", "last", "month", "and", "the", "invoice", "details", "for", "our",
+          "team", "account")
+REF_PATTERN = re.compile(r"\bref-(\d+)\b")
+
+
+class TraceRecorder:
+    """Buffers turn records and appends them to path ("{pid}" is replaced) about once per flush_interval"""
+
+    def __init__(self, path=None, salt=None, flush_interval=1.0, max_buffer=1000):
+        self.path = path or config.TRACE_FILE
+        salt = config.TRACE_SALT if salt is None else salt
+        self._key = salt.encode() if salt else os.urandom(16)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self.stats = {'recorded': 0, 'write_errors': 0}
+
+    def anonymize(self, conversation_key):
+        return blake2b(conversation_key.encode(), key=self._key, digest_size=6).hexdigest()
+
+    def begin(self, conversation_key, tenant_id, user_message, stream=False):
+        """The record for a turn that arrives now; completed by finish()"""
+        return {"ts": round(time.time(), 3), "conversation": self.anonymize(conversation_key), "tenant": tenant_id,
+                "chars": len(user_message), "words": len(user_message.split()), "stream": stream,
+                "route": None, "calls": [], "_start": time.perf_counter()}
+
+    def finish(self, turn, outcome):
+        turn["total_ms"] = round((time.perf_counter() - turn.pop("_start")) * 1000, 2)
+        turn["outcome"] = outcome
+        with self._lock:
+            self._buffer.append(turn)
+            self.stats['recorded'] += 1
+            due = (len(self._buffer) >= self.max_buffer
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not records:
+            return
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        try:
+            with self._write_lock, open(self.path.replace("{pid}", str(os.getpid())), "a") as f:
+                f.write(data)
+        except OSError:
+            self.stats['write_errors'] += 1
+
+
+def load(path):
+    """Records of a trace file, by arrival time"""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["ts"])
+
+
+def _percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * share))], 1)
+
+
+def summarize(records):
+    """Arrival rate, route mix, message sizes and upstream latencies of a trace"""
+    if not records:
+        return {"turns": 0}
+    span = records[-1]["ts"] - records[0]["ts"]
+    routes = defaultdict(int)
+    for record in records:
+        routes[record.get("route") or record["outcome"]] += 1
+    calls = [call["ms"] for record in records for call in record["calls"]]
+    return {
+        "turns": len(records),
+        "conversations": len({record["conversation"] for record in records}),
+        "span_s": round(span, 1),
+        "rate_per_s": round(len(records) / span, 2) if span else None,
+        "routes": dict(routes),
+        "words_p50": _percentile([record["words"] for record in records], 0.5),
+        "words_p95": _percentile([record["words"] for record in records], 0.95),
+        "upstream_calls": len(calls),
+        "upstream_failures": sum(not call["ok"] for record in records for call in record["calls"]),
+        "upstream_p50_ms": _percentile(calls, 0.5),
+        "upstream_p95_ms": _percentile(calls, 0.95),
+    }
+
+
+def synthesize(index, record):
+    """A message with the record's length in words that takes the record's route"""
+    route = record.get("route")
+    if route == "human":
+        return HUMAN_MESSAGE
+    if route == "local":
+        return LOCAL_MESSAGE
+    # The reference lets the upstream stand-in find the recorded calls of this turn
+    words = [FILLER[i % len(FILLER)] for i in range(max(4, record["words"] - 1))]
+    return " ".join(words + [f"ref-{index}"])
+
+
+class ReplayUpstream:
+    """
+    Upstream stand-in (mock_upstream.py) that answers each replayed LLM turn
+    after the recorded latency of its calls, failing the calls that failed.
+    """
+
+    def __init__(self, records, port=0, latency_scale=1.0):
+        from mock_upstream import MockUpstream
+
+        self.calls = {index: record["calls"] for index, record in enumerate(records)}
+        self.latency_scale = latency_scale
+        self._attempts = defaultdict(int)
+        self._lock = threading.Lock()
+        self.unplanned = 0
+        self.mock = MockUpstream(port=port)
+        self.mock.behaviour = self.behaviour
+        self.url = self.mock.url
+
+    def behaviour(self, body):
+        match = REF_PATTERN.search(body.get("message", ""))
+        calls = self.calls.get(int(match.group(1))) if match else None
+        if not calls:
+            # A turn the trace answered without the LLM reached it in this build
+            with self._lock:
+                self.unplanned += 1
+            return 0.0, 200
+        with self._lock:
+            attempt = self._attempts[int(match.group(1))]
+            self._attempts[int(match.group(1))] += 1
+        call = calls[min(attempt, len(calls) - 1)]
+        return call["ms"] / 1000 * self.latency_scale, 200 if call["ok"] else 503
+
+    def close(self):
+        self.mock.close()
+
+
+def replay(records, url, speed=1.0, max_conversations=256, timeout=60, post=None):
+    """
+    Re-drive records against url at speed times their recorded pace. Each
+    conversation's turns are sent in order, each no earlier than its time.
+    post(url, json=..., headers=..., timeout=...) defaults to a requests session per thread.
+    """
+    import requests
+
+    local = threading.local()
+    if post is None:
+        def post(target, **kwargs):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return local.session.post(target, **kwargs)
+
+    conversations = defaultdict(list)
+    for index, record in enumerate(records):
+        conversations[record["conversation"]].append((index, record))
+    run = os.urandom(3).hex()
+    first = records[0]["ts"] if records else 0
+    results = []
+    results_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def drive(turns):
+        for index, record in turns:
+            due = started + (record["ts"] - first) / speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            headers = {} if record.get("tenant", "default") == "default" else {"X-Tenant-ID": record["tenant"]}
+            body = {"message": synthesize(index, record), "conversation_id": f"replay-{run}-{record['conversation']}"}
+            sent = time.perf_counter()
+            try:
+                status = post(f"{url}/chat", json=body, headers=headers, timeout=timeout).status_code
+            except Exception:
+                status = None
+            done = time.perf_counter()
+            with results_lock:
+                results.append({"route": record.get("route"), "status": status, "lag_ms": (sent - due) * 1000,
+                                "ms": (done - sent) * 1000, "recorded_ms": record["total_ms"]})
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_conversations, len(conversations)))) as pool:
+        for future in [pool.submit(drive, turns) for turns in conversations.values()]:
+            future.result()
+    duration = time.perf_counter() - started
+    return _replay_report(records, results, speed, duration)
+
+
+def _replay_report(records, results, speed, duration):
+    by_route = {}
+    for route in sorted({result["route"] or "none" for result in results}):
+        chosen = [result for result in results if (result["route"] or "none") == route]
+        ok = [result["ms"] for result in chosen if result["status"] == 200]
+        by_route[route] = {"turns": len(chosen),
+                           "recorded_p50_ms": _percentile([result["recorded_ms"] for result in chosen], 0.5),
+                           "replayed_p50_ms": _percentile(ok, 0.5), "replayed_p95_ms": _percentile(ok, 0.95)}
+    statuses = defaultdict(int)
+    for result in results:
+        statuses[str(result["status"])] += 1
+    span = (records[-1]["ts"] - records[0]["ts"]) / speed if records else 0
+    return {
+        "turns": len(results),
+        "speed": speed,
+        "duration_s": round(duration, 2),
+        "offered_rps": round(len(records) / span, 1) if span else None,
+        "achieved_rps": round(len(results) / duration, 1) if duration else None,
+        "statuses": dict(statuses),
+        "errors": sum(result["status"] != 200 for result in results),
+        # How late turns went out: high values mean the replayer (or a slow conversation) held them back
+        "lag_p95_ms": _percentile([result["lag_ms"] for result in results], 0.95),
+        "routes": by_route,
+    }
+
+
+def _print(report, indent=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            _print(value, indent + "  ")
+        else:
+            print(f"{indent}{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize or replay a recorded traffic trace")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_command = commands.add_parser("summary", help="arrival rate, route mix and latencies of a trace")
+    summary_command.add_argument("trace")
+    upstream_command = commands.add_parser("upstream", help="only run the upstream stand-in for a trace")
+    upstream_command.add_argument("trace")
+    upstream_command.add_argument("--port", type=int, default=8081)
+    upstream_command.add_argument("--latency-scale", type=float, default=1.0)
+    replay_command = commands.add_parser("replay", help="re-drive a trace against a running build")
+    replay_command.add_argument("trace")
+    replay_command.add_argument("--url", default="http://localhost:8000")
+    replay_command.add_argument("--speed", type=float, default=1.0, help="10 sends the trace ten times as fast")
+    replay_command.add_argument("--upstream-port", type=int, default=None,
+                                help="also run the upstream stand-in on this port")
+    replay_command.add_argument("--latency-scale", type=float, default=1.0)
+    replay_command.add_argument("--max-conversations", type=int, default=256, help="conversations driven at once")
+    args = parser.parse_args()
+
+    trace = load(args.trace)
+    if args.command == "summary":
+        _print(summarize(trace))
+    elif args.command == "upstream":
+        stand_in = ReplayUpstream(trace, args.port, args.latency_scale)
+        print(f"Upstream stand-in for {len(trace)} turns on {stand_in.url}")
+        try:
+            stand_in.mock.thread.join()
+        except KeyboardInterrupt:
+            stand_in.close()
+    else:
+        stand_in = ReplayUpstream(trace, args.upstream_port, args.latency_scale) \
+            if args.upstream_port is not None else None
+        try:
+            report = replay(trace, args.url.rstrip("/"), args.speed, args.max_conversations)
+            if stand_in is not None:
+                report["unplanned_upstream_calls"] = stand_in.unplanned
+            _print(report)
+        finally:
+            if stand_in is not None:
+                stand_in.close()
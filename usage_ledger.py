@@ -0,0 +1,333 @@
+# usage_ledger.py
+# What the LLM calls cost. Each upstream call adds its input and output
+# tokens, its price (USAGE_PRICES) and its latency to running totals per
+# conversation, per tenant and per model tier, for each UTC day. Before a turn
+# goes upstream, the bot checks those totals against the daily budgets:
+#
+#   past USAGE_CONVERSATION_BUDGET / USAGE_TENANT_BUDGET tokens   fast tier only
+#   past USAGE_CONVERSATION_LIMIT / USAGE_TENANT_LIMIT tokens     USAGE_LIMIT_MESSAGE, no LLM call
+#
+# Tokens are what the provider billed, or an estimate from the text when a
+# response carries none (providers.fill_usage). The totals are split over
+# USAGE_STRIPES shards by key, each with its own lock, so turns of different
+# conversations rarely wait for each other.
+#
+# With USAGE_DB set, a thread adds each worker's changes since its last flush
+# to that SQLite file every USAGE_FLUSH_INTERVAL seconds. It then reads back
+# every tenant's totals for the day. A tenant's budget therefore counts all
+# the workers on the host (as of their last flush), and survives a restart.
+# Conversations stay on one worker, so their budgets use local totals only.
+#
+#   python usage_ledger.py report usage.db --day 2024-06-10   # tenants, tiers and top conversations
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from zlib import crc32
+
+import config
+
+logger = logging.getLogger("usage_ledger")
+
+# Fields of a total, in order
+FIELDS = ("calls", "failures", "input_tokens", "output_tokens", "cost", "ms")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    ms REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, scope, key)
+);
+"""
+
+UPSERT = """
+INSERT INTO usage (day, scope, key, calls, failures, input_tokens, output_tokens, cost, ms)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, scope, key) DO UPDATE SET
+    calls = calls + excluded.calls,
+    failures = failures + excluded.failures,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    cost = cost + excluded.cost,
+    ms = ms + excluded.ms
+"""
+
+
+def today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def parse_prices(spec):
+    """{tier: (input, output)} in USD per million tokens, from "fast=0.0375/0.15,strong=0.15/0.6" """
+    prices = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tier, _, rates = item.partition("=")
+        input_rate, _, output_rate = rates.partition("/")
+        prices[tier.strip()] = (float(input_rate), float(output_rate or input_rate))
+    return prices
+
+
+def _add(table, entry, values):
+    total = table.get(entry)
+    if total is None:
+        table[entry] = list(values)
+    else:
+        for i, value in enumerate(values):
+            total[i] += value
+
+
+def _over(tokens, cap):
+    return cap > 0 and tokens >= cap
+
+
+class _Stripe:
+    __slots__ = ("lock", "totals", "pending")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (day, scope, key) -> [calls, failures, input_tokens, output_tokens, cost, ms]
+        self.totals = {}
+        # The same, for what hasn't been flushed yet
+        self.pending = {}
+
+
+class UsageLedger:
+    """One worker's usage totals, the budgets checked against them, and their flushes to USAGE_DB"""
+
+    def __init__(self, path=None, stripes=None, prices=None, flush_interval=None):
+        self.path = config.USAGE_DB if path is None else path
+        self.prices = parse_prices(config.USAGE_PRICES) if prices is None else prices
+        self.flush_interval = config.USAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._stripes = [_Stripe() for _ in range(stripes or config.USAGE_STRIPES)]
+        # Tokens a day (0 = none); runtime_config.py can change them
+        self.conversation_budget = config.USAGE_CONVERSATION_BUDGET
+        self.conversation_limit = config.USAGE_CONVERSATION_LIMIT
+        self.tenant_budget = config.USAGE_TENANT_BUDGET
+        self.tenant_limit = config.USAGE_TENANT_LIMIT
+        # (day, tenant) -> tokens of the tenant's calls made by other workers (and before a restart)
+        self._others = {}
+        self._day = today()
+        self._flush_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'downgraded': 0, 'limited': 0, 'flushes': 0, 'flush_errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _stripe(self, key):
+        return self._stripes[crc32(key.encode()) % len(self._stripes)]
+
+    def cost(self, tier, input_tokens, output_tokens):
+        input_rate, output_rate = self.prices.get(tier, (0.0, 0.0))
+        return (input_tokens * input_rate + output_tokens * output_rate) / 1_000_000
+
+    def record(self, conversation_key, tenant_id, tier, input_tokens=0, output_tokens=0, ms=0.0, failed=False):
+        """Add one upstream call to today's totals of its conversation, tenant and tier (None keys are skipped)"""
+        values = (1, int(failed), input_tokens, output_tokens, self.cost(tier, input_tokens, output_tokens), ms)
+        day = today()
+        if day != self._day:
+            self._roll(day)
+        for scope, key in (("conversation", conversation_key), ("tenant", tenant_id), ("tier", tier)):
+            if key is None:
+                continue
+            stripe = self._stripe(key)
+            entry = (day, scope, key)
+            with stripe.lock:
+                _add(stripe.totals, entry, values)
+                if self.path:
+                    _add(stripe.pending, entry, values)
+
+    def _roll(self, day):
+        # A new day: earlier totals are kept only until they are flushed
+        with self._flush_lock:
+            if day == self._day:
+                return
+            self._day = day
+            for stripe in self._stripes:
+                with stripe.lock:
+                    for entry in [entry for entry in stripe.totals if entry[0] != day]:
+                        del stripe.totals[entry]
+
+    def usage(self, scope, key, day=None):
+        """This worker's totals for one conversation, tenant or tier on day (today)"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            total = stripe.totals.get((day or today(), scope, key))
+            return dict(zip(FIELDS, total or (0,) * len(FIELDS)))
+
+    def tokens(self, scope, key, day=None):
+        """Input plus output tokens on day (today), a tenant's including the other workers'"""
+        day = day or today()
+        stripe = self._stripe(key)
+        with stripe.lock:
+            total = stripe.totals.get((day, scope, key))
+            tokens = total[2] + total[3] if total else 0
+        if scope == "tenant":
+            tokens += self._others.get((day, key), 0)
+        return tokens
+
+    def check(self, conversation_key, tenant_id):
+        """
+        How a turn starting now may use the LLM: "ok", "budget" (past a
+        budget: fast tier only) or "limit" (past a limit: no call at all)
+        """
+        if not (self.conversation_budget or self.conversation_limit or self.tenant_budget or self.tenant_limit):
+            return "ok"
+        day = today()
+        conversation = self.tokens("conversation", conversation_key, day)
+        tenant = self.tokens("tenant", tenant_id, day)
+        if _over(conversation, self.conversation_limit) or _over(tenant, self.tenant_limit):
+            state = "limit"
+        elif _over(conversation, self.conversation_budget) or _over(tenant, self.tenant_budget):
+            state = "budget"
+        else:
+            return "ok"
+        with self._stats_lock:
+            self.stats['limited' if state == "limit" else 'downgraded'] += 1
+        return state
+
+    def _conn(self):
+        # One connection per process (never used across a fork), used under _flush_lock
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def flush(self):
+        """Add the changes since the last flush to USAGE_DB and read back the tenants' totals"""
+        if not self.path:
+            return
+        with self._flush_lock:
+            day = today()
+            changes = {}
+            for stripe in self._stripes:
+                with stripe.lock:
+                    changes.update(stripe.pending)
+                    stripe.pending = {}
+            try:
+                db = self._conn()
+                with db:
+                    db.executemany(UPSERT, [entry + tuple(total) for entry, total in changes.items()])
+                rows = db.execute("SELECT key, input_tokens + output_tokens FROM usage"
+                                  " WHERE day = ? AND scope = 'tenant'", (day,)).fetchall()
+            except sqlite3.Error as e:
+                # Keep the changes for the next flush
+                for entry, total in changes.items():
+                    stripe = self._stripe(entry[2])
+                    with stripe.lock:
+                        _add(stripe.pending, entry, total)
+                with self._stats_lock:
+                    self.stats['flush_errors'] += 1
+                logger.warning(f"Usage totals not flushed to {self.path}: {e!r}")
+                return
+            others = {}
+            for tenant_id, tokens in rows:
+                stripe = self._stripe(tenant_id)
+                with stripe.lock:
+                    total = stripe.totals.get((day, "tenant", tenant_id))
+                    own = total[2] + total[3] if total else 0
+                others[(day, tenant_id)] = max(0, tokens - own)
+            self._others = others
+            with self._stats_lock:
+                self.stats['flushes'] += 1
+
+    def start(self):
+        """Flush every flush_interval seconds on a background thread (if there is a store)"""
+        if self.path and self._thread is None:
+            self.flush()
+            self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and flush what is left"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def report(self, day=None, top=10):
+        """Totals by tenant and tier and the top conversations by tokens: all workers' with a store, else this one's"""
+        day = day or today()
+        if self.path:
+            self.flush()
+            with self._flush_lock:
+                rows = read_day(self._conn(), day)
+        else:
+            rows = []
+            for stripe in self._stripes:
+                with stripe.lock:
+                    rows += [(scope, key, dict(zip(FIELDS, total)))
+                             for (entry_day, scope, key), total in stripe.totals.items() if entry_day == day]
+        report = summarize(day, rows, top)
+        report["budgets"] = {"conversation_budget": self.conversation_budget,
+                             "conversation_limit": self.conversation_limit,
+                             "tenant_budget": self.tenant_budget, "tenant_limit": self.tenant_limit}
+        with self._stats_lock:
+            report["stats"] = dict(self.stats)
+        return report
+
+
+def read_day(db, day):
+    """(scope, key, totals) rows of one day in a usage store"""
+    rows = db.execute(f"SELECT scope, key, {', '.join(FIELDS)} FROM usage WHERE day = ?", (day,)).fetchall()
+    return [(row[0], row[1], dict(zip(FIELDS, row[2:]))) for row in rows]
+
+
+def summarize(day, rows, top=10):
+    def rounded(totals):
+        return dict(totals, cost=round(totals["cost"], 6), ms=round(totals["ms"], 1))
+
+    by_scope = {"conversation": [], "tenant": [], "tier": []}
+    for scope, key, totals in rows:
+        by_scope[scope].append((key, totals))
+    conversations = sorted(by_scope["conversation"],
+                           key=lambda item: -(item[1]["input_tokens"] + item[1]["output_tokens"]))
+    return {
+        "day": day,
+        "cost": round(sum(totals["cost"] for _, totals in by_scope["tier"]), 6),
+        "tenants": {key: rounded(totals) for key, totals in sorted(by_scope["tenant"])},
+        "tiers": {key: rounded(totals) for key, totals in sorted(by_scope["tier"])},
+        "conversations": len(conversations),
+        "top_conversations": [dict(rounded(totals), conversation=key) for key, totals in conversations[:top]],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a usage store (USAGE_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_command = commands.add_parser("report", help="one day's totals by tenant and tier, and top conversations")
+    report_command.add_argument("path")
+    report_command.add_argument("--day", default=None, help="YYYY-MM-DD (UTC); today if left out")
+    report_command.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.path) as store:
+        result = summarize(args.day or today(), read_day(store, args.day or today()), args.top)
+    print(f"{result['day']}: ${result['cost']:.4f} over {result['conversations']} conversations")
+    for title, section in (("tenant", result["tenants"]), ("tier", result["tiers"])):
+        for key, totals in section.items():
+            print(f"  {title:6} {key:24} {totals['calls']:>7} calls {totals['input_tokens']:>10} in "
+                  f"{totals['output_tokens']:>9} out  ${totals['cost']:.4f}")
+    for totals in result["top_conversations"]:
+        print(f"  top    {totals['conversation']:24} {totals['calls']:>7} calls {totals['input_tokens']:>10} in "
+              f"{totals['output_tokens']:>9} out  ${totals['cost']:.4f}")
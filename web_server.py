@@ -1,34 +1,26 @@
-from flask import Flask, request, jsonify, render_template_string
-from flask_cors import CORS
-import json
+# web_server.py
+# Web UI for the customer support bot: the one-page website with the embedded
+# chat widget, plus the routes only the website uses. Served by the single
+# application in api.py.
+
 import logging
 import time
-from bot import CustomerSupportBot
-
-# Set up logging for web server
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("web_server.log")]
-)
-logger = logging.getLogger("web_server")
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
 
-# Initialize the bot
-try:
-    bot = CustomerSupportBot()
-    logger.info("Bot initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize bot: {e}")
-    bot = None
+from bot import try_get_bot
+import channel_inbox
+import idempotency
+from serialization import FastJSONResponse
+from tenants import UnknownTenant
 
+logger = logging.getLogger("web_server")
 
-@app.route('/')
-def index():
-    """Serve the integrated one-page website with AI chat"""
-    html_content = '''<!DOCTYPE html>
+router = APIRouter()
+
+# The integrated one-page website with AI chat (served at / to browsers)
+INDEX_HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -696,7 +688,8 @@ def index():
     <script>
         let chatOpen = false;
         let isTyping = false;
-        let conversationId = 'web_' + Date.now();
+        // Replaced by the server-issued id once the WebSocket session starts
+        let conversationId = 'web_' + (window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now());
 
         // Initialize
         document.addEventListener('DOMContentLoaded', function() {
@@ -730,6 +723,7 @@ def index():
                 chatWindow.style.display = 'block';
                 chatButton.classList.add('active');
                 chatOpen = true;
+                connectSocket();
                 setTimeout(() => {
                     document.getElementById('chatInput').focus();
                 }, 300);
@@ -742,6 +736,131 @@ def index():
             }
         }
 
+        // WebSocket channel: one persistent connection per chat session.
+        // Falls back to POST /chat whenever the socket isn't open.
+        let socket = null;
+        let socketReady = false;
+        let sessionToken = null;
+        let lastSeq = 0;
+        let reconnectDelay = 1000;
+        let socketTypingId = null;
+        let streamingDiv = null;
+        let pendingTimer = null;
+
+        function connectSocket() {
+            if (socket || !('WebSocket' in window)) return;
+
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            // Reconnects present the session token; the first connect gets one in hello
+            const query = sessionToken
+                ? `?conversation_id=${encodeURIComponent(conversationId)}&token=${encodeURIComponent(sessionToken)}`
+                : '';
+            socket = new WebSocket(`${scheme}://${location.host}/ws${query}`);
+
+            socket.onopen = () => {
+                socketReady = true;
+                reconnectDelay = 1000;
+                updateChatStatus(true);
+            };
+            socket.onmessage = (e) => handleSocketEvent(JSON.parse(e.data));
+            socket.onclose = (e) => {
+                socketReady = false;
+                socket = null;
+                // Session expired or was refused: start a fresh one next time
+                if (e.code === 4403) {
+                    sessionToken = null;
+                    lastSeq = 0;
+                }
+                // Reconnect with backoff; the hello event tells us what to resume
+                setTimeout(connectSocket, reconnectDelay);
+                reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+            };
+        }
+
+        function handleSocketEvent(event) {
+            if (event.seq) {
+                if (event.seq <= lastSeq) return;
+                lastSeq = event.seq;
+            }
+
+            switch (event.type) {
+                case 'hello':
+                    conversationId = event.conversation_id;
+                    sessionToken = event.token;
+                    if (event.last_seq > lastSeq) {
+                        socket.send(JSON.stringify({type: 'resume', last_seq: lastSeq}));
+                    }
+                    break;
+                case 'ping':
+                    socket.send(JSON.stringify({type: 'pong'}));
+                    break;
+                case 'typing':
+                    if (event.state && !socketTypingId && !streamingDiv) {
+                        socketTypingId = addTypingIndicator();
+                    } else if (!event.state && socketTypingId) {
+                        removeTypingIndicator(socketTypingId);
+                        socketTypingId = null;
+                    }
+                    break;
+                case 'token':
+                    appendBotToken(event.text);
+                    break;
+                case 'done':
+                    finishBotMessage(event.text);
+                    break;
+                case 'agent':
+                    addMessage('bot', event.text, event.agent || 'Support Agent');
+                    break;
+                case 'status':
+                    // Overloaded or rate limited: the message was not taken
+                    if (event.state === 'busy') {
+                        addMessage('bot', event.message);
+                        finishSending();
+                    }
+                    break;
+            }
+        }
+
+        function appendBotToken(text) {
+            if (socketTypingId) {
+                removeTypingIndicator(socketTypingId);
+                socketTypingId = null;
+            }
+            if (!streamingDiv) {
+                streamingDiv = addMessage('bot', '');
+            }
+            streamingDiv.querySelector('.message-text').textContent += text;
+            const chatBody = document.getElementById('chatBody');
+            chatBody.scrollTop = chatBody.scrollHeight;
+        }
+
+        function finishBotMessage(text) {
+            if (socketTypingId) {
+                removeTypingIndicator(socketTypingId);
+                socketTypingId = null;
+            }
+            // The final text is the cleaned-up version of what was streamed
+            if (streamingDiv) {
+                streamingDiv.querySelector('.message-text').textContent = text;
+                streamingDiv = null;
+            } else {
+                addMessage('bot', text);
+            }
+            updateChatStatus(true);
+            finishSending();
+        }
+
+        function finishSending() {
+            const input = document.getElementById('chatInput');
+            const sendButton = document.getElementById('sendButton');
+
+            clearTimeout(pendingTimer);
+            isTyping = false;
+            sendButton.disabled = false;
+            sendButton.textContent = 'Send';
+            input.focus();
+        }
+
         async function sendMessage() {
             const input = document.getElementById('chatInput');
             const sendButton = document.getElementById('sendButton');
@@ -756,6 +875,16 @@ def index():
             addMessage('user', message);
             input.value = '';
 
+            if (socketReady) {
+                socket.send(JSON.stringify({type: 'message', text: message}));
+                // The reply arrives as token/done events; don't lock the input forever
+                pendingTimer = setTimeout(() => {
+                    addMessage('bot', 'Sorry, this is taking longer than expected. Please try again.');
+                    finishSending();
+                }, 60000);
+                return;
+            }
+
             const typingId = addTypingIndicator();
 
             try {
@@ -768,7 +897,10 @@ def index():
                     })
                 });
 
-                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                // Busy/rate-limited answers carry a message for the customer
+                if (!response.ok && response.status !== 429 && response.status !== 503) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
 
                 const data = await response.json();
                 removeTypingIndicator(typingId);
@@ -787,10 +919,7 @@ def index():
                 updateChatStatus(false);
             }
 
-            isTyping = false;
-            sendButton.disabled = false;
-            sendButton.textContent = 'Send';
-            input.focus();
+            finishSending();
         }
 
         function sendQuickMessage(message) {
@@ -798,16 +927,17 @@ def index():
             sendMessage();
         }
 
-        function addMessage(sender, text) {
+        function addMessage(sender, text, label) {
             const chatBody = document.getElementById('chatBody');
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${sender}`;
 
-            const label = sender === 'user' ? 'You' : 'AI Assistant';
-            messageDiv.innerHTML = `<strong>${label}:</strong> ${escapeHtml(text)}`;
+            label = label || (sender === 'user' ? 'You' : 'AI Assistant');
+            messageDiv.innerHTML = `<strong>${escapeHtml(label)}:</strong> <span class="message-text">${escapeHtml(text)}</span>`;
 
             chatBody.appendChild(messageDiv);
             chatBody.scrollTop = chatBody.scrollHeight;
+            return messageDiv;
         }
 
         function addTypingIndicator() {
@@ -848,6 +978,8 @@ def index():
         }
 
         async function checkBotHealth() {
+            // An open socket already carries heartbeats, no need to poll
+            if (socketReady) return;
             try {
                 const response = await fetch('/health');
                 const data = await response.json();
@@ -905,182 +1037,95 @@ def index():
     </script>
 </body>
 </html>'''
-    return render_template_string(html_content)
-
-
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Handle chat requests from the web interface"""
-    try:
-        if not bot:
-            return jsonify({
-                'success': False,
-                'error': 'AI assistant is not available. Please try again later.'
-            }), 503
-
-        data = request.get_json()
-
-        if not data or 'message' not in data:
-            return jsonify({
-                'success': False,
-                'error': 'Invalid request format'
-            }), 400
-
-        message = data.get('message', '').strip()
-        conversation_id = data.get('conversation_id', 'default')
 
-        if not message:
-            return jsonify({
-                'success': False,
-                'error': 'Message cannot be empty'
-            }), 400
-
-        # Log the chat request
-        logger.info(f"Chat request - ID: {conversation_id}, Message: {message[:50]}...")
 
-        # Get response from bot (without typing indicator for web)
-        response = bot.chat(message, conversation_id, show_typing=False)
+def unknown_tenant_response():
+    return FastJSONResponse({
+        "success": False,
+        "error": "Unknown tenant"
+    }, status_code=404)
 
-        return jsonify({
-            'success': True,
-            'response': response,
-            'conversation_id': conversation_id
-        })
 
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': 'Internal server error. Please try again.'
-        }), 500
-
-
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint for the chatbot"""
+@router.post('/clear/{conversation_id}')
+async def clear_conversation(conversation_id: str, request: Request):
+    """Clear conversation history (in the request's tenant)"""
     try:
+        bot = try_get_bot()
         if not bot:
-            return jsonify({
-                'healthy': False,
-                'message': 'AI assistant not initialized'
-            }), 503
-
-            # Quick health check
-        is_healthy, message = bot.health_check()
-        return jsonify({
-            'healthy': is_healthy,
-            'message': message
-        })
-
-    except Exception as e:
-        logger.error(f"Health check error: {str(e)}")
-        return jsonify({
-            'healthy': False,
-            'message': 'Health check failed'
-        }), 500
-
-    @app.route('/clear/<conversation_id>', methods=['POST'])
-    def clear_conversation(conversation_id):
-        """Clear conversation history"""
-    try:
-        if not bot:
-            return jsonify({
+            return FastJSONResponse({
                 'success': False,
                 'error': 'AI assistant not available'
-            }), 503
+            }, status_code=503)
 
-        bot.clear_conversation(conversation_id)
+        try:
+            tenant = bot.tenants.resolve(request)
+        except UnknownTenant:
+            return unknown_tenant_response()
+        await run_in_threadpool(bot.clear_conversation, conversation_id, tenant)
         logger.info(f"Conversation cleared: {conversation_id}")
 
-        return jsonify({
+        return {
             'success': True,
             'message': 'Conversation cleared successfully'
-        })
+        }
 
     except Exception as e:
         logger.error(f"Error clearing conversation {conversation_id}: {str(e)}")
-        return jsonify({
+        return FastJSONResponse({
             'success': False,
             'error': 'Failed to clear conversation'
-        }), 500
+        }, status_code=500)
 
-@app.route('/api/status', methods=['GET'])
-def api_status():
+
+@router.get('/api/status')
+async def api_status():
     """API status endpoint"""
     try:
-        return jsonify({
+        bot = try_get_bot()
+        status = {
             'status': 'online',
             'service': 'Mshauri Tech AI Assistant',
             'version': '1.0.0',
             'timestamp': time.time(),
-            'bot_available': bot is not None
-        })
+            'bot_available': bot is not None,
+            'idempotency': idempotency.chat_idempotency.report()
+        }
+        if bot is not None:
+            status['models'] = bot.model_router.report()
+            status['cancellations'] = dict(bot.cancellations)
+            status['usage'] = dict(bot.usage_ledger.stats)
+            status['tenants'] = len(bot.tenants)
+            if bot.answer_pack is not None:
+                status['answer_pack'] = bot.answer_pack.report()
+            if bot.config_reloader is not None:
+                status['runtime_config'] = bot.config_reloader.report()
+            if bot.remote_conversations is not None:
+                status['remote_conversations'] = bot.remote_conversations.report()
+        inbox = channel_inbox.get_inbox()
+        if inbox is not None:
+            status['inbox'] = await run_in_threadpool(inbox.report)
+        # Only if already trained: the intent_router property would train it here, on the event loop
+        router = bot._intent_router if bot is not None else None
+        if router is not None:
+            status['intent_router'] = router.report()
+        return status
     except Exception as e:
         logger.error(f"Status check error: {str(e)}")
-        return jsonify({
+        return FastJSONResponse({
             'status': 'error',
             'message': str(e)
-        }), 500
-
-@app.errorhandler(404)
-def not_found(error):
-    """Handle 404 errors"""
-    return jsonify({
-        'error': 'Endpoint not found',
-        'status': 404
-    }), 404
-
-@app.errorhandler(500)
-def internal_error(error):
-    """Handle 500 errors"""
-    logger.error(f"Internal server error: {str(error)}")
-    return jsonify({
-        'error': 'Internal server error',
-        'status': 500
-    }), 500
-
-@app.errorhandler(503)
-def service_unavailable(error):
-    """Handle 503 errors"""
-    return jsonify({
-        'error': 'Service temporarily unavailable',
-        'status': 503
-    }), 503
-
-    # Add CORS headers for all responses
-@app.after_request
-def after_request(response):
-    """Add security headers and CORS"""
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    return response
+        }, status_code=500)
+
 
 if __name__ == '__main__':
-    if bot:
-        print("🚀 Starting Mshauri Tech AI-Powered Website...")
-        print("🌐 Open your browser and go to: http://localhost:8000")
-        print("💬 Integrated AI chat assistant is ready!")
-        print("📊 Health check available at: http://localhost:8000/health")
-        print("⚡ Press Ctrl+C to stop the server")
-        print("-" * 60)
+    import uvicorn
 
-        try:
-            app.run(
-                host='0.0.0.0',
-                port=8000,
-                debug=False,
-                threaded=True
-            )
-        except KeyboardInterrupt:
-            print("\n👋 Server stopped by user")
-        except Exception as e:
-            logger.error(f"Server error: {str(e)}")
-            print(f"❌ Server error: {str(e)}")
-    else:
-        print("❌ Cannot start server: AI assistant initialization failed")
-        print("🔧 Please check your bot configuration and try again.")
-        print("📋 Check the web_server.log file for detailed error information.")
\ No newline at end of file
+    print("🚀 Starting Mshauri Tech AI-Powered Website...")
+    print("🌐 Open your browser and go to: http://localhost:8000")
+    print("💬 Integrated AI chat assistant is ready!")
+    print("📊 Health check available at: http://localhost:8000/health")
+    print("⚡ Press Ctrl+C to stop the server")
+    print("-" * 60)
+
+    # The website, JSON API and operational endpoints are one app (api.py)
+    uvicorn.run("api:app", host="0.0.0.0", port=8000)